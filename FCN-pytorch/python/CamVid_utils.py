@@ -4,11 +4,12 @@ from __future__ import print_function
 
 from matplotlib import pyplot as plt
 import matplotlib.image as mpimg
-import numpy as np
 import scipy.misc
 import random
 import os
 
+from label_utils import ColorLUT, parse_files
+
 
 #############################
     # global variables #
@@ -70,7 +71,7 @@ def divide_train_val(val_rate=0.1, shuffle=True, random_seed=None):
         t.write("{},{}\n".format(img_name, lab_name))
 
 
-def parse_label():
+def parse_label(num_workers=None):
     # change label to class index
     f = open(label_colors_file, "r").read().split("\n")[:-1]  # ignore the last empty line
     for idx, line in enumerate(f):
@@ -87,29 +88,17 @@ def parse_label():
         # rgb[..., 2] = color[2]
         # imshow(rgb, title=label)
     
+    lut = ColorLUT(dict((color, label2index[label]) for color, label in color2label.items()), void_index=0)
+
+    tasks = []
     for idx, name in enumerate(os.listdir(label_dir)):
         filename = os.path.join(label_idx_dir, name)
         if os.path.exists(filename + '.npy'):
             print("Skip %s" % (name))
             continue
-        print("Parse %s" % (name))
-        img = os.path.join(label_dir, name)
-        img = scipy.misc.imread(img, mode='RGB')
-        height, weight, _ = img.shape
-    
-        idx_mat = np.zeros((height, weight))
-        for h in range(height):
-            for w in range(weight):
-                color = tuple(img[h, w])
-                try:
-                    label = color2label[color]
-                    index = label2index[label]
-                    idx_mat[h, w] = index
-                except:
-                    print("error: img:%s, h:%d, w:%d" % (name, h, w))
-        idx_mat = idx_mat.astype(np.uint8)
-        np.save(filename, idx_mat)
-        print("Finish %s" % (name))
+        tasks.append((os.path.join(label_dir, name), filename))
+    print("Parse %d images" % (len(tasks)))
+    parse_files(tasks, lut, num_workers, warn_unknown=True)
 
     # test some pixels' label    
     img = os.path.join(label_dir, os.listdir(label_dir)[0])
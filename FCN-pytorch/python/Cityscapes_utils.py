@@ -5,11 +5,11 @@ from __future__ import print_function
 from collections import namedtuple
 from matplotlib import pyplot as plt
 import matplotlib.image as mpimg
-import numpy as np
-import scipy.misc
 import random
 import os
 
+from label_utils import ColorLUT, parse_files
+
 
 #############################
     # global variables #
@@ -86,7 +86,7 @@ labels = [
 ]
 
 
-def parse_label():
+def parse_label(num_workers=None):
     # change label to class index
     color2index[(0,0,0)] = 0  # add an void class 
     for obj in labels:
@@ -96,8 +96,11 @@ def parse_label():
         label = obj.name
         color = obj.color
         color2index[color] = idx
+    # no index, assign to void
+    lut = ColorLUT(color2index, void_index=19)
 
     # parse train, val, test data    
+    tasks = []
     for label_dir, index_dir, csv_file in zip([train_dir, val_dir, test_dir], [train_idx_dir, val_idx_dir, test_idx_dir], [train_file, val_file, test_file]):
         f = open(csv_file, "w")
         f.write("img,label\n")
@@ -118,24 +121,12 @@ def parse_label():
                 if os.path.exists(lab_name + '.npy'):
                     print("Skip %s" % (filename))
                     continue
-                print("Parse %s" % (filename))
-                img = os.path.join(city_dir, filename)
-                img = scipy.misc.imread(img, mode='RGB')
-                height, weight, _ = img.shape
-        
-                idx_mat = np.zeros((height, weight))
-                for h in range(height):
-                    for w in range(weight):
-                        color = tuple(img[h, w])
-                        try:
-                            index = color2index[color]
-                            idx_mat[h, w] = index
-                        except:
-                            # no index, assign to void
-                            idx_mat[h, w] = 19
-                idx_mat = idx_mat.astype(np.uint8)
-                np.save(lab_name, idx_mat)
-                print("Finish %s" % (filename))
+                tasks.append((os.path.join(city_dir, filename), lab_name))
+        f.close()
+
+    # convert the images of all cities with a pool of processes
+    print("Parse %d images" % (len(tasks)))
+    parse_files(tasks, lut, num_workers)
 
 
 '''debug function'''
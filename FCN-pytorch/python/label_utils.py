@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import scipy.misc
+
+
+color_lut = None  # lookup tables of the worker processes
+
+
+class ColorLUT(object):
+    '''maps 24-bit RGB keys to class indices, unknown colors to void_index'''
+
+    UNKNOWN = 255  # table entry of colors without a class, class indices must be smaller
+
+    def __init__(self, color2index, void_index):
+        assert all(index < self.UNKNOWN for index in color2index.values())
+        self.void_index = void_index
+        self.table = np.full(1 << 24, self.UNKNOWN, dtype=np.uint8)
+        for color, index in color2index.items():
+            self.table[color_key(color)] = index
+
+    def __call__(self, img):
+        # convert a (H, W, 3) RGB label image to a (H, W) uint8 index map,
+        # also return the number of pixels with an unknown color
+        idx_mat = self.table[color_keys(img)]
+        unknown = idx_mat == self.UNKNOWN
+        idx_mat[unknown] = self.void_index
+        return idx_mat, int(np.count_nonzero(unknown))
+
+
+def color_key(color):
+    return (int(color[0]) << 16) | (int(color[1]) << 8) | int(color[2])
+
+
+def color_keys(img):
+    # pack the RGB channels into a single 24-bit key per pixel
+    img = img.astype(np.uint32)
+    return (img[..., 0] << 16) | (img[..., 1] << 8) | img[..., 2]
+
+
+def init_worker(lut):
+    global color_lut
+    color_lut = lut
+
+
+def parse_file(task):
+    img_name, idx_name = task
+    img = scipy.misc.imread(img_name, mode='RGB')
+    idx_mat, n_unknown = color_lut(img)
+    np.save(idx_name, idx_mat)
+    return img_name, n_unknown
+
+
+def parse_files(tasks, lut, num_workers=None, warn_unknown=False):
+    '''convert (color image, index file) pairs to uint8 .npy index maps with a pool of processes'''
+    if len(tasks) == 0:
+        return
+    num_workers = min(num_workers or cpu_count(), len(tasks))
+    if num_workers <= 1:
+        init_worker(lut)
+        results = map(parse_file, tasks)
+    else:
+        pool    = Pool(num_workers, initializer=init_worker, initargs=(lut,))
+        results = pool.imap_unordered(parse_file, tasks, chunksize=4)
+    try:
+        for img_name, n_unknown in results:
+            if warn_unknown and n_unknown > 0:
+                print("error: img:%s, %d pixels with unknown color" % (img_name, n_unknown))
+            print("Finish %s" % (img_name))
+    finally:
+        if num_workers > 1:
+            pool.close()
+            pool.join()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+#
+# Benchmark for loading polygon annotations with helpers/annotation.py
+#
+# Loads all gtFine polygon files of a split three times: with the json module
+# and Point lists (the former default), with orjson (if installed) and Point
+# lists, and with orjson and compact numpy polygons. Reports the loading time
+# and the memory held by the loaded annotations, and checks that all variants
+# yield identical polygons and identical output of Annotation.toJson.
+#
+# Usage: python benchAnnotationLoading.py [split]
+#
+# The dataset is searched in CITYSCAPES_DATASET, the split defaults to "val".
+# Without a dataset, a synthetic split of the size of gtFine/val is generated.
+# orjson is installed with the "fast" extra: pip install cityscapesscripts[fast]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# Cityscapes imports
+from cityscapesscripts.helpers import annotation as csAnnotation
+from cityscapesscripts.helpers.labels import labels as csLabels
+
+
+def createDataset(folder, split, nbImages=500, seed=0):
+    # polygons with a log-normal number of vertices, as in the gtFine annotations
+    rng = np.random.RandomState(seed)
+    names = [label.name for label in csLabels if label.id >= 0]
+    splitFolder = os.path.join(folder, "gtFine", split, "city")
+    os.makedirs(splitFolder)
+    for i in range(nbImages):
+        objects = []
+        for _ in range(rng.randint(20, 100)):
+            nbPoints = min(int(rng.lognormal(3.2, 0.8)) + 3, 300)
+            cx, cy, r = rng.uniform(0, 2048), rng.uniform(0, 1024), rng.uniform(5, 300)
+            angles = np.sort(rng.uniform(0, 2 * np.pi, nbPoints))
+            polygon = [[int(cx + r * np.cos(a)), int(cy + r * np.sin(a))] for a in angles]
+            objects.append({"label": names[rng.randint(len(names))], "polygon": polygon})
+        name = "city_{:06d}_000019_gtFine_polygons.json".format(i)
+        with open(os.path.join(splitFolder, name), "w") as f:
+            json.dump({"imgHeight": 1024, "imgWidth": 2048, "objects": objects}, f, indent=4)
+
+
+def loadAll(files, compact):
+    annotations = []
+    for f in files:
+        annotation = csAnnotation.Annotation(compact=compact)
+        annotation.fromJsonFile(f)
+        annotations.append(annotation)
+    return annotations
+
+
+def measure(files, compact):
+    # tracing slows down loading, the time is measured in a separate run
+    tracemalloc.start()
+    annotations = loadAll(files, compact)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.time()
+    loadAll(files, compact)
+    duration = time.time() - start
+    return annotations, duration, memory
+
+
+def run(files):
+    orjson = csAnnotation.orjson
+    csAnnotation.orjson = None
+    reference, duration, memory = measure(files, False)
+    csAnnotation.orjson = orjson
+    print("json,   point lists:    {:8.2f}s {:8.1f} MB".format(duration, memory / 1e6))
+
+    variants = [(False, "point lists:   "), (True, "compact arrays:")]
+    if orjson is None:
+        print("orjson is not installed, using the json module")
+    for compact, name in variants:
+        annotations, duration, memory = measure(files, compact)
+        print("{} {} {:8.2f}s {:8.1f} MB".format("orjson," if orjson else "json,  ", name,
+                                                 duration, memory / 1e6))
+        for a, b in zip(reference, annotations):
+            assert [o.points.tolist() for o in a.objects] == [o.points.tolist() for o in b.objects]
+            assert a.toJson() == b.toJson()
+        # legacy access creates the same points
+        for a, b in zip(reference[:50], annotations[:50]):
+            assert [o.polygon for o in a.objects] == [o.polygon for o in b.objects]
+
+
+def main(argv):
+    split = argv[0] if len(argv) > 0 else "val"
+    if 'CITYSCAPES_DATASET' in os.environ:
+        cityscapesPath = os.environ['CITYSCAPES_DATASET']
+    else:
+        cityscapesPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
+    files = sorted(glob.glob(os.path.join(cityscapesPath, "gtFine", split, "*", "*_gt*_polygons.json")))
+    folder = None
+    if not files:
+        print("Did not find any polygon files in {}, using a synthetic split".format(
+            os.path.join(cityscapesPath, "gtFine", split)))
+        folder = tempfile.mkdtemp()
+        createDataset(folder, split)
+        files = sorted(glob.glob(os.path.join(folder, "gtFine", split, "*", "*_gt*_polygons.json")))
+    print("{} polygon files in gtFine/{}".format(len(files), split))
+    try:
+        run(files)
+    finally:
+        if folder is not None:
+            shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# Benchmark for the batched projection Box3dImageTransform.project_boxes in
+# helpers/box3dImageTransform.py
+#
+# Compares it to calling initialize_box and get_amodal_box_2d for every box
+# on random boxes around the camera, including boxes that are partially or
+# completely behind it. The amodal boxes and vertices of both are checked to
+# be identical up to floating point rounding.
+#
+# Usage: python benchBox3dTransform.py [nbBoxes] [nbRuns]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import sys
+import timeit
+
+import numpy as np
+from pyquaternion import Quaternion
+
+# Cityscapes imports
+from cityscapesscripts.helpers.box3dImageTransform import (
+    Box3dImageTransform,
+    Camera
+)
+
+
+SENSOR_T_ISO_8855 = [[0.9990, 0.0, 0.0436, -1.70], [0.0, 1.0, 0.0, -0.10], [-0.0436, 0.0, 0.9990, -1.22]]
+
+
+def projectLoop(box3dTransform, sizes, quaternions, centers):
+    amodalBoxes = []
+    vertices = []
+    vertices2d = []
+    for size, quaternion, center in zip(sizes, quaternions, centers):
+        box3dTransform.initialize_box(size, quaternion, center)
+        amodalBoxes.append(box3dTransform.get_amodal_box_2d())
+        vertices.append(list(box3dTransform.get_vertices().values()))
+        vertices2d.append(list(box3dTransform.get_vertices_2d().values()))
+    return np.array(amodalBoxes), np.array(vertices), np.array(vertices2d)
+
+
+def main():
+    nbBoxes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    nbRuns = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    rng = np.random.RandomState(0)
+    camera = Camera(2262.52, 2265.30, 1096.98, 513.14, SENSOR_T_ISO_8855)
+    box3dTransform = Box3dImageTransform(camera)
+
+    # most boxes are in front of the camera, some are next to or behind it
+    centers = np.stack([rng.uniform(-10, 90, nbBoxes), rng.uniform(-20, 20, nbBoxes), rng.uniform(0, 2, nbBoxes)], axis=1)
+    sizes = np.stack([rng.uniform(1.5, 6., nbBoxes), rng.uniform(0.6, 2.5, nbBoxes), rng.uniform(1.2, 3., nbBoxes)], axis=1)
+    quaternions = np.array([Quaternion(axis=[0, 0, 1], angle=yaw).elements for yaw in rng.uniform(-np.pi, np.pi, nbBoxes)])
+
+    loop = projectLoop(box3dTransform, sizes, quaternions, centers)
+    batch = box3dTransform.project_boxes(sizes, quaternions, centers)
+    for name, old, new in zip(["amodal boxes", "vertices", "2d vertices"], loop, batch):
+        finite = np.isfinite(old)
+        if not (np.array_equal(finite, np.isfinite(new)) and np.allclose(old[finite], new[finite], rtol=1e-9, atol=1e-6)):
+            raise RuntimeError("The {} of the loop and the batch differ".format(name))
+
+    loopTime = timeit.timeit(lambda: projectLoop(box3dTransform, sizes, quaternions, centers), number=nbRuns) / nbRuns
+    batchTime = timeit.timeit(lambda: box3dTransform.project_boxes(sizes, quaternions, centers), number=nbRuns) / nbRuns
+    print("{} boxes: loop {:8.2f} ms, batch {:8.2f} ms (speedup {:.1f}x)".format(
+        nbBoxes, 1000. * loopTime, 1000. * batchTime, loopTime / batchTime))
+
+
+if __name__ == "__main__":
+    main()
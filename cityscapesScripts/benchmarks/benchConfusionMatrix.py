@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Benchmark for the confusion matrix kernels used in
+# evaluation/evalPixelLevelSemanticLabeling.py
+#
+# Compares the numpy bincount kernel to the cython extension (if built)
+# and to the former np.unique based fallback on random 2048x1024 images.
+#
+# Usage: python benchConfusionMatrix.py [nbImages]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import sys
+import timeit
+
+import numpy as np
+
+# Cityscapes imports
+from cityscapesscripts.evaluation import evalPixelLevelSemanticLabeling as evalPixel
+
+
+# The np.unique based fallback that was used before the bincount kernel
+def addToConfusionMatrixUnique(predictionNp, groundTruthNp, confMatrix, args):
+    encoding_value = max(groundTruthNp.max(), predictionNp.max()).astype(np.int32) + 1
+    encoded = (groundTruthNp.astype(np.int32) * encoding_value) + predictionNp
+
+    values, cnt = np.unique(encoded, return_counts=True)
+
+    for value, c in zip(values, cnt):
+        pred_id = value % encoding_value
+        gt_id = int((value - pred_id)/encoding_value)
+        if not gt_id in args.evalLabels:
+            evalPixel.printError("Unknown label with id {:}".format(gt_id))
+        confMatrix[gt_id][pred_id] += c
+    return confMatrix
+
+
+def addToConfusionMatrixCython(predictionNp, groundTruthNp, confMatrix, args):
+    return evalPixel.addToConfusionMatrix.cEvaluatePair(predictionNp, groundTruthNp, confMatrix, args.evalLabels)
+
+
+def main():
+    nbImages = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    args = evalPixel.args
+    evalPixel.generateMatrix(args)
+    rng = np.random.RandomState(0)
+    images = []
+    for _ in range(nbImages):
+        groundTruthNp = rng.randint(0, max(args.evalLabels) + 1, size=(1024, 2048)).astype(np.uint8)
+        predictionNp = np.where(rng.rand(1024, 2048) < 0.8, groundTruthNp, rng.randint(0, 19, size=(1024, 2048))).astype(np.uint8)
+        images.append((predictionNp, groundTruthNp))
+
+    kernels = [("np.unique", addToConfusionMatrixUnique),
+               ("bincount", evalPixel.addToConfusionMatrixNumpy)]
+    if evalPixel.CSUPPORT:
+        kernels.append(("cython", addToConfusionMatrixCython))
+    else:
+        print("Cython extension not built, skipping cython kernel")
+
+    reference = None
+    for name, kernel in kernels:
+        confMatrix = evalPixel.generateMatrix(args)
+
+        def run():
+            for predictionNp, groundTruthNp in images:
+                kernel(predictionNp, groundTruthNp, confMatrix, args)
+
+        seconds = timeit.timeit(run, number=1)
+        if reference is None:
+            reference = confMatrix
+        elif not np.array_equal(reference, confMatrix):
+            evalPixel.printError("Kernel {} disagrees with the np.unique kernel".format(name))
+        print("{:<10}: {:8.2f} ms per image".format(name, 1000. * seconds / nbImages))
+
+
+if __name__ == "__main__":
+    main()
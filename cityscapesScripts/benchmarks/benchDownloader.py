@@ -0,0 +1,187 @@
+#!/usr/bin/python
+#
+# Benchmark for the range-chunked downloader in download/downloader.py
+#
+# Serves fake packages of random bytes from a local stand-in for the
+# cityscapes server and downloads them once in a single stream per package
+# and once over concurrent range requests. A parallel download is then
+# interrupted by the server and resumed from its manifest. The content of
+# all downloaded files is checked against the served packages.
+#
+# Usage: python benchDownloader.py [packageSizeMiB] [nbPackages] [nbConnections]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Cityscapes imports
+from cityscapesscripts.download import downloader
+
+
+class FakeServer(object):
+    """Local stand-in for the package listing, md5 sums and file handling"""
+
+    def __init__(self, packages, delay=0.0):
+        self.packages = packages
+        self.md5sums = {name: hashlib.md5(data).hexdigest() for name, data in packages.items()}
+        self.delay = delay
+        # number of range requests to answer before failing all further ones
+        self.failAfter = None
+        self.nbRanges = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.send_response(302)
+                self.send_header('Location', '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.baseUrl = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reply(self, handler, status, body, headers=None):
+        handler.send_response(status)
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def handle(self, handler):
+        url = urlparse(handler.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        names = sorted(self.packages)
+        if url.path == '/login':
+            self.reply(handler, 200, b'')
+        elif url.path == '/downloads/':
+            listing = [{'name': name, 'packageID': i, 'size': '{} B'.format(len(self.packages[name]))}
+                       for i, name in enumerate(names)]
+            self.reply(handler, 200, json.dumps(listing).encode())
+        elif url.path == '/md5-sum/':
+            name = names[int(query['packageID'][0])]
+            self.reply(handler, 200, '{}  {}\n'.format(self.md5sums[name], name).encode())
+        elif url.path == '/file-handling/':
+            data = self.packages[names[int(query['packageID'][0])]]
+            match = re.match(r'bytes=(\d+)-(\d*)', handler.headers.get('Range', ''))
+            if not match:
+                time.sleep(self.delay)
+                self.reply(handler, 200, data)
+                return
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else len(data)
+            end = min(end, len(data))
+            if end - start > 1:
+                with self.lock:
+                    self.nbRanges += 1
+                    failed = self.failAfter is not None and self.nbRanges > self.failAfter
+                if failed:
+                    self.reply(handler, 503, b'')
+                    return
+                time.sleep(self.delay)
+            self.reply(handler, 206, data[start:end], {
+                'Content-Range': 'bytes {}-{}/{}'.format(start, end - 1, len(data))})
+        else:
+            self.reply(handler, 404, b'')
+
+
+def download(server, names, destination, **kwargs):
+    session = requests.Session()
+    start = time.time()
+    downloader.download_packages(session=session, package_names=names,
+                                 destination_path=destination,
+                                 base_url=server.baseUrl, **kwargs)
+    return time.time() - start
+
+
+def checkFiles(server, destination):
+    for name, data in server.packages.items():
+        with open(os.path.join(destination, name), 'rb') as f:
+            assert f.read() == data, "content of {} differs".format(name)
+        assert not os.path.exists(os.path.join(destination, name + ".manifest.json"))
+
+
+def main(argv):
+    sizeMiB = int(argv[0]) if len(argv) > 0 else 64
+    nbPackages = int(argv[1]) if len(argv) > 1 else 3
+    nbConnections = int(argv[2]) if len(argv) > 2 else 4
+    chunkSize = 4 * 1024 * 1024
+
+    packages = {"package{}.zip".format(i): os.urandom(sizeMiB * 1024 * 1024)
+                for i in range(nbPackages)}
+    # a small per-range latency to mimic a remote server
+    server = FakeServer(packages, delay=0.05)
+    names = sorted(packages)
+    tmpDir = tempfile.mkdtemp()
+    try:
+        sequential = os.path.join(tmpDir, "sequential")
+        os.mkdir(sequential)
+        t = download(server, names, sequential, num_connections=1)
+        checkFiles(server, sequential)
+        print("single stream:       {:6.2f}s".format(t))
+
+        parallel = os.path.join(tmpDir, "parallel")
+        os.mkdir(parallel)
+        t = download(server, names, parallel, num_connections=nbConnections,
+                     chunk_size=chunkSize)
+        checkFiles(server, parallel)
+        print("{:2d} connections:      {:6.2f}s".format(nbConnections, t))
+
+        resumed = os.path.join(tmpDir, "resumed")
+        os.mkdir(resumed)
+        nbRanges = server.nbRanges
+        server.failAfter = nbRanges + nbPackages * sizeMiB * 1024 * 1024 // chunkSize // 2
+        try:
+            download(server, names, resumed, num_connections=nbConnections,
+                     chunk_size=chunkSize)
+            raise AssertionError("download was not interrupted")
+        except requests.HTTPError:
+            pass
+        server.failAfter = None
+        before = server.nbRanges
+        t = download(server, names, resumed, num_connections=nbConnections,
+                     chunk_size=chunkSize, resume=True)
+        checkFiles(server, resumed)
+        totalRanges = nbPackages * (-(-sizeMiB * 1024 * 1024 // chunkSize))
+        fetched = server.nbRanges - before
+        assert fetched < totalRanges, "resume fetched all {} ranges again".format(totalRanges)
+        print("resumed:             {:6.2f}s ({} of {} ranges fetched after resume)".format(
+            t, fetched, totalRanges))
+    finally:
+        server.close()
+        shutil.rmtree(tmpDir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
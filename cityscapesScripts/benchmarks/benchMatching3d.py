@@ -0,0 +1,94 @@
+#!/usr/bin/python
+#
+# Micro-benchmark for the greedy matching Box3dEvaluator._getMatches in
+# evaluation/evalObjectDetection3d.py
+#
+# Compares the sorted greedy matcher to the former implementation, which
+# repeatedly searched the max of the whole IoU matrix, on random 1000x1000
+# IoU matrices of 2D boxes. The matches of both are checked to be identical.
+#
+# Usage: python benchMatching3d.py [size] [nbRuns]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import sys
+import timeit
+
+import numpy as np
+
+# Cityscapes imports
+from cityscapesscripts.evaluation.objectDetectionHelpers import (
+    EvaluationParameters,
+    calcIouMatrix
+)
+from cityscapesscripts.evaluation.evalObjectDetection3d import Box3dEvaluator
+
+
+# The former matcher that was used before the sorted greedy matcher
+def getMatchesMax(iou_matrix, min_iou_to_match, matchIgnores=False):
+    matched_gts = []
+    matched_preds = []
+    matched_ious = []
+
+    if iou_matrix.shape[0] == 0 or iou_matrix.shape[1] == 0:
+        return [], [], []
+
+    tmp_iou_max = np.max(iou_matrix)
+
+    while tmp_iou_max > min_iou_to_match:
+        tmp_row, tmp_col = np.where(iou_matrix == tmp_iou_max)
+
+        used_row = tmp_row[0]
+        used_col = tmp_col[0]
+
+        matched_gts.append(used_row)
+        matched_preds.append(used_col)
+        matched_ious.append(np.max(iou_matrix))
+
+        if matchIgnores is False:
+            iou_matrix[used_row, ...] = 0.0
+
+        iou_matrix[..., used_col] = 0.0
+
+        tmp_iou_max = np.max(iou_matrix)
+
+    return (matched_gts, matched_preds, matched_ious)
+
+
+def randomBoxes(rng, size):
+    xy = rng.uniform(0, 2000, size=(size, 2))
+    wh = rng.uniform(20, 200, size=(size, 2))
+    return np.concatenate([xy, xy + wh], axis=1)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nbRuns = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    rng = np.random.RandomState(0)
+    gts = randomBoxes(rng, size)
+    # predictions are disturbed GT boxes plus some duplicates
+    preds = gts + rng.normal(0, 5, size=gts.shape)
+    preds[::10] = preds[1::10][:len(preds[::10])]
+    iou_matrix = calcIouMatrix(gts, preds)
+    # overlap like values for ignore matching
+    overlap_matrix = np.round(rng.rand(20, size), 1)
+
+    evaluator = Box3dEvaluator(EvaluationParameters(["car"]))
+    min_iou = evaluator.eval_params.min_iou_to_match
+
+    for name, matrix, matchIgnores in [("iou", iou_matrix, False), ("ignores", overlap_matrix, True)]:
+        new = evaluator._getMatches(matrix.copy(), matchIgnores=matchIgnores)
+        old = getMatchesMax(matrix.copy(), min_iou, matchIgnores=matchIgnores)
+        if [list(map(int, x)) for x in old[:2]] != [list(x) for x in new[:2]] or list(map(float, old[2])) != new[2]:
+            raise RuntimeError("Matches of the {} matrix differ".format(name))
+
+        oldTime = timeit.timeit(lambda: getMatchesMax(matrix.copy(), min_iou, matchIgnores=matchIgnores), number=nbRuns) / nbRuns
+        newTime = timeit.timeit(lambda: evaluator._getMatches(matrix.copy(), matchIgnores=matchIgnores), number=nbRuns) / nbRuns
+        print("{:<8} {}x{}, {} matches: max search {:8.2f} ms, sorted greedy {:8.2f} ms".format(
+            name, matrix.shape[0], matrix.shape[1], len(new[0]), 1000. * oldTime, 1000. * newTime))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+#
+# Benchmark for the 3D object detection evaluation in
+# evaluation/evalObjectDetection3d.py
+#
+# Creates a synthetic set of GT and prediction files in a temporary folder
+# and evaluates it with a single and with several worker processes.
+# Then the time to load the GT is compared with and without the GT cache.
+# The results of all runs are checked to be identical.
+#
+# Usage: python benchObjectDetection3d.py [nbImages] [nbWorkers]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import os
+import sys
+import json
+import time
+import logging
+import shutil
+import tempfile
+
+import numpy as np
+from pyquaternion import Quaternion
+
+# Cityscapes imports
+from cityscapesscripts.helpers.annotation import CsBbox3d
+from cityscapesscripts.helpers.box3dImageTransform import (
+    Box3dImageTransform,
+    Camera
+)
+from cityscapesscripts.evaluation.objectDetectionHelpers import EvaluationParameters
+from cityscapesscripts.evaluation.evalObjectDetection3d import Box3dEvaluator
+
+
+LABELS = ["car", "truck", "bus", "train", "motorcycle", "bicycle"]
+SENSOR = {
+    "fx": 2262.52,
+    "fy": 2265.30,
+    "u0": 1096.98,
+    "v0": 513.14,
+    "sensor_T_ISO_8855": [[0.9990, 0.0, 0.0436, -1.70], [0.0, 1.0, 0.0, -0.10], [-0.0436, 0.0, 0.9990, -1.22]]
+}
+
+
+def createBox(label, center, dims, yaw, score, box3dTransform):
+    rotation = list(Quaternion(axis=[0, 0, 1], angle=yaw).elements)
+    box = CsBbox3d()
+    box.fromJsonText({
+        "2d": {"amodal": [0, 0, 0, 0]},
+        "3d": {"center": center, "dimensions": dims, "rotation": rotation},
+        "label": label,
+        "score": score
+    })
+    box3dTransform.initialize_box_from_annotation(box)
+    xmin, ymin, xmax, ymax = box3dTransform.get_amodal_box_2d()
+    amodal = [xmin, ymin, xmax - xmin, ymax - ymin]
+    return {
+        "2d": {"amodal": amodal, "modal": amodal},
+        "3d": {"center": center, "dimensions": dims, "rotation": rotation},
+        "label": label,
+        "score": score
+    }
+
+
+def createDataset(folder, nbImages, nbBoxes=20, seed=0):
+    rng = np.random.RandomState(seed)
+    camera = Camera(SENSOR["fx"], SENSOR["fy"], SENSOR["u0"], SENSOR["v0"], SENSOR["sensor_T_ISO_8855"])
+    box3dTransform = Box3dImageTransform(camera)
+    gtFolder = os.path.join(folder, "gt")
+    predFolder = os.path.join(folder, "pred")
+    os.makedirs(gtFolder)
+    os.makedirs(predFolder)
+
+    for i in range(nbImages):
+        gts = []
+        preds = []
+        for _ in range(nbBoxes):
+            label = LABELS[rng.randint(len(LABELS))]
+            center = [float(rng.uniform(5, 90)), float(rng.uniform(-15, 15)), 0.8]
+            dims = [float(rng.uniform(1.5, 6.)), float(rng.uniform(0.6, 2.5)), float(rng.uniform(1.2, 3.))]
+            yaw = float(rng.uniform(-np.pi, np.pi))
+            gts.append(createBox(label, center, dims, yaw, 1.0, box3dTransform))
+
+            # most GT boxes get a slightly disturbed prediction
+            if rng.rand() < 0.8:
+                predCenter = [c + float(rng.normal(0, 0.3)) for c in center]
+                predDims = [d * float(rng.uniform(0.9, 1.1)) for d in dims]
+                predYaw = yaw + float(rng.normal(0, 0.1))
+                preds.append(createBox(label, predCenter, predDims, predYaw, float(rng.rand()), box3dTransform))
+            # and there are some false positives
+            if rng.rand() < 0.3:
+                fpCenter = [float(rng.uniform(5, 90)), float(rng.uniform(-15, 15)), 0.8]
+                preds.append(createBox(label, fpCenter, dims, yaw, float(rng.rand()), box3dTransform))
+
+        ignores = [{"2d": [float(rng.uniform(0, 1800)), float(rng.uniform(0, 800)), 200., 150.]}]
+        base = "city_{:06d}_000019".format(i)
+        with open(os.path.join(gtFolder, base + "_gtBbox3d.json"), "w") as f:
+            json.dump({"objects": gts, "ignore": ignores, "sensor": SENSOR}, f)
+        with open(os.path.join(predFolder, base + "_pred.json"), "w") as f:
+            json.dump({"objects": preds}, f)
+
+    return gtFolder, predFolder
+
+
+def runEvaluation(gtFolder, predFolder, numWorkers, gtCacheDir=None):
+    evaluator = Box3dEvaluator(EvaluationParameters(LABELS), num_workers=numWorkers, gt_cache_dir=gtCacheDir)
+    evaluator.loadGT(gtFolder)
+    evaluator.loadPredictions(predFolder)
+    start = time.time()
+    evaluator.evaluate()
+    return time.time() - start, json.dumps(evaluator.results)
+
+
+def timeLoadGT(gtFolder, gtCacheDir):
+    evaluator = Box3dEvaluator(EvaluationParameters(LABELS), gt_cache_dir=gtCacheDir)
+    start = time.time()
+    evaluator.loadGT(gtFolder)
+    return time.time() - start
+
+
+def main():
+    logging.getLogger('EvalObjectDetection3d').setLevel(logging.WARNING)
+    nbImages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    nbWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    folder = tempfile.mkdtemp()
+    try:
+        gtFolder, predFolder = createDataset(folder, nbImages)
+
+        serialTime, serialResults = runEvaluation(gtFolder, predFolder, 1)
+        parallelTime, parallelResults = runEvaluation(gtFolder, predFolder, nbWorkers)
+        if serialResults != parallelResults:
+            raise RuntimeError("Results of serial and parallel evaluation differ")
+
+        print("{} images, 1 worker : {:8.2f}s".format(nbImages, serialTime))
+        print("{} images, {} workers: {:8.2f}s (speedup {:.2f}x)".format(nbImages, nbWorkers, parallelTime, serialTime / parallelTime))
+
+        cacheDir = os.path.join(folder, "cache")
+        parseTime = timeLoadGT(gtFolder, None)
+        coldTime = timeLoadGT(gtFolder, cacheDir)
+        warmTime = timeLoadGT(gtFolder, cacheDir)
+        _, cachedResults = runEvaluation(gtFolder, predFolder, 1, cacheDir)
+        if serialResults != cachedResults:
+            raise RuntimeError("Results with and without GT cache differ")
+
+        print("load GT, no cache   : {:8.2f}s".format(parseTime))
+        print("load GT, cold cache : {:8.2f}s".format(coldTime))
+        print("load GT, warm cache : {:8.2f}s (speedup {:.2f}x)".format(warmTime, parseTime / warmTime))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+#
+# Benchmark for the DDTP metrics in Box3dEvaluator._calcTpStats in
+# evaluation/evalObjectDetection3d.py
+#
+# Compares the vectorized metrics and depth binning to the former
+# implementation, which converted every quaternion with pyquaternion and
+# appended the values of each box to lists per depth bin, on random pairs
+# of TP boxes. The mean values and counts per depth bin are checked to be
+# identical up to floating point rounding.
+#
+# Usage: python benchTpStats.py [nbBoxes]
+#
+
+# python imports
+from __future__ import print_function, absolute_import, division
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+from pyquaternion import Quaternion
+
+# Cityscapes imports
+from cityscapesscripts.evaluation.objectDetectionHelpers import (
+    EvaluationParameters,
+    Box3dArrays
+)
+from cityscapesscripts.evaluation.evalObjectDetection3d import Box3dEvaluator
+
+
+# The former metrics, that appended the values of each box to lists per depth bin
+def tpStatsLists(gt_boxes, pred_boxes, max_depth, step_size, depth_bins):
+    data = OrderedDict((x, OrderedDict((d, []) for d in depth_bins))
+                       for x in ["Center_Dist", "Size_Similarity", "OS_Yaw", "OS_Pitch_Roll"])
+
+    gt_dists = np.sqrt(gt_boxes.centers[..., 0]**2 + gt_boxes.centers[..., 1]**2).astype(int)
+    center_dists = gt_boxes.centers - pred_boxes.centers
+    center_dists = np.sqrt(center_dists[..., 0]**2 + center_dists[..., 1]**2)
+    size_similarities = np.prod(np.minimum(
+        gt_boxes.dims / pred_boxes.dims, pred_boxes.dims / gt_boxes.dims), axis=1)
+    gt_vals = np.asarray([Quaternion(x).yaw_pitch_roll for x in gt_boxes.rotations])
+    pred_vals = np.asarray([Quaternion(x).yaw_pitch_roll for x in pred_boxes.rotations])
+    os_yaws = (1. + np.cos(gt_vals[..., 0] - pred_vals[..., 0])) / 2.
+    os_pitch_rolls = 0.5 + (np.cos(gt_vals[..., 1] - pred_vals[..., 1]) +
+                            np.cos(gt_vals[..., 2] - pred_vals[..., 2])) / 4.
+
+    for i, gt_dist in enumerate(gt_dists):
+        if gt_dist >= max_depth:
+            continue
+        gt_dist = int(gt_dist / step_size) * step_size
+        data["Center_Dist"][gt_dist].append(1. - min(center_dists[i] / float(max_depth), 1.))
+        data["Size_Similarity"][gt_dist].append(size_similarities[i])
+        data["OS_Yaw"][gt_dist].append(os_yaws[i])
+        data["OS_Pitch_Roll"][gt_dist].append(os_pitch_rolls[i])
+
+    return OrderedDict(
+        (name, OrderedDict((d, (sum(v) / float(len(v)), len(v))) for d, v in values.items() if v))
+        for name, values in data.items())
+
+
+def randomBoxes(rng, nbBoxes):
+    centers = np.stack([rng.uniform(0, 120, nbBoxes), rng.uniform(-20, 20, nbBoxes), rng.uniform(0, 2, nbBoxes)], axis=1)
+    dims = rng.uniform(0.5, 6., size=(nbBoxes, 3))
+    rotations = rng.normal(size=(nbBoxes, 4))
+    rotations /= np.linalg.norm(rotations, axis=1, keepdims=True)
+    return Box3dArrays(["car"] * nbBoxes, np.ones(nbBoxes), centers, dims, rotations,
+                       np.zeros((nbBoxes, 4)), np.zeros((nbBoxes, 4)))
+
+
+def main():
+    nbBoxes = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    rng = np.random.RandomState(0)
+    gt_boxes = randomBoxes(rng, nbBoxes)
+    pred_boxes = randomBoxes(rng, nbBoxes)
+    pred_boxes.centers = gt_boxes.centers + rng.normal(0, 0.5, size=(nbBoxes, 3))
+
+    evaluator = Box3dEvaluator(EvaluationParameters(["car"]))
+    max_depth = evaluator.eval_params.max_depth
+    step_size = evaluator.eval_params.step_size
+
+    start = time.time()
+    old = tpStatsLists(gt_boxes, pred_boxes, max_depth, step_size, evaluator._depth_bins)
+    oldTime = time.time() - start
+
+    start = time.time()
+    evaluator._stats["working_data"] = {"car": OrderedDict(
+        (x, (np.zeros(len(evaluator._depth_bins)), np.zeros(len(evaluator._depth_bins), dtype=np.int64)))
+        for x in old.keys())}
+    gt_dists = evaluator._calcCenterDistances("car", gt_boxes, pred_boxes)
+    evaluator._calcSizeSimilarities("car", gt_boxes, pred_boxes, gt_dists)
+    evaluator._calcOrientationSimilarities("car", gt_boxes, pred_boxes, gt_dists)
+    newTime = time.time() - start
+
+    for name, (sums, counts) in evaluator._stats["working_data"]["car"].items():
+        new = OrderedDict((d, (s / c, c)) for d, s, c in zip(evaluator._depth_bins, sums, counts) if c > 0)
+        if list(new.keys()) != list(old[name].keys()):
+            raise RuntimeError("The depth bins of {} differ".format(name))
+        for d, (mean, count) in new.items():
+            if count != old[name][d][1] or not np.isclose(mean, old[name][d][0], rtol=1e-12):
+                raise RuntimeError("The values of {} at depth {} differ".format(name, d))
+
+    print("{} TP boxes: lists {:8.2f}s, vectorized {:8.3f}s (speedup {:.0f}x)".format(
+        nbBoxes, oldTime, newTime, oldTime / newTime))
+
+
+if __name__ == "__main__":
+    main()
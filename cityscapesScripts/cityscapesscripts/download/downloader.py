@@ -9,13 +9,19 @@ import hashlib
 import json
 import os
 import requests
-import shutil
 import stat
+import threading
 
 from builtins import input
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+BASE_URL = "https://www.cityscapes-dataset.com"
+CHUNK_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+TIMEOUT = 60
 
-def login():
+
+def login(base_url=BASE_URL):
     appname = __name__.split('.')[0]
     appauthor = 'cityscapes'
     data_dir = appdirs.user_data_dir(appname, appauthor)
@@ -43,11 +49,11 @@ def login():
             os.chmod(credentials_file, stat.S_IREAD | stat.S_IWRITE)
 
     session = requests.Session()
-    r = session.get("https://www.cityscapes-dataset.com/login",
+    r = session.get(base_url + "/login",
                     allow_redirects=False)
     r.raise_for_status()
     credentials['submit'] = 'Login'
-    r = session.post("https://www.cityscapes-dataset.com/login",
+    r = session.post(base_url + "/login",
                      data=credentials, allow_redirects=False)
     r.raise_for_status()
 
@@ -60,15 +66,15 @@ def login():
     return session
 
 
-def get_available_packages(*, session):
+def get_available_packages(*, session, base_url=BASE_URL):
     r = session.get(
-        "https://www.cityscapes-dataset.com/downloads/?list", allow_redirects=False)
+        base_url + "/downloads/?list", allow_redirects=False)
     r.raise_for_status()
     return r.json()
 
 
-def list_available_packages(*, session):
-    packages = get_available_packages(session=session)
+def list_available_packages(*, session, base_url=BASE_URL):
+    packages = get_available_packages(session=session, base_url=base_url)
     print("The following packages are available for download.")
     print("Please refer to https://www.cityscapes-dataset.com/downloads/ "
           "for additional packages and instructions on properly citing third party packages.")
@@ -79,18 +85,189 @@ def list_available_packages(*, session):
         print(info)
 
 
-def download_packages(*, session, package_names, destination_path, resume=False):
+class PackageDownload(object):
+    """Download state of a single package
+
+    The file is split into byte ranges that are fetched independently. Completed
+    ranges are recorded in a manifest next to the file, such that an interrupted
+    download can be resumed. The MD5 sum is updated with every byte range that
+    extends the completed prefix of the file, so no separate pass over the
+    file is needed once the download is finished.
+    """
+
+    def __init__(self, local_filename, url, md5sum):
+        self.local_filename = local_filename
+        self.manifest_filename = local_filename + ".manifest.json"
+        self.url = url
+        self.md5sum = md5sum
+        self.size = None
+        self.done = {}
+        self.hash_md5 = hashlib.md5()
+        self.hashed = 0
+        self.lock = threading.Lock()
+
+    def load_manifest(self, size):
+        """Return the completed ranges of a previous download of the same file
+
+        Returns None if there is no manifest or it belongs to a different file.
+        """
+        if not os.path.isfile(self.manifest_filename):
+            return None
+        with open(self.manifest_filename, 'r') as f:
+            manifest = json.load(f)
+        if manifest['size'] != size or manifest['md5'] != self.md5sum:
+            return None
+        return {start: end for start, end in manifest['done']}
+
+    def save_manifest(self):
+        manifest = {
+            'size': self.size,
+            'md5': self.md5sum,
+            'done': sorted(self.done.items())
+        }
+        tmp_filename = self.manifest_filename + ".tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_filename, self.manifest_filename)
+
+    def prepare(self, size, chunk_size, resume):
+        """Allocate the file and return the byte ranges that still need to be fetched"""
+        self.size = size
+        self.done = {}
+        if resume:
+            done = self.load_manifest(size)
+            if done is not None:
+                self.done = done
+            elif os.path.isfile(self.manifest_filename):
+                print("Manifest of '{}' does not match, restarting download".format(
+                    self.local_filename))
+            elif os.path.isfile(self.local_filename):
+                # file of a previous sequential download, its content is a prefix
+                existing = min(os.path.getsize(self.local_filename), size)
+                if existing > 0:
+                    self.done = {0: existing}
+        if not self.done or not os.path.isfile(self.local_filename):
+            self.done = {}
+            with open(self.local_filename, 'wb'):
+                pass
+        os.truncate(self.local_filename, size)
+        self.save_manifest()
+        self.update_hash()
+
+        ranges = []
+        start = 0
+        for done_start, done_end in sorted(self.done.items()) + [(size, size)]:
+            for chunk_start in range(start, done_start, chunk_size):
+                ranges.append((chunk_start, min(chunk_start + chunk_size, done_start)))
+            start = max(start, done_end)
+        return ranges
+
+    def update_hash(self):
+        """Hash all completed bytes that directly follow the already hashed prefix"""
+        with open(self.local_filename, 'rb') as f:
+            while self.hashed in self.done:
+                end = self.done.pop(self.hashed)
+                f.seek(self.hashed)
+                while self.hashed < end:
+                    chunk = f.read(min(BUFFER_SIZE, end - self.hashed))
+                    if not chunk:
+                        raise Exception("Downloaded file '{}' is truncated.".format(
+                            self.local_filename))
+                    self.hash_md5.update(chunk)
+                    self.hashed += len(chunk)
+                # merge into a single completed range for the manifest
+                self.done[0] = self.hashed
+
+    def fetch_range(self, session, start, end):
+        """Download the bytes [start, end) into the file"""
+        headers = {'Range': 'bytes={}-{}'.format(start, end - 1)}
+        with session.get(self.url, allow_redirects=False, stream=True, headers=headers,
+                         timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise Exception("Server does not support range requests.")
+            with open(self.local_filename, 'r+b') as f:
+                f.seek(start)
+                position = start
+                for chunk in r.iter_content(BUFFER_SIZE):
+                    f.write(chunk)
+                    position += len(chunk)
+        if position != end:
+            raise Exception("Incomplete range {}-{} of '{}'.".format(
+                start, end - 1, self.local_filename))
+
+    def fetch_and_record_range(self, session, start, end):
+        """Download the bytes [start, end) and record them in the manifest"""
+        self.fetch_range(session, start, end)
+        self.range_done(start, end)
+
+    def range_done(self, start, end):
+        with self.lock:
+            self.done[start] = end
+            self.update_hash()
+            self.save_manifest()
+
+    def fetch_stream(self, session, resume):
+        """Download the whole file in a single stream, for servers without range support"""
+        offset = os.path.getsize(self.local_filename) if resume and os.path.isfile(self.local_filename) else 0
+        if offset and os.path.isfile(self.manifest_filename):
+            # the file was preallocated by a ranged download, only its prefix is complete
+            with open(self.manifest_filename, 'r') as f:
+                manifest = json.load(f)
+            offset = dict(manifest['done']).get(0, 0) if manifest['md5'] == self.md5sum else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        with session.get(self.url, allow_redirects=False, stream=True, headers=headers,
+                         timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            assert r.status_code in [200, 206]
+            if r.status_code == 200:
+                offset = 0
+            with open(self.local_filename, 'r+b' if offset else 'wb') as f:
+                if offset:
+                    self.done = {0: offset}
+                    self.update_hash()
+                    f.seek(offset)
+                for chunk in r.iter_content(BUFFER_SIZE):
+                    f.write(chunk)
+                    self.hash_md5.update(chunk)
+
+    def verify(self):
+        if self.md5sum != self.hash_md5.hexdigest():
+            # a resumed download must not trust any of the downloaded bytes
+            self.done = {}
+            self.save_manifest()
+            raise Exception("MD5 sum of downloaded file does not match.")
+        if os.path.isfile(self.manifest_filename):
+            os.remove(self.manifest_filename)
+
+
+def get_download_size(session, url):
+    """Return the size of the file behind url, or None if the server does not support ranges"""
+    with session.get(url, allow_redirects=False, stream=True, headers={'Range': 'bytes=0-0'},
+                     timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        content_range = r.headers.get('Content-Range', '')
+        if r.status_code != 206 or '/' not in content_range:
+            return None
+        size = content_range.rsplit('/', 1)[1]
+        return int(size) if size.isdigit() else None
+
+
+def download_packages(*, session, package_names, destination_path, resume=False,
+                      num_connections=4, chunk_size=CHUNK_SIZE, base_url=BASE_URL):
     if not os.path.isdir(destination_path):
         raise Exception(
             "Destination path '{}' does not exist.".format(destination_path))
 
-    packages = get_available_packages(session=session)
+    packages = get_available_packages(session=session, base_url=base_url)
     name_to_id = {p['name']: p['packageID'] for p in packages}
     invalid_names = [n for n in package_names if n not in name_to_id]
     if invalid_names:
         raise Exception(
             "These packages do not exist or you don't have access: {}".format(invalid_names))
 
+    # the byte ranges of all packages share one pool of connections
+    tasks = []
     for package_name in package_names:
         local_filename = os.path.join(destination_path, package_name)
         package_id = name_to_id[package_name]
@@ -106,31 +283,53 @@ def download_packages(*, session, package_names, destination_path, resume=False)
                     "Destination file '{}' already exists.".format(local_filename))
 
         # md5sum
-        url = "https://www.cityscapes-dataset.com/md5-sum/?packageID={}".format(
+        url = base_url + "/md5-sum/?packageID={}".format(
             package_id)
         r = session.get(url, allow_redirects=False)
         r.raise_for_status()
         md5sum = r.text.split()[0]
 
         # download in chunks, support resume
-        url = "https://www.cityscapes-dataset.com/file-handling/?packageID={}".format(
+        url = base_url + "/file-handling/?packageID={}".format(
             package_id)
-        with open(local_filename, 'ab' if resume else 'wb') as f:
-            resume_header = {
-                'Range': 'bytes={}-'.format(f.tell())} if resume else {}
-            with session.get(url, allow_redirects=False, stream=True, headers=resume_header) as r:
-                r.raise_for_status()
-                assert r.status_code in [200, 206]
-
-                shutil.copyfileobj(r.raw, f)
-
-        # verify md5sum
-        hash_md5 = hashlib.md5()
-        with open(local_filename, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        if md5sum != hash_md5.hexdigest():
-            raise Exception("MD5 sum of downloaded file does not match.")
+        download = PackageDownload(local_filename, url, md5sum)
+        size = get_download_size(session, url)
+        if size is None or num_connections <= 1:
+            download.fetch_stream(session, resume)
+            download.verify()
+            continue
+        ranges = download.prepare(size, chunk_size, resume)
+        if not ranges:
+            download.verify()
+            continue
+        tasks.append((download, ranges))
+
+    if not tasks:
+        return
+
+    # allow one pooled connection per worker
+    session.mount(base_url, requests.adapters.HTTPAdapter(pool_maxsize=num_connections))
+
+    remaining = {download: len(ranges) for download, ranges in tasks}
+    with ThreadPoolExecutor(max_workers=num_connections) as executor:
+        futures = {}
+        for download, ranges in tasks:
+            for start, end in ranges:
+                # ranges are recorded by the workers, such that all completed ranges
+                # survive a failure of another range
+                future = executor.submit(download.fetch_and_record_range, session, start, end)
+                futures[future] = download
+        try:
+            for future in as_completed(futures):
+                download = futures[future]
+                future.result()
+                remaining[download] -= 1
+                if remaining[download] == 0:
+                    download.verify()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
 
 def parse_arguments():
@@ -147,6 +346,15 @@ def parse_arguments():
     parser.add_argument('-r', '--resume', action='store_true',
                         help="resume previous download")
 
+    parser.add_argument('-j', '--num_connections', type=int, default=4,
+                        help="number of concurrent connections, 1 downloads each package in a single stream")
+
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE // (1024 * 1024),
+                        help="size in MiB of the byte ranges that are downloaded concurrently")
+
+    parser.add_argument('--base_url', default=BASE_URL,
+                        help=argparse.SUPPRESS)
+
     parser.add_argument('package_name', nargs='*',
                         help="name of the packages to download")
 
@@ -156,15 +364,18 @@ def parse_arguments():
 def main():
     args = parse_arguments()
 
-    session = login()
+    session = login(base_url=args.base_url)
 
     if args.list_available:
-        list_available_packages(session=session)
+        list_available_packages(session=session, base_url=args.base_url)
         return
 
     download_packages(session=session, package_names=args.package_name,
                       destination_path=args.destination_path,
-                      resume=args.resume)
+                      resume=args.resume,
+                      num_connections=args.num_connections,
+                      chunk_size=args.chunk_size * 1024 * 1024,
+                      base_url=args.base_url)
 
 
 if __name__ == "__main__":
@@ -28,16 +28,24 @@
 # - The field "confidencePrediction" is a float value that assigns a
 # confidence score to the mask.
 #
-# Note that this tool creates a file named "gtInstances.json" during its
-# first run. This file helps to speed up computation and should be deleted
-# whenever anything changes in the ground truth annotations or anything
-# goes wrong.
+# Note that this tool creates a file named "gtInstances.npz" during its
+# first run. This file caches the ground truth instances to speed up
+# computation. Ground truth images that are new or have changed since
+# (by modification time or size) are processed again and added to the cache.
+# Delete the file if anything goes wrong.
+# A JSON file of ground truth instances can be used instead, by setting
+# args.gtInstancesFile to a path ending with ".json". Such a file is only
+# created if it does not exist and never updated.
+#
+# The matching of predictions and ground truth can be distributed over
+# several cores, e.g.
+# csEvalInstanceLevelSemanticLabeling --workers 8
 
 # python imports
 from __future__ import print_function, absolute_import, division
 import os, sys
 import fnmatch
-from copy import deepcopy
+import multiprocessing
 
 # Cityscapes imports
 from cityscapesscripts.helpers.csHelpers import *
@@ -133,13 +141,15 @@ args.distanceThs        = np.array( [  float('inf') , 100 , 50 ] )
 # distance confidences
 args.distanceConfs      = np.array( [ -float('inf') , 0.5 , 0.5 ] )
 
-args.gtInstancesFile    = os.path.join(os.path.dirname(os.path.realpath(__file__)),'gtInstances.json')
+args.gtInstancesFile    = os.path.join(os.path.dirname(os.path.realpath(__file__)),'gtInstances.npz')
 args.distanceAvailable  = False
 args.JSONOutput         = True
 args.quiet              = False
 args.csv                = False
 args.colorized          = True
 args.instLabels         = []
+args.numWorkers         = 1
+args.workerChunkSize    = 4
 
 # store some parameters for finding predictions in the args variable
 # the values are filled when the method getPrediction is first called
@@ -189,18 +199,25 @@ def readGTImage(gtImageFileName,args):
 # either read or compute a dictionary of all ground truth instances
 def getGtInstances(groundTruthList,args):
     gtInstances = {}
-    # if there is a global statistics json, then load it
-    if (os.path.isfile(args.gtInstancesFile)):
-        if not args.quiet:
-            print("Loading ground truth instances from JSON.")
-        with open(args.gtInstancesFile) as json_file:
-            gtInstances = json.load(json_file)
-    # otherwise create it
+    # a JSON file of instances is only created once
+    if os.path.splitext(args.gtInstancesFile)[1] == ".json":
+        # if there is a global statistics json, then load it
+        if (os.path.isfile(args.gtInstancesFile)):
+            if not args.quiet:
+                print("Loading ground truth instances from JSON.")
+            with open(args.gtInstancesFile) as json_file:
+                gtInstances = json.load(json_file)
+        # otherwise create it
+        else:
+            if (not args.quiet):
+                print("Creating ground truth instances from png files.")
+            gtInstances = instances2dict(groundTruthList,not args.quiet)
+            writeDict2JSON(gtInstances, args.gtInstancesFile)
+    # otherwise the cache is updated with all new or changed files
     else:
         if (not args.quiet):
-            print("Creating ground truth instances from png files.")
-        gtInstances = instances2dict(groundTruthList,not args.quiet)
-        writeDict2JSON(gtInstances, args.gtInstancesFile)
+            print("Loading ground truth instances from cache and png files.")
+        gtInstances = instances2dict(groundTruthList,not args.quiet,args.gtInstancesFile)
 
     return gtInstances
 
@@ -219,37 +236,75 @@ def matchGtWithPreds(predictionList,groundTruthList,gtInstances,args):
     if not args.quiet:
         print("Matching {} pairs of images...".format(len(predictionList)))
 
-    count = 0
+    # the ground truth instances of each frame
+    imgTasks = []
     for (pred,gt) in zip(predictionList,groundTruthList):
-        # key for dicts
-        dictKey = os.path.abspath(gt)
-
-        # Read input files
-        gtImage  = readGTImage(gt,args)
-        predInfo = readPredInfo(pred,args)
-
-        # Get and filter ground truth instances
-        unfilteredInstances = gtInstances[ dictKey ]
-        curGtInstancesOrig  = filterGtInstances(unfilteredInstances,args)
+        imgTasks.append( (pred, gt, gtInstances[ os.path.abspath(gt) ]) )
 
-        # Try to assign all predictions
-        (curGtInstances,curPredInstances) = assignGt2Preds(curGtInstancesOrig, gtImage, predInfo, args)
-
-        # append to global dict
-        matches[ dictKey ] = {}
-        matches[ dictKey ]["groundTruth"] = curGtInstances
-        matches[ dictKey ]["prediction"]  = curPredInstances
+    if args.numWorkers > 1:
+        pool = multiprocessing.Pool(processes=args.numWorkers, initializer=initMatchingWorker, initargs=(args,))
+        imgMatches = pool.imap(matchGtWithPredsWorker, imgTasks, chunksize=args.workerChunkSize)
+    else:
+        pool = None
+        imgMatches = (matchGtWithPredsSingleImage(pred, gt, unfilteredInstances, args) for (pred, gt, unfilteredInstances) in imgTasks)
 
-        count += 1
-        if not args.quiet:
-            print("\rImages Processed: {}".format(count), end=' ')
-            sys.stdout.flush()
+    count = 0
+    try:
+        for (dictKey, curGtInstances, curPredInstances) in imgMatches:
+            # append to global dict
+            matches[ dictKey ] = {}
+            matches[ dictKey ]["groundTruth"] = curGtInstances
+            matches[ dictKey ]["prediction"]  = curPredInstances
+
+            count += 1
+            if not args.quiet:
+                print("\rImages Processed: {}".format(count), end=' ')
+                sys.stdout.flush()
+    except RuntimeError as e:
+        if pool is None:
+            raise
+        pool.terminate()
+        printError(e)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     if not args.quiet:
         print("")
 
     return matches
 
+# match ground truth instances with predicted instances of a single frame
+def matchGtWithPredsSingleImage(pred, gt, unfilteredInstances, args):
+    # key for dicts
+    dictKey = os.path.abspath(gt)
+
+    # Read input files
+    gtImage  = readGTImage(gt,args)
+    predInfo = readPredInfo(pred,args)
+
+    # Get and filter ground truth instances
+    curGtInstancesOrig  = filterGtInstances(unfilteredInstances,args)
+
+    # Try to assign all predictions
+    (curGtInstances,curPredInstances) = assignGt2Preds(curGtInstancesOrig, gtImage, predInfo, args)
+
+    return (dictKey, curGtInstances, curPredInstances)
+
+# Initialize the global arguments within a worker process.
+def initMatchingWorker(workerArgs):
+    global args
+    args = workerArgs
+
+# match a single frame within a worker process
+def matchGtWithPredsWorker(imgTask):
+    (pred, gt, unfilteredInstances) = imgTask
+    try:
+        return matchGtWithPredsSingleImage(pred, gt, unfilteredInstances, args)
+    except SystemExit:
+        # printError exits, which would leave the pool waiting forever
+        raise RuntimeError("Matching of {} failed".format(pred))
+
 # For a given frame, assign all predicted instances to ground truth instances
 def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
     # In this method, we create two lists
@@ -264,10 +319,14 @@ def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
 
     # We already know about the gt instances
     # Add the matching information array
-    gtInstances = deepcopy(gtInstancesOrig)
-    for label in gtInstances:
-        for gt in gtInstances[label]:
-            gt["matchedPred"] = []
+    # The instance dicts only hold plain values, so shallow copies suffice
+    gtInstances = {}
+    for label in gtInstancesOrig:
+        gtInstances[label] = []
+        for gt in gtInstancesOrig[label]:
+            gtCopy = gt.copy()
+            gtCopy["matchedPred"] = []
+            gtInstances[label].append(gtCopy)
 
     # Make the gt a numpy array
     gtNp = np.array(gtImage)
@@ -313,7 +372,11 @@ def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
         predInstance["pixelCount"]       = predPixelCount
         predInstance["confidence"]       = predConf
         # Determine the number of pixels overlapping void
-        predInstance["voidIntersection"] = np.count_nonzero( np.logical_and(boolVoid, boolPredInst) )
+        predInstance["voidIntersection"] = np.count_nonzero( boolVoid[boolPredInst] )
+
+        # The number of pixels overlapping each ground truth instance,
+        # computed once for all instances from the ids below the prediction
+        gtOverlaps = np.bincount( gtNp[boolPredInst] )
 
         # A list of all overlapping ground truth instances
         matchedGt = []
@@ -325,7 +388,9 @@ def assignGt2Preds(gtInstancesOrig, gtImage, predInfo, args):
         # However, for now we treat both the same and do the rest later
         for (gtNum,gtInstance) in enumerate(gtInstancesOrig[labelName]):
 
-            intersection = np.count_nonzero( np.logical_and( gtNp == gtInstance["instID"] , boolPredInst) )
+            intersection = 0
+            if gtInstance["instID"] < gtOverlaps.size:
+                intersection = int(gtOverlaps[gtInstance["instID"]])
 
             # If they intersect add them as matches to both dicts
             if (intersection > 0):
@@ -681,6 +746,17 @@ def main():
     global args
     argv = sys.argv[1:]
 
+    # the number of worker processes can be given as option
+    try:
+        opts, argv = getopt.gnu_getopt(argv, "j:", ["workers="])
+    except getopt.GetoptError as e:
+        printError(e)
+    for opt, val in opts:
+        if opt in ("-j", "--workers"):
+            if not val.isdigit() or int(val) < 1:
+                printError("Invalid number of workers: {}".format(val))
+            args.numWorkers = int(val)
+
     predictionImgList = []
     groundTruthImgList = []
 
@@ -703,7 +779,7 @@ def main():
 
     # print some info for user
     print("Note that this tool uses the file '{}' to cache the ground truth instances.".format(args.gtInstancesFile))
-    print("If anything goes wrong, or if you change the ground truth, please delete the file.")
+    print("If anything goes wrong, please delete the file.")
 
     # evaluate
     evaluateImgLists(predictionImgList, groundTruthImgList, args)
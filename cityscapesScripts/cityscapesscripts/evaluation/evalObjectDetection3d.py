@@ -38,28 +38,36 @@ import logging
 import numpy as np
 import json
 import os
+import glob
 import argparse
+import multiprocessing
 from typing import (
     List,
+    Optional,
     Tuple
 )
 
-from pyquaternion import Quaternion
 from tqdm import tqdm
 # keep compatibility for python2
 from collections import OrderedDict
 
 from cityscapesscripts.helpers.annotation import (
     CsBbox3d,
-    CsIgnore2d
+    CsIgnore2d,
+    loadJson
 )
 from cityscapesscripts.helpers.box3dImageTransform import (
     Box3dImageTransform,
-    Camera
+    Camera,
+    quaternions_to_yaw_pitch_roll
 )
 from cityscapesscripts.evaluation.objectDetectionHelpers import (
     EvaluationParameters,
+    Box3dArrays,
     getFiles,
+    getGtFingerprint,
+    loadGtCache,
+    saveGtCache,
     calcIouMatrix,
     calcOverlapMatrix
 )
@@ -90,23 +98,34 @@ class Box3dEvaluator:
     :type ap: dict
     :param results: evaluation results
     :type results: dict
+    :param num_workers: number of processes used to evaluate the images
+    :type num_workers: int
+    :param gt_cache_dir: directory of the GT cache files, no caching if None
+    :type gt_cache_dir: Optional[str]
     """
 
     def __init__(
         self,
-        evaluation_params       # type: EvaluationParameters
+        evaluation_params,      # type: EvaluationParameters
+        num_workers=1,          # type: int
+        gt_cache_dir=None       # type: Optional[str]
     ):
         # type: (...) -> None
 
         self.eval_params = evaluation_params
 
-        # dict containing the GTs per image
+        self.num_workers = num_workers
+
+        self.gt_cache_dir = gt_cache_dir
+
+        # dict containing the GTs per image, the boxes are stored as Box3dArrays
+        # and the ignore regions as array of [xmin, ymin, xmax, ymax]
         self.gts = {}
 
         # dict containing the Camera object per image
         self.cameras = {}
 
-        # dict containing the predictions per image
+        # dict containing the predictions per image as Box3dArrays
         self.preds = {}
 
         # dict containing information for AP per class
@@ -165,6 +184,11 @@ class Box3dEvaluator:
         # type: (...) -> None
         """Loads ground truth from the given folder.
 
+        If a GT cache directory is set, the GT is read from a cache file
+        keyed by the fingerprint of the GT files and the evaluated labels.
+        The cache file is created if it does not exist and replaces the
+        cache files of other GT sets in that directory.
+
         Args:
             gt_folder (str): Ground truth folder
         """
@@ -174,8 +198,42 @@ class Box3dEvaluator:
 
         logger.info("Found {} GT files.".format(len(gts)))
 
+        cache_file = None
+        if self.gt_cache_dir is not None:
+            fingerprint = getGtFingerprint(gts, self.eval_params.labels_to_evaluate)
+            cache_file = os.path.join(self.gt_cache_dir, "gtBbox3d_{}.npz".format(fingerprint))
+
+        if cache_file is not None and os.path.isfile(cache_file):
+            logger.info("Loading GT from cache {}.".format(cache_file))
+            self.gts, self.cameras = loadGtCache(cache_file)
+        else:
+            self._parseGT(gts)
+            if cache_file is not None:
+                try:
+                    os.makedirs(self.gt_cache_dir, exist_ok=True)
+                    saveGtCache(cache_file, self.gts, self.cameras)
+                    # keep only the cache of the current GT, such that the cache directory does not grow
+                    for old_cache_file in glob.glob(os.path.join(self.gt_cache_dir, "gtBbox3d_*.npz")):
+                        if os.path.abspath(old_cache_file) != os.path.abspath(cache_file):
+                            os.remove(old_cache_file)
+                except OSError as e:
+                    logger.warning("Could not write GT cache {}: {}".format(cache_file, e))
+
         self._stats["GT_stats"] = OrderedDict((x, 0) for x in self.eval_params.labels_to_evaluate)
+        for gt in self.gts.values():
+            for label in gt["objects"].labels.tolist():
+                self._stats["GT_stats"][label] += 1
+
+    def _parseGT(
+        self,
+        gts     # type: List[str]
+    ):
+        # type: (...) -> None
+        """Internal method that parses the given GT files.
 
+        Args:
+            gts (List[str]): GT files
+        """
         for p in gts:
             gts_for_image = []
             ignores_for_image = []
@@ -186,8 +244,8 @@ class Box3dEvaluator:
 
             # check for valid json file
             try:
-                with open(p) as f:
-                    data = json.load(f)
+                with open(p, 'rb') as f:
+                    data = loadJson(f.read())
             except json.decoder.JSONDecodeError:
                 logger.error("Invalid GT json file: {}".format(base))
                 raise
@@ -214,7 +272,6 @@ class Box3dEvaluator:
             # load 3D boxes
             for d in data["objects"]:
                 if d["label"] in self.eval_params.labels_to_evaluate:
-                    self._stats["GT_stats"][d["label"]] += 1
                     box_data = CsBbox3d()
                     box_data.fromJsonText(d)
                     gts_for_image.append(box_data)
@@ -226,8 +283,8 @@ class Box3dEvaluator:
                 ignores_for_image.append(box_data)
 
             self.gts[base] = {
-                "objects": gts_for_image,
-                "ignores": ignores_for_image
+                "objects": Box3dArrays.fromBoxes(gts_for_image),
+                "ignores": np.asarray([box.bbox for box in ignores_for_image], dtype=np.float64).reshape(-1, 4)
             }
 
             self.cameras[base] = camera
@@ -258,8 +315,8 @@ class Box3dEvaluator:
 
             # check for valid json file
             try:
-                with open(p) as f:
-                    data = json.load(f)
+                with open(p, 'rb') as f:
+                    data = loadJson(f.read())
             except json.decoder.JSONDecodeError:
                 logger.error("Invalid prediction json file: {}".format(base))
                 raise
@@ -284,7 +341,7 @@ class Box3dEvaluator:
                     preds_for_image.append(box_data)
 
             self.preds[base] = {
-                "objects": preds_for_image
+                "objects": Box3dArrays.fromBoxes(preds_for_image)
             }
 
     def evaluate(self):
@@ -296,7 +353,7 @@ class Box3dEvaluator:
             if base not in self.preds.keys():
                 logger.critical(
                     "Could not find any prediction for image {}.".format(base))
-                self.preds[base] = {"objects": []}
+                self.preds[base] = {"objects": Box3dArrays.fromBoxes([])}
 
         # initialize empty data
         for s in self._conf_thresholds:
@@ -344,10 +401,28 @@ class Box3dEvaluator:
         # type: (...) -> None
         """Internal method that calculates Precision and Recall values for whole dataset."""
 
-        # single threaded
+        bases = list(self.gts.keys())
         results = []
-        for x in tqdm(self.gts.keys()):
-            results.append(self._worker(x))
+        if self.num_workers > 1:
+            # the evaluator is sent once to each worker, the images are
+            # evaluated independently and the results are kept in order
+            pool = multiprocessing.Pool(
+                processes=self.num_workers,
+                initializer=_initImageStatsWorker,
+                initargs=(self,)
+            )
+            chunksize = max(1, len(bases) // (4 * self.num_workers))
+            for base, (result, amodal_boxes) in zip(bases, tqdm(
+                pool.imap(_calcImageStatsWorker, bases, chunksize=chunksize), total=len(bases)
+            )):
+                # keep the recalculated amodal boxes in sync with the workers
+                self.preds[base]["objects"].boxes_2d_amodal = amodal_boxes
+                results.append(result)
+            pool.close()
+            pool.join()
+        else:
+            for x in tqdm(bases):
+                results.append(self._worker(x))
 
         # update internal result dict with the corresponding results
         for thread_result in results:
@@ -371,17 +446,20 @@ class Box3dEvaluator:
         # recalculate the amodal bounding boxes
         box3dTransform = Box3dImageTransform(camera)
 
-        for p in pred_boxes["objects"]:
-            box3dTransform.initialize_box_from_annotation(p)
-            p.bbox_2d.setAmodalBox(box3dTransform.get_amodal_box_2d())
+        pred_objects = pred_boxes["objects"]
+        amodal_boxes, _, _ = box3dTransform.project_boxes(
+            pred_objects.dims, pred_objects.rotations, pred_objects.centers)
+        pred_objects.setAmodalBoxes(amodal_boxes)
 
-        # calculate PR stats for each conf threshold
-        for s in self._conf_thresholds:
+        # calculate PR stats for all conf thresholds at once
+        image_evaluations = self._addImageEvaluations(gt_boxes, pred_boxes, self._conf_thresholds)
+
+        for s, image_evaluation in zip(self._conf_thresholds, image_evaluations):
             tmp_stats[s] = {
                 "data": {}
             }
             (tp_idx_gt, tp_idx_pred, fp_idx_pred,
-             fn_idx_gt) = self._addImageEvaluation(gt_boxes, pred_boxes, s)
+             fn_idx_gt) = image_evaluation
 
             assert len(tp_idx_gt) == len(tp_idx_pred)
 
@@ -396,118 +474,162 @@ class Box3dEvaluator:
 
     def _addImageEvaluation(
         self,
-        gt_boxes,    # type: List[CsBbox3d]
-        pred_boxes,  # type: List[CsBbox3d]
+        gt_boxes,    # type: dict
+        pred_boxes,  # type: dict
         min_score    # type: float
     ):
         # type: (...) -> Tuple[dict, dict, dict, dict]
         """Internal method to evaluate a single image.
 
         Args:
-            gt_boxes (List[CsBbox3d]): GT boxes
-            pred_boxes (List[CsBbox3d]): Predicted boxes
+            gt_boxes (dict): GT boxes and ignore regions
+            pred_boxes (dict): Predicted boxes
             min_score (float): minimum required score
 
         Returns:
             tuple(dict, dict, dict, dict): tuple of TP, FP and FN data
         """
-        tp_idx_gt = {}
-        tp_idx_pred = {}
-        fp_idx_pred = {}
-        fn_idx_gt = {}
+        return self._addImageEvaluations(gt_boxes, pred_boxes, [min_score])[0]
+
+    def _addImageEvaluations(
+        self,
+        gt_boxes,       # type: dict
+        pred_boxes,     # type: dict
+        min_scores      # type: List[float]
+    ):
+        # type: (...) -> List[Tuple[dict, dict, dict, dict]]
+        """Internal method to evaluate a single image for several minimum scores.
+
+        The IoU and overlap matrices do not depend on the minimum score. They are
+        calculated once per class for all predictions and the columns of the
+        predictions above each minimum score are selected afterwards. As the
+        selected predictions only depend on their number, the matching is done
+        only once for each distinct number of selected predictions.
+
+        Args:
+            gt_boxes (dict): GT boxes (Box3dArrays) and ignore regions (Mx4 array)
+            pred_boxes (dict): Predicted boxes (Box3dArrays)
+            min_scores (List[float]): minimum required scores
+
+        Returns:
+            list(tuple(dict, dict, dict, dict)): tuple of TP, FP and FN data per minimum score
+        """
+        evaluations = [({}, {}, {}, {}) for _ in min_scores]
+
+        gt_objects = gt_boxes["objects"]
+        pred_objects = pred_boxes["objects"]
 
-        # pre-load all ignore regions as they are the same for all classes
-        gt_idx_ignores = [idx for idx,
-                          box in enumerate(gt_boxes["ignores"])]
+        # ignore regions are the same for all classes
+        boxes_2d_gt_ignores = gt_boxes["ignores"]
+
+        # get modal or amodal boxes depending on matching strategy
+        if self.eval_params.matching_method == MATCHING_AMODAL:
+            all_boxes_2d_gt = gt_objects.boxes_2d_amodal
+            all_boxes_2d_pred = pred_objects.boxes_2d_amodal
+        elif self.eval_params.matching_method == MATCHING_MODAL:
+            all_boxes_2d_gt = gt_objects.boxes_2d_modal
+            all_boxes_2d_pred = pred_objects.boxes_2d_modal
+        else:
+            raise ValueError("Matching method {} not known!".format(self.eval_params.matching_method))
 
         # calculate stats per class
         for i in self.eval_params.labels_to_evaluate:
-            # get idx for pred boxes for current class
-            pred_idx = [idx for idx, box in enumerate(
-                pred_boxes["objects"]) if box.label == i and box.score >= min_score]
+            # get idx for all pred boxes for current class and their scores
+            class_pred_idx = np.flatnonzero(pred_objects.labels == i).tolist()
+            class_scores = pred_objects.scores[class_pred_idx]
 
             # get idx for gt boxes for current class
-            gt_idx = [idx for idx, box in enumerate(
-                gt_boxes["objects"]) if box.label == i]
+            gt_idx = np.flatnonzero(gt_objects.labels == i).tolist()
+
+            # create 2D box matrix for predictions and gts
+            boxes_2d_pred = all_boxes_2d_pred[class_pred_idx]
+            boxes_2d_gt = all_boxes_2d_gt[gt_idx]
+
+            # as there are no amodal boxes for ignore regions
+            # matching with ignore regions should only be performed on
+            # modal predictions.
+            boxes_2d_pred_modal = pred_objects.boxes_2d_modal[class_pred_idx]
+
+            # calculate IoU matrix between GTs and Preds and overlap matrix
+            # between ignores and Preds once for all minimum scores
+            full_iou_matrix = calcIouMatrix(boxes_2d_gt, boxes_2d_pred)
+            full_overlap_matrix = calcOverlapMatrix(boxes_2d_gt_ignores, boxes_2d_pred_modal)
+
+            # the results for each number of selected predictions
+            results_per_count = {}
+
+            for evaluation, min_score in zip(evaluations, min_scores):
+                tp_idx_gt, tp_idx_pred, fp_idx_pred, fn_idx_gt = evaluation
+
+                # columns of the pred boxes for current class above the minimum score
+                pred_cols = np.flatnonzero(class_scores >= min_score)
+
+                if len(pred_cols) not in results_per_count:
+                    results_per_count[len(pred_cols)] = self._evaluateClass(
+                        gt_idx, class_pred_idx, pred_cols, full_iou_matrix, full_overlap_matrix)
+                gt_tp_idx, pred_tp_idx, pred_fp_idx, gt_fn_idx = results_per_count[len(pred_cols)]
 
-            # if there is no prediction at all, just return an empty result
-            if len(pred_idx) == 0:
                 # dump data to result dicts
-                tp_idx_gt[i] = []
-                tp_idx_pred[i] = []
-                fp_idx_pred[i] = pred_idx
-                fn_idx_gt[i] = gt_idx
-                continue
+                tp_idx_gt[i] = list(gt_tp_idx)
+                tp_idx_pred[i] = list(pred_tp_idx)
+                fp_idx_pred[i] = list(pred_fp_idx)
+                fn_idx_gt[i] = list(gt_fn_idx)
 
-            # create 2D box matrix for predictions and gts
-            boxes_2d_pred = np.zeros((0, 4))
-            if len(pred_idx) > 0:
-                # get modal or amodal boxes depending on matching strategy
-                if self.eval_params.matching_method == MATCHING_AMODAL:
-                    boxes_2d_pred = np.asarray(
-                        [pred_boxes["objects"][x].bbox_2d.bbox_amodal for x in pred_idx])
-                elif self.eval_params.matching_method == MATCHING_MODAL:
-                    boxes_2d_pred = np.asarray(
-                        [pred_boxes["objects"][x].bbox_2d.bbox_modal for x in pred_idx])
-                else:
-                    raise ValueError("Matching method {} not known!".format(self.eval_params.matching_method))
-
-            boxes_2d_gt = np.zeros((0, 4))
-            if len(gt_idx) > 0:
-                # get modal or amodal boxes depending on matching strategy
-                if self.eval_params.matching_method == MATCHING_AMODAL:
-                    boxes_2d_gt = np.asarray(
-                        [gt_boxes["objects"][x].bbox_2d.bbox_amodal for x in gt_idx])
-                elif self.eval_params.matching_method == MATCHING_MODAL:
-                    boxes_2d_gt = np.asarray(
-                        [gt_boxes["objects"][x].bbox_2d.bbox_modal for x in gt_idx])
-                else:
-                    raise ValueError("Matching method {} not known!".format(self.eval_params.matching_method))
-
-            boxes_2d_gt_ignores = np.zeros((0, 4))
-            if len(gt_idx_ignores) > 0:
-                boxes_2d_gt_ignores = np.asarray(
-                    [gt_boxes["ignores"][x].bbox for x in gt_idx_ignores])
-
-            # calculate IoU matrix between GTs and Preds
-            iou_matrix = calcIouMatrix(boxes_2d_gt, boxes_2d_pred)
-
-            # get matches
-            (gt_tp_row_idx, pred_tp_col_idx, _) = self._getMatches(iou_matrix)
-
-            # convert it to box idx
-            gt_tp_idx = [gt_idx[x] for x in gt_tp_row_idx]
-            pred_tp_idx = [pred_idx[x] for x in pred_tp_col_idx]
-            gt_fn_idx = [x for x in gt_idx if x not in gt_tp_idx]
-            pred_fp_idx_check_for_ignores = [
-                x for x in pred_idx if x not in pred_tp_idx]
-
-            # check if remaining FP idx match with ignored GT
-            boxes_2d_pred_fp = np.zeros((0, 4))
-            if len(pred_fp_idx_check_for_ignores) > 0:
-                # as there are no amodal boxes for ignore regions
-                # matching with ignore regions should only be performed on
-                # modal predictions.
-                boxes_2d_pred_fp = np.asarray(
-                    [pred_boxes["objects"][x].bbox_2d.bbox_modal for x in pred_fp_idx_check_for_ignores])
-
-            overlap_matrix = calcOverlapMatrix(
-                boxes_2d_gt_ignores, boxes_2d_pred_fp)
-
-            # get matches and convert to actual box idx
-            (_, pred_tp_col_idx, _) = self._getMatches(overlap_matrix, matchIgnores=True)
-            pred_tp_ignores_idx = [
-                pred_fp_idx_check_for_ignores[x] for x in pred_tp_col_idx]
-            pred_fp_idx = [
-                x for x in pred_fp_idx_check_for_ignores if x not in pred_tp_ignores_idx]
-
-            # dump data to result dicts
-            tp_idx_gt[i] = gt_tp_idx
-            tp_idx_pred[i] = pred_tp_idx
-            fp_idx_pred[i] = pred_fp_idx
-            fn_idx_gt[i] = gt_fn_idx
-
-        return (tp_idx_gt, tp_idx_pred, fp_idx_pred, fn_idx_gt)
+        return evaluations
+
+    def _evaluateClass(
+        self,
+        gt_idx,             # type: List[int]
+        class_pred_idx,     # type: List[int]
+        pred_cols,          # type: np.ndarray
+        full_iou_matrix,    # type: np.ndarray
+        full_overlap_matrix # type: np.ndarray
+    ):
+        # type: (...) -> Tuple[List[int], List[int], List[int], List[int]]
+        """Internal method to match the selected predictions of a single class.
+
+        Args:
+            gt_idx (List[int]): idx of the GT boxes of the class
+            class_pred_idx (List[int]): idx of all pred boxes of the class
+            pred_cols (np.ndarray): columns of the selected pred boxes in the matrices
+            full_iou_matrix (np.ndarray): IoU matrix between GTs and all pred boxes
+            full_overlap_matrix (np.ndarray): overlap matrix between ignores and all pred boxes
+
+        Returns:
+            tuple(list[int], list[int], list[int], list[int]): TP idx of GTs and
+            predictions, FP idx of predictions and FN idx of GTs
+        """
+        pred_idx = [class_pred_idx[x] for x in pred_cols]
+
+        # if there is no prediction at all, just return an empty result
+        if len(pred_idx) == 0:
+            return [], [], pred_idx, gt_idx
+
+        # get matches
+        (gt_tp_row_idx, pred_tp_col_idx, _) = self._getMatches(full_iou_matrix[:, pred_cols])
+
+        # convert it to box idx
+        gt_tp_idx = [gt_idx[x] for x in gt_tp_row_idx]
+        pred_tp_idx = [pred_idx[x] for x in pred_tp_col_idx]
+        gt_tp_set = set(gt_tp_idx)
+        pred_tp_set = set(pred_tp_idx)
+        gt_fn_idx = [x for x in gt_idx if x not in gt_tp_set]
+        fp_cols_check_for_ignores = [
+            col for col, x in zip(pred_cols, pred_idx) if x not in pred_tp_set]
+        pred_fp_idx_check_for_ignores = [
+            class_pred_idx[col] for col in fp_cols_check_for_ignores]
+
+        # check if remaining FP idx match with ignored GT
+        overlap_matrix = full_overlap_matrix[:, fp_cols_check_for_ignores]
+
+        # get matches and convert to actual box idx
+        (_, pred_tp_col_idx, _) = self._getMatches(overlap_matrix, matchIgnores=True)
+        pred_tp_ignores_idx = set(
+            pred_fp_idx_check_for_ignores[x] for x in pred_tp_col_idx)
+        pred_fp_idx = [
+            x for x in pred_fp_idx_check_for_ignores if x not in pred_tp_ignores_idx]
+
+        return gt_tp_idx, pred_tp_idx, pred_fp_idx, gt_fn_idx
 
     def _getMatches(
         self,
@@ -533,50 +655,80 @@ class Box3dEvaluator:
         if iou_matrix.shape[0] == 0 or iou_matrix.shape[1] == 0:
             return [], [], []
 
-        # iteratively select the max of the iou_matrix and set the corresponding
-        # rows and cols to 0.
-        tmp_iou_max = np.max(iou_matrix)
+        # all candidate pairs, sorted by decreasing iou. The stable sort keeps
+        # pairs with equal iou in row-major order, which results in the same
+        # matches as iteratively selecting the first max of the iou_matrix.
+        cand_rows, cand_cols = np.nonzero(iou_matrix > self.eval_params.min_iou_to_match)
+        cand_ious = iou_matrix[cand_rows, cand_cols]
+        order = np.argsort(-cand_ious, kind="stable")
+
+        # greedily accept the pairs whose row and col are still free.
+        # If ignores are matched, a row can be used multiple times.
+        used_rows = np.zeros(iou_matrix.shape[0], dtype=bool)
+        used_cols = np.zeros(iou_matrix.shape[1], dtype=bool)
+        max_matches = iou_matrix.shape[1] if matchIgnores else min(iou_matrix.shape)
+
+        for row, col, iou in zip(cand_rows[order].tolist(), cand_cols[order].tolist(), cand_ious[order].tolist()):
+            if used_cols[col] or (used_rows[row] and not matchIgnores):
+                continue
 
-        while tmp_iou_max > self.eval_params.min_iou_to_match:
-            tmp_row, tmp_col = np.where(iou_matrix == tmp_iou_max)
+            matched_gts.append(row)
+            matched_preds.append(col)
+            matched_ious.append(iou)
 
-            used_row = tmp_row[0]
-            used_col = tmp_col[0]
+            used_rows[row] = True
+            used_cols[col] = True
 
-            matched_gts.append(used_row)
-            matched_preds.append(used_col)
-            matched_ious.append(np.max(iou_matrix))
+            if len(matched_preds) == max_matches:
+                break
 
-            if matchIgnores is False:
-                iou_matrix[used_row, ...] = 0.0
+        return (matched_gts, matched_preds, matched_ious)
 
-            iou_matrix[..., used_col] = 0.0
+    def _addToDepthBins(
+        self,
+        label,      # type: str
+        parameter,  # type: str
+        gt_dists,   # type: np.ndarray
+        values      # type: np.ndarray
+    ):
+        # type: (...) -> None
+        """Internal method that accumulates the values of TP boxes in the depth bins
+        of their GT distances. Boxes at or beyond the max depth are skipped.
 
-            tmp_iou_max = np.max(iou_matrix)
+        Args:
+            label (str): the class that will be evaluated
+            parameter (str): the DDTP metric
+            gt_dists (np.ndarray): GT distances
+            values (np.ndarray): values of the metric
+        """
+        in_range = gt_dists < self.eval_params.max_depth
+        bins = np.digitize(gt_dists[in_range], np.asarray(self._depth_bins)) - 1
 
-        return (matched_gts, matched_preds, matched_ious)
+        sums, counts = self._stats["working_data"][label][parameter]
+        sums += np.bincount(bins, weights=values[in_range], minlength=len(sums))
+        counts += np.bincount(bins, minlength=len(counts))
 
     def _calcCenterDistances(
         self,
         label,       # type: str
-        gt_boxes,    # type: List[CsBbox3d]
-        pred_boxes,  # type: List[CsBbox3d]
+        gt_boxes,    # type: Box3dArrays
+        pred_boxes,  # type: Box3dArrays
     ):
         # type: (...) -> np.ndarray
-        """Internal method that calculates the BEV distance for a TP box
+        """Internal method that calculates the BEV distance for TP boxes
         d = sqrt(dx*dx + dz*dz)
 
         Args:
             label (str): the class that will be evaluated
-            gt_boxes (List[CsBbox3d]): GT boxes
-            pred_boxes (List[CsBbox3d]): Predicted boxes
+            gt_boxes (Box3dArrays): GT boxes
+            pred_boxes (Box3dArrays): Predicted boxes
 
         Returns:
             np.ndarray: array containing the GT distances
         """
 
-        gt_boxes = np.asarray([x.center for x in gt_boxes])
-        pred_boxes = np.asarray([x.center for x in pred_boxes])
+        gt_boxes = gt_boxes.centers
+        pred_boxes = pred_boxes.centers
 
         gt_dists = np.sqrt(gt_boxes[..., 0]**2 +
                            gt_boxes[..., 1]**2).astype(int)
@@ -585,96 +737,70 @@ class Box3dEvaluator:
         center_dists = np.sqrt(center_dists[..., 0]**2 +
                                center_dists[..., 1]**2)
 
-        for gt_dist, center_dist in zip(gt_dists, center_dists):
-            if gt_dist >= self.eval_params.max_depth:
-                continue
-
-            # instead of unbound distances in m we want to transform this in a score between 0 and 1
-            # e.g. if the max_depth == 100
-            # score = 1. - (dist / 100)
-
-            gt_dist = int(gt_dist / self.eval_params.step_size) * \
-                self.eval_params.step_size
+        # instead of unbound distances in m we want to transform this in a score between 0 and 1
+        # e.g. if the max_depth == 100
+        # score = 1. - (dist / 100)
+        center_scores = 1. - np.minimum(center_dists / float(self.eval_params.max_depth), 1.)  # norm it to 1.
 
-            self._stats["working_data"][label]["Center_Dist"][gt_dist].append(
-                1. - min(center_dist / float(self.eval_params.max_depth), 1.))  # norm it to 1.
+        self._addToDepthBins(label, "Center_Dist", gt_dists, center_scores)
 
         return gt_dists
 
     def _calcSizeSimilarities(
         self,
         label,       # type: str
-        gt_boxes,    # type: List[CsBbox3d]
-        pred_boxes,  # type: List[CsBbox3d]
+        gt_boxes,    # type: Box3dArrays
+        pred_boxes,  # type: Box3dArrays
         gt_dists     # type: np.ndarray
     ):
         # type: (...) -> None
-        """Internal method that calculates the size similarity for a TP box
+        """Internal method that calculates the size similarity for TP boxes
         s = min(w/w', w'/w) * min(h/h', h'/h) * min(l/l', l'/l)
 
         Args:
             label (str): the class that will be evaluated
-            gt_boxes (List[CsBbox3d]): GT boxes
-            pred_boxes (List[CsBbox3d]): Predicted boxes
+            gt_boxes (Box3dArrays): GT boxes
+            pred_boxes (Box3dArrays): Predicted boxes
             gt_dists (np.ndarray): GT distances
         """
 
-        gt_boxes = np.asarray([x.dims for x in gt_boxes])
-        pred_boxes = np.asarray([x.dims for x in pred_boxes])
+        gt_boxes = gt_boxes.dims
+        pred_boxes = pred_boxes.dims
 
         size_similarities = np.prod(np.minimum(
             gt_boxes / pred_boxes, pred_boxes / gt_boxes), axis=1)
 
-        for gt_dist, size_simi in zip(gt_dists, size_similarities):
-            if gt_dist >= self.eval_params.max_depth:
-                continue
-
-            gt_dist = int(gt_dist / self.eval_params.step_size) * \
-                self.eval_params.step_size
-
-            self._stats["working_data"][label]["Size_Similarity"][gt_dist].append(
-                size_simi)
+        self._addToDepthBins(label, "Size_Similarity", gt_dists, size_similarities)
 
     def _calcOrientationSimilarities(
         self,
         label,       # type: str
-        gt_boxes,    # type: List[CsBbox3d]
-        pred_boxes,  # type: List[CsBbox3d]
+        gt_boxes,    # type: Box3dArrays
+        pred_boxes,  # type: Box3dArrays
         gt_dists     # type: np.ndarray
     ):
         # type: (...) -> None
-        """Internal method that calculates the orientation similarity for a TP box.
+        """Internal method that calculates the orientation similarity for TP boxes.
         os_yaw = (1 + cos(delta)) / 2.
         os_pitch/roll = 0.5 + (cos(delta_pitch) + cos(delta_roll)) / 4.
 
         Args:
             label (str): the class that will be evaluated
-            gt_boxes (List[CsBbox3d]): GT boxes
-            pred_boxes (List[CsBbox3d]): Predicted boxes
+            gt_boxes (Box3dArrays): GT boxes
+            pred_boxes (Box3dArrays): Predicted boxes
             gt_dists (np.ndarray): GT distances
         """
 
-        gt_vals = np.asarray(
-            [Quaternion(x.rotation).yaw_pitch_roll for x in gt_boxes])
-        pred_vals = np.asarray(
-            [Quaternion(x.rotation).yaw_pitch_roll for x in pred_boxes])
+        gt_vals = quaternions_to_yaw_pitch_roll(gt_boxes.rotations)
+        pred_vals = quaternions_to_yaw_pitch_roll(pred_boxes.rotations)
 
         os_yaws = (1. + np.cos(gt_vals[..., 0] - pred_vals[..., 0])) / 2.
         os_pitch_rolls = 0.5 + \
             (np.cos(gt_vals[..., 1] - pred_vals[..., 1]) +
              np.cos(gt_vals[..., 2] - pred_vals[..., 2])) / 4.
 
-        for gt_dist, os_yaw, os_pitch_roll in zip(gt_dists, os_yaws, os_pitch_rolls):
-            if gt_dist >= self.eval_params.max_depth:
-                continue
-
-            gt_dist = int(gt_dist / self.eval_params.step_size) * \
-                self.eval_params.step_size
-
-            self._stats["working_data"][label]["OS_Yaw"][gt_dist].append(
-                os_yaw)
-            self._stats["working_data"][label]["OS_Pitch_Roll"][gt_dist].append(
-                os_pitch_roll)
+        self._addToDepthBins(label, "OS_Yaw", gt_dists, os_yaws)
+        self._addToDepthBins(label, "OS_Pitch_Roll", gt_dists, os_pitch_rolls)
 
     def _calculateAUC(
         self,
@@ -689,28 +815,12 @@ class Box3dEvaluator:
         """
         parameter_depth_data = self._stats["working_data"][label]
 
-        for parameter_name, value_dict in parameter_depth_data.items():
-            curr_mean = -1.
-            result_dict = OrderedDict()
-            result_items = OrderedDict()
-            result_auc = 0.
-            num_items = 0
-
-            depths = []
-            vals = []
-            num_items_list = []
-            all_items = []
-
-            for depth, values in value_dict.items():
-                if len(values) > 0:
-                    num_items += len(values)
-                    all_items += values
-
-                    curr_mean = sum(values) / float(len(values))
-
-                    depths.append(depth)
-                    vals.append(curr_mean)
-                    num_items_list.append(len(values))
+        for parameter_name, (sums, counts) in parameter_depth_data.items():
+            # only depths with values are kept
+            valid = counts > 0
+            depths = np.asarray(self._depth_bins)[valid].tolist()
+            vals = (sums[valid] / counts[valid]).tolist()
+            num_items_list = counts[valid].tolist()
 
             # AUC is calculated as the mean of all values for available depths
             if len(vals) > 1:
@@ -718,14 +828,9 @@ class Box3dEvaluator:
             else:
                 result_auc = 0.
 
-            # remove the expanded entries
-            for d, v, n in list(zip(depths, vals, num_items_list)):
-                result_dict[d] = v
-                result_items[d] = n
-
-            self.results[parameter_name][label]["data"] = result_dict
+            self.results[parameter_name][label]["data"] = OrderedDict(zip(depths, vals))
             self.results[parameter_name][label]["auc"] = result_auc
-            self.results[parameter_name][label]["items"] = result_items
+            self.results[parameter_name][label]["items"] = OrderedDict(zip(depths, num_items_list))
 
     def _calcTpStats(self):
         # type (...) -> None
@@ -756,30 +861,35 @@ class Box3dEvaluator:
             working_confidence = self._stats["working_confidence"][label]
             working_data = self._stats[working_confidence]["data"]
 
+            # sum and number of the values of each metric per depth bin
             self._stats["working_data"] = {}
-            self._stats["working_data"][label] = OrderedDict()
-            self._stats["working_data"][label]["Center_Dist"] = OrderedDict((x, []) for x in self._depth_bins)
-            self._stats["working_data"][label]["Size_Similarity"] = OrderedDict((x, []) for x in self._depth_bins)
-            self._stats["working_data"][label]["OS_Yaw"] = OrderedDict((x, []) for x in self._depth_bins)
-            self._stats["working_data"][label]["OS_Pitch_Roll"] = OrderedDict((x, []) for x in self._depth_bins)
+            self._stats["working_data"][label] = OrderedDict(
+                (x, (np.zeros(len(self._depth_bins)), np.zeros(len(self._depth_bins), dtype=np.int64)))
+                for x in ["Center_Dist", "Size_Similarity", "OS_Yaw", "OS_Pitch_Roll"]
+            )
+
+            # stack the TP boxes of all images
+            tp_gt_boxes = []
+            tp_pred_boxes = []
 
             # loop over all images
             for base_img, tp_fp_fn_data in working_data.items():
-                gt_boxes = self.gts[base_img]["objects"]
-                pred_boxes = self.preds[base_img]["objects"]
-
-                tp_idx_gt = tp_fp_fn_data["tp_idx_gt"]
-                tp_idx_pred = tp_fp_fn_data["tp_idx_pred"]
-
-                # only select the GT boxes
-                gt_boxes = [gt_boxes[x] for x in tp_idx_gt[label]]
-                pred_boxes = [pred_boxes[x] for x in tp_idx_pred[label]]
+                tp_idx_gt = tp_fp_fn_data["tp_idx_gt"][label]
+                tp_idx_pred = tp_fp_fn_data["tp_idx_pred"][label]
 
                 # there is no prediction or GT -> no TP statistics
-                if len(gt_boxes) == 0 or len(pred_boxes) == 0:
+                if len(tp_idx_gt) == 0 or len(tp_idx_pred) == 0:
                     continue
 
-                # calculate center_dists for image
+                # only select the TP boxes
+                tp_gt_boxes.append(self.gts[base_img]["objects"].select(tp_idx_gt))
+                tp_pred_boxes.append(self.preds[base_img]["objects"].select(tp_idx_pred))
+
+            if tp_gt_boxes:
+                gt_boxes = Box3dArrays.concatenate(tp_gt_boxes)
+                pred_boxes = Box3dArrays.concatenate(tp_pred_boxes)
+
+                # calculate center_dists for all TP boxes
                 gt_dists = self._calcCenterDistances(
                     label, gt_boxes, pred_boxes)
 
@@ -877,8 +987,8 @@ class Box3dEvaluator:
 
             # get the statistics for each image
             for img_base, img_base_stats in score_data.items():
-                gt_depths = [x.depth for x in self.gts[img_base]["objects"]]
-                pred_depths = [x.depth for x in self.preds[img_base]["objects"]]
+                gt_depths = self.gts[img_base]["objects"].depths
+                pred_depths = self.preds[img_base]["objects"].depths
 
                 for label, idxs in img_base_stats["tp_idx_gt"].items():
                     tp[label] += len(idxs)
@@ -1091,6 +1201,34 @@ class Box3dEvaluator:
         self.results["AP"] = ap
         self.results["AP_per_depth"] = ap_per_depth
 
+
+# the evaluator used within a worker process of Box3dEvaluator._calcImageStats
+_worker_evaluator = None
+
+
+def _initImageStatsWorker(
+    evaluator   # type: Box3dEvaluator
+):
+    # type: (...) -> None
+    """Stores the evaluator within a worker process."""
+    global _worker_evaluator
+    _worker_evaluator = evaluator
+
+
+def _calcImageStatsWorker(
+    base    # type: str
+):
+    # type: (...) -> Tuple[dict, List[List[float]]]
+    """Evaluates a single image within a worker process.
+
+    Returns:
+        tuple(dict, list): the image stats and the recalculated amodal boxes
+        of the predictions
+    """
+    result = _worker_evaluator._worker(base)
+    amodal_boxes = _worker_evaluator.preds[base]["objects"].boxes_2d_amodal
+    return result, amodal_boxes
+
 # evaluation method
 
 
@@ -1099,7 +1237,9 @@ def evaluate3dObjectDetection(
     pred_folder,    # type: str
     result_folder,  # type: str
     eval_params,    # type: EvaluationParameters
-    plot=True       # type: bool
+    plot=True,      # type: bool
+    num_workers=1,  # type: int
+    gt_cache_dir=None   # type: Optional[str]
 ):
     # type: (...) -> None
     """Performs the 3D object detection evaluation.
@@ -1110,10 +1250,12 @@ def evaluate3dObjectDetection(
         result_folder (str): directory in which the result files are saved
         eval_params (EvaluationParameters): evaluation parameters
         plot (bool): plot the evaluation results
+        num_workers (int): number of processes used to evaluate the images
+        gt_cache_dir (Optional[str]): directory of the GT cache files, no caching if None
     """
 
     # initialize the evaluator
-    boxEvaluator = Box3dEvaluator(eval_params)
+    boxEvaluator = Box3dEvaluator(eval_params, num_workers=num_workers, gt_cache_dir=gt_cache_dir)
     boxEvaluator.checkCw()
 
     logger.info("Use the following options")
@@ -1123,6 +1265,8 @@ def evaluate3dObjectDetection(
     logger.info(" -> Min IoU:     : {:.2f}".format(eval_params.min_iou_to_match))
     logger.info(" -> Max depth [m]: {}".format(eval_params.max_depth))
     logger.info(" -> Step size [m]: {}".format(eval_params.step_size))
+    logger.info(" -> Workers      : {}".format(num_workers))
+    logger.info(" -> GT cache     : {}".format(gt_cache_dir if gt_cache_dir is not None else "-- disabled --"))
     if boxEvaluator.eval_params.cw == -1.0:
         logger.info(" -> cw           : -- automatically determined --")
     else:
@@ -1232,6 +1376,26 @@ def main():
                         action="store_false",
                         help="Don't plot the graphical results")
 
+    parser.add_argument("--num-workers",
+                        dest="numWorkers",
+                        help="Number of processes used to evaluate the images. Default: 1",
+                        default=1,
+                        type=int)
+
+    gtCacheDir = os.path.dirname(os.path.realpath(__file__))
+    parser.add_argument("--gt-cache-dir",
+                        dest="gtCacheDir",
+                        help="Directory in which the parsed GT is cached. A cache file is only used for identical "
+                        "GT files and labels, it replaces the cache of other GT files. Default: {}".format(gtCacheDir),
+                        default=gtCacheDir,
+                        type=str)
+
+    parser.add_argument("--no-gt-cache",
+                        dest="gtCacheDir",
+                        action="store_const",
+                        const=None,
+                        help="Don't cache the parsed GT")
+
     args = parser.parse_args()
 
     if not os.path.exists(args.gtFolder):
@@ -1266,7 +1430,9 @@ def main():
         args.predictionFolder,
         resultsFolder,
         eval_params,
-        plot=args.plot_results
+        plot=args.plot_results,
+        num_workers=args.numWorkers,
+        gt_cache_dir=args.gtCacheDir
     )
 
     logger.info("========================")
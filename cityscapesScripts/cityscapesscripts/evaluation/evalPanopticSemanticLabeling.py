@@ -118,112 +118,159 @@ class PQStat():
         return {'pq': pq / n, 'sq': sq / n, 'rq': rq / n, 'n': n}, per_class_results
 
 
-@get_traceback
-def pq_compute_single_core(proc_id, annotation_set, gt_folder, pred_folder, categories):
-    pq_stat = PQStat()
+# Index of each id within the given segment ids, -1 for ids that are no segment
+def segment_index(segment_ids, ids):
+    if len(segment_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    order = np.argsort(segment_ids, kind='stable')
+    pos = np.minimum(np.searchsorted(segment_ids[order], ids), len(segment_ids) - 1)
+    return np.where(segment_ids[order][pos] == ids, order[pos], -1)
+
+
+def pq_compute_single_image(pq_stat, gt_ann, pred_ann, gt_folder, pred_folder, categories):
+    pan_gt = np.array(Image.open(os.path.join(gt_folder, gt_ann['file_name'])), dtype=np.uint32)
+    pan_gt = rgb2id(pan_gt)
+    pan_pred = np.array(Image.open(os.path.join(pred_folder, pred_ann['file_name'])), dtype=np.uint32)
+    pan_pred = rgb2id(pan_pred)
+
+    gt_segms = {el['id']: el for el in gt_ann['segments_info']}
+    pred_segms = {el['id']: el for el in pred_ann['segments_info']}
+
+    # predicted segments area calculation + prediction sanity checks
+    pred_labels_set = set(el['id'] for el in pred_ann['segments_info'])
+    labels, labels_cnt = np.unique(pan_pred, return_counts=True)
+    for label, label_cnt in zip(labels, labels_cnt):
+        if label not in pred_segms:
+            if label == VOID:
+                continue
+            raise KeyError('In the image with ID {} segment with ID {} is presented in PNG and not presented in JSON.'.format(gt_ann['image_id'], label))
+        pred_segms[label]['area'] = label_cnt
+        pred_labels_set.remove(label)
+        if pred_segms[label]['category_id'] not in categories:
+            raise KeyError('In the image with ID {} segment with ID {} has unknown category_id {}.'.format(gt_ann['image_id'], label, pred_segms[label]['category_id']))
+    if len(pred_labels_set) != 0:
+        raise KeyError('In the image with ID {} the following segment IDs {} are presented in JSON and not presented in PNG.'.format(gt_ann['image_id'], list(pred_labels_set)))
+
+    # segment attributes as arrays, in the order of the segment dicts
+    gt_labels = list(gt_segms.keys())
+    gt_ids = np.array(gt_labels, dtype=np.uint64)
+    gt_categories = np.array([el['category_id'] for el in gt_segms.values()], dtype=np.int64)
+    gt_areas = np.array([el['area'] for el in gt_segms.values()], dtype=np.int64)
+    gt_crowd = np.array([el['iscrowd'] == 1 for el in gt_segms.values()], dtype=bool)
+    pred_ids = np.array(list(pred_segms.keys()), dtype=np.uint64)
+    pred_categories = np.array([el['category_id'] for el in pred_segms.values()], dtype=np.int64)
+    pred_areas = np.array([el['area'] for el in pred_segms.values()], dtype=np.int64)
+
+    # confusion matrix calculation, one entry per unique pair of segments
+    pan_gt_pred = pan_gt.astype(np.uint64) * OFFSET + pan_pred.astype(np.uint64)
+    labels, labels_cnt = np.unique(pan_gt_pred, return_counts=True)
+    pair_gt = segment_index(gt_ids, labels // OFFSET)
+    pair_pred = segment_index(pred_ids, labels % OFFSET)
+    pair_void = (labels // OFFSET) == VOID
+    intersections = labels_cnt.astype(np.int64)
+
+    # intersection of each predicted segment with VOID
+    void_intersections = np.zeros(len(pred_ids), dtype=np.int64)
+    is_void_pair = np.logical_and(pair_void, pair_pred >= 0)
+    void_intersections[pair_pred[is_void_pair]] = intersections[is_void_pair]
+
+    # count all matched pairs
+    candidates = np.flatnonzero(np.logical_and(pair_gt >= 0, pair_pred >= 0))
+    candidates = candidates[~gt_crowd[pair_gt[candidates]]]
+    candidates = candidates[gt_categories[pair_gt[candidates]] == pred_categories[pair_pred[candidates]]]
+    cand_gt = pair_gt[candidates]
+    cand_pred = pair_pred[candidates]
+    unions = pred_areas[cand_pred] + gt_areas[cand_gt] - intersections[candidates] - void_intersections[cand_pred]
+    ious = intersections[candidates] / unions
+    is_match = ious > 0.5
+    gt_matched = np.zeros(len(gt_ids), dtype=bool)
+    gt_matched[cand_gt[is_match]] = True
+    pred_matched = np.zeros(len(pred_ids), dtype=bool)
+    pred_matched[cand_pred[is_match]] = True
+    # accumulate in the order of the pairs, to keep the floating point sum unchanged
+    for category_id, iou in zip(gt_categories[cand_gt[is_match]].tolist(), ious[is_match]):
+        pq_stat[category_id].tp += 1
+        pq_stat[category_id].iou += iou
+
+    # count false negatives, crowd segments are ignored
+    for category_id, fn in zip(*np.unique(gt_categories[np.logical_and(~gt_matched, ~gt_crowd)], return_counts=True)):
+        pq_stat[int(category_id)].fn += int(fn)
+
+    # the crowd segment of each category, the last one if there are several
+    crowd_gt = {}
+    for gt_idx in np.flatnonzero(gt_crowd):
+        crowd_gt[int(gt_categories[gt_idx])] = gt_idx
+
+    # intersection of each predicted segment with the crowd region of its category
+    crowd_intersections = np.zeros(len(pred_ids), dtype=np.int64)
+    if crowd_gt:
+        crowd_categories = np.array(list(crowd_gt.keys()), dtype=np.int64)
+        crowd_segments = np.array(list(crowd_gt.values()), dtype=np.int64)
+        pairs = np.flatnonzero(np.logical_and(pair_gt >= 0, pair_pred >= 0))
+        crowd_idx = segment_index(crowd_categories, pred_categories[pair_pred[pairs]])
+        is_crowd_pair = crowd_idx >= 0
+        is_crowd_pair[is_crowd_pair] = crowd_segments[crowd_idx[is_crowd_pair]] == pair_gt[pairs[is_crowd_pair]]
+        crowd_intersections[pair_pred[pairs[is_crowd_pair]]] = intersections[pairs[is_crowd_pair]]
+
+    # count false positives
+    # predicted segment is ignored if more than half of the segment correspond to VOID and CROWD regions
+    is_ignored = (void_intersections + crowd_intersections) / pred_areas > 0.5
+    for category_id, fp in zip(*np.unique(pred_categories[np.logical_and(~pred_matched, ~is_ignored)], return_counts=True)):
+        pq_stat[int(category_id)].fp += int(fp)
+
 
-    idx = 0
+@get_traceback
+def pq_compute_chunk(chunk):
+    chunk_id, annotation_set, gt_folder, pred_folder, categories = chunk
+    image_stats = []
     for gt_ann, pred_ann in annotation_set:
-        if idx % 30 == 0:
-            print('Core: {}, {} from {} images processed'.format(proc_id, idx, len(annotation_set)))
-        idx += 1
-
-        pan_gt = np.array(Image.open(os.path.join(gt_folder, gt_ann['file_name'])), dtype=np.uint32)
-        pan_gt = rgb2id(pan_gt)
-        pan_pred = np.array(Image.open(os.path.join(pred_folder, pred_ann['file_name'])), dtype=np.uint32)
-        pan_pred = rgb2id(pan_pred)
-
-        gt_segms = {el['id']: el for el in gt_ann['segments_info']}
-        pred_segms = {el['id']: el for el in pred_ann['segments_info']}
-
-        # predicted segments area calculation + prediction sanity checks
-        pred_labels_set = set(el['id'] for el in pred_ann['segments_info'])
-        labels, labels_cnt = np.unique(pan_pred, return_counts=True)
-        for label, label_cnt in zip(labels, labels_cnt):
-            if label not in pred_segms:
-                if label == VOID:
-                    continue
-                raise KeyError('In the image with ID {} segment with ID {} is presented in PNG and not presented in JSON.'.format(gt_ann['image_id'], label))
-            pred_segms[label]['area'] = label_cnt
-            pred_labels_set.remove(label)
-            if pred_segms[label]['category_id'] not in categories:
-                raise KeyError('In the image with ID {} segment with ID {} has unknown category_id {}.'.format(gt_ann['image_id'], label, pred_segms[label]['category_id']))
-        if len(pred_labels_set) != 0:
-            raise KeyError('In the image with ID {} the following segment IDs {} are presented in JSON and not presented in PNG.'.format(gt_ann['image_id'], list(pred_labels_set)))
-
-        # confusion matrix calculation
-        pan_gt_pred = pan_gt.astype(np.uint64) * OFFSET + pan_pred.astype(np.uint64)
-        gt_pred_map = {}
-        labels, labels_cnt = np.unique(pan_gt_pred, return_counts=True)
-        for label, intersection in zip(labels, labels_cnt):
-            gt_id = label // OFFSET
-            pred_id = label % OFFSET
-            gt_pred_map[(gt_id, pred_id)] = intersection
-
-        # count all matched pairs
-        gt_matched = set()
-        pred_matched = set()
-        for label_tuple, intersection in gt_pred_map.items():
-            gt_label, pred_label = label_tuple
-            if gt_label not in gt_segms:
-                continue
-            if pred_label not in pred_segms:
-                continue
-            if gt_segms[gt_label]['iscrowd'] == 1:
-                continue
-            if gt_segms[gt_label]['category_id'] != pred_segms[pred_label]['category_id']:
-                continue
+        pq_stat = PQStat()
+        pq_compute_single_image(pq_stat, gt_ann, pred_ann, gt_folder, pred_folder, categories)
+        image_stats.append(pq_stat)
+    return chunk_id, image_stats
 
-            union = pred_segms[pred_label]['area'] + gt_segms[gt_label]['area'] - intersection - gt_pred_map.get((VOID, pred_label), 0)
-            iou = intersection / union
-            if iou > 0.5:
-                pq_stat[gt_segms[gt_label]['category_id']].tp += 1
-                pq_stat[gt_segms[gt_label]['category_id']].iou += iou
-                gt_matched.add(gt_label)
-                pred_matched.add(pred_label)
-
-        # count false positives
-        crowd_labels_dict = {}
-        for gt_label, gt_info in gt_segms.items():
-            if gt_label in gt_matched:
-                continue
-            # crowd segments are ignored
-            if gt_info['iscrowd'] == 1:
-                crowd_labels_dict[gt_info['category_id']] = gt_label
-                continue
-            pq_stat[gt_info['category_id']].fn += 1
 
-        # count false positives
-        for pred_label, pred_info in pred_segms.items():
-            if pred_label in pred_matched:
-                continue
-            # intersection of the segment with VOID
-            intersection = gt_pred_map.get((VOID, pred_label), 0)
-            # plus intersection with corresponding CROWD region if it exists
-            if pred_info['category_id'] in crowd_labels_dict:
-                intersection += gt_pred_map.get((crowd_labels_dict[pred_info['category_id']], pred_label), 0)
-            # predicted segment is ignored if more than half of the segment correspond to VOID and CROWD regions
-            if intersection / pred_info['area'] > 0.5:
-                continue
-            pq_stat[pred_info['category_id']].fp += 1
+def pq_compute_single_core(proc_id, annotation_set, gt_folder, pred_folder, categories):
+    # all images of annotation_set in one chunk, merged into a single PQStat
+    _, image_stats = pq_compute_chunk((proc_id, annotation_set, gt_folder, pred_folder, categories))
+    pq_stat = PQStat()
+    for image_stat in image_stats:
+        pq_stat += image_stat
     print('Core: {}, all {} images processed'.format(proc_id, len(annotation_set)))
     return pq_stat
 
 
-def pq_compute_multi_core(matched_annotations_list, gt_folder, pred_folder, categories):
-    cpu_num = multiprocessing.cpu_count()
-    annotations_split = np.array_split(matched_annotations_list, cpu_num)
-    print("Number of cores: {}, images per core: {}".format(cpu_num, len(annotations_split[0])))
-    workers = multiprocessing.Pool(processes=cpu_num)
-    processes = []
-    for proc_id, annotation_set in enumerate(annotations_split):
-        p = workers.apply_async(pq_compute_single_core,
-                                (proc_id, annotation_set, gt_folder, pred_folder, categories))
-        processes.append(p)
-    pq_stat = PQStat()
-    for p in processes:
-        pq_stat += p.get()
+# The images are distributed to the workers in small chunks, such that idle workers
+# pick up the next chunk and a slow chunk does not stall the whole run. The statistics
+# of all images are merged in the order of the images, such that the result does not
+# depend on the number of workers or the chunk size.
+def pq_compute_multi_core(matched_annotations_list, gt_folder, pred_folder, categories, num_workers=None, chunk_size=8):
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = max(num_workers, 1)
+    chunk_size = max(chunk_size, 1)
+    chunks = []
+    for chunk_id, start in enumerate(range(0, len(matched_annotations_list), chunk_size)):
+        annotation_set = matched_annotations_list[start:start + chunk_size]
+        chunks.append((chunk_id, annotation_set, gt_folder, pred_folder, categories))
+    print("Number of workers: {}, images per chunk: {}, chunks: {}".format(num_workers, chunk_size, len(chunks)))
+
+    chunk_stats = [None] * len(chunks)
+    processed = 0
+    workers = multiprocessing.Pool(processes=num_workers)
+    for chunk_id, image_stats in workers.imap_unordered(pq_compute_chunk, chunks):
+        chunk_stats[chunk_id] = image_stats
+        processed += len(image_stats)
+        print('\r{} from {} images processed'.format(processed, len(matched_annotations_list)), end='')
+        sys.stdout.flush()
+    print('')
     workers.close()
+    workers.join()
+
+    pq_stat = PQStat()
+    for image_stats in chunk_stats:
+        for image_stat in image_stats:
+            pq_stat += image_stat
     return pq_stat
 
 
@@ -261,7 +308,7 @@ def print_results(results, categories):
         ))
 
 
-def evaluatePanoptic(gt_json_file, gt_folder, pred_json_file, pred_folder, resultsFile):
+def evaluatePanoptic(gt_json_file, gt_folder, pred_json_file, pred_folder, resultsFile, num_workers=None, chunk_size=8):
 
     start_time = time.time()
     with open(gt_json_file, 'r') as f:
@@ -291,7 +338,7 @@ def evaluatePanoptic(gt_json_file, gt_folder, pred_json_file, pred_folder, resul
             raise Exception('no prediction for the image with id: {}'.format(image_id))
         matched_annotations_list.append((gt_ann, pred_annotations[image_id]))
 
-    pq_stat = pq_compute_multi_core(matched_annotations_list, gt_folder, pred_folder, categories)
+    pq_stat = pq_compute_multi_core(matched_annotations_list, gt_folder, pred_folder, categories, num_workers, chunk_size)
 
     results = average_pq(pq_stat, categories)
     with open(resultsFile, 'w') as f:
@@ -305,6 +352,13 @@ def evaluatePanoptic(gt_json_file, gt_folder, pred_json_file, pred_folder, resul
     return results
 
 
+def positive_int(value):
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {}".format(value))
+    return value
+
+
 # The main method
 def main():
     cityscapesPath = os.environ.get(
@@ -357,6 +411,16 @@ def main():
                         help="File to store computed panoptic quality. Default: {}".format(resultFile),
                         default=resultFile,
                         type=str)
+    parser.add_argument("--num-workers",
+                        dest="numWorkers",
+                        help="Number of worker processes. Default: number of CPUs",
+                        default=None,
+                        type=positive_int)
+    parser.add_argument("--chunk-size",
+                        dest="chunkSize",
+                        help="Number of images a worker processes at once. Default: 8",
+                        default=8,
+                        type=positive_int)
     args = parser.parse_args()
 
     if not os.path.isfile(args.gtJsonFile):
@@ -369,7 +433,8 @@ def main():
     if args.predictionFolder is None:
         args.predictionFolder = os.path.splitext(args.predictionJsonFile)[0]
 
-    evaluatePanoptic(args.gtJsonFile, args.gtFolder, args.predictionJsonFile, args.predictionFolder, args.resultsFile)
+    evaluatePanoptic(args.gtJsonFile, args.gtFolder, args.predictionJsonFile, args.predictionFolder, args.resultsFile,
+                     args.numWorkers, args.chunkSize)
 
     return
 
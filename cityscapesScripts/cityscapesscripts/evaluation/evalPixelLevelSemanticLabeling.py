@@ -15,6 +15,10 @@
 # To enable cython, run
 # CYTHONIZE_EVAL= python setup.py build_ext --inplace
 #
+# Large image lists can be evaluated on several cores, e.g.
+# csEvalPixelLevelSemanticLabeling --workers 8
+# The results are identical to the single process evaluation.
+#
 # To run this script, make sure that your results are images,
 # where pixels encode the class IDs as defined in labels.py.
 # Note that the regular ID is used, not the train ID.
@@ -28,6 +32,7 @@ from __future__ import print_function, absolute_import, division
 import os, sys
 import platform
 import fnmatch
+import multiprocessing
 
 try:
     from itertools import izip
@@ -143,6 +148,8 @@ args.bold               = colors.BOLD if args.colorized else ""
 args.nocol              = colors.ENDC if args.colorized else ""
 args.JSONOutput         = True
 args.quiet              = False
+args.numWorkers         = 1
+args.workerChunkSize    = 8
 
 args.avgClassSize       = {
     "bicycle"    :  4672.3249222261 ,
@@ -468,19 +475,18 @@ def evaluateImgLists(predictionImgList, groundTruthImgList, args):
         print("Evaluating {} pairs of images...".format(len(predictionImgList)))
 
     # Evaluate all pairs of images and save them into a matrix
-    for i in range(len(predictionImgList)):
-        predictionImgFileName = predictionImgList[i]
-        groundTruthImgFileName = groundTruthImgList[i]
-        #print "Evaluate ", predictionImgFileName, "<>", groundTruthImgFileName
-        nbPixels += evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, instStats, perImageStats, args)
-
-        # sanity check
-        if confMatrix.sum() != nbPixels:
-            printError('Number of analyzed pixels and entries in confusion matrix disagree: contMatrix {}, pixels {}'.format(confMatrix.sum(),nbPixels))
-
-        if not args.quiet:
-            print("\rImages Processed: {}".format(i+1), end=' ')
-            sys.stdout.flush()
+    if args.numWorkers > 1:
+        nbPixels = evaluateImgListsParallel(predictionImgList, groundTruthImgList, confMatrix, instStats, perImageStats, args)
+    else:
+        for i in range(len(predictionImgList)):
+            predictionImgFileName = predictionImgList[i]
+            groundTruthImgFileName = groundTruthImgList[i]
+            #print "Evaluate ", predictionImgFileName, "<>", groundTruthImgFileName
+            nbPixels += evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, instStats, perImageStats, args)
+
+            if not args.quiet:
+                print("\rImages Processed: {}".format(i+1), end=' ')
+                sys.stdout.flush()
     if not args.quiet:
         print("\n")
 
@@ -545,9 +551,109 @@ def evaluateImgLists(predictionImgList, groundTruthImgList, args):
     # return confusion matrix
     return allResultsDict
 
+# Initialize the global arguments within a worker process.
+def initEvaluationWorker(workerArgs):
+    global args
+    args = workerArgs
+
+# Evaluate a chunk of image pairs within a worker process.
+# Returns the partial confusion matrix together with the instance
+# contributions of all images in the order they were evaluated.
+def evaluateImgChunk(imgPairs):
+    confMatrix        = generateMatrix(args)
+    instStats         = generateInstanceStats(args)
+    instContributions = []
+    perImageStats     = {}
+    nbPixels          = 0
+    for predictionImgFileName, groundTruthImgFileName in imgPairs:
+        try:
+            nbPixels += evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, instStats, perImageStats, args, instContributions)
+        except SystemExit:
+            # printError exits, which would leave the pool waiting forever
+            raise RuntimeError("Evaluation of {} failed".format(predictionImgFileName))
+    return confMatrix, instContributions, perImageStats, nbPixels
+
+# Evaluate image lists pairwise using several worker processes.
+# The image pairs are streamed to the workers in small chunks. The partial
+# results are merged in the original order of the images, such that the
+# result is bit-identical to the single process evaluation.
+def evaluateImgListsParallel(predictionImgList, groundTruthImgList, confMatrix, instStats, perImageStats, args):
+    imgPairs = list(izip(predictionImgList, groundTruthImgList))
+    chunks   = [imgPairs[i:i+args.workerChunkSize] for i in range(0, len(imgPairs), args.workerChunkSize)]
+    nbPixels = 0
+    nbImages = 0
+
+    pool = multiprocessing.Pool(processes=args.numWorkers, initializer=initEvaluationWorker, initargs=(args,))
+    try:
+        for chunk, result in izip(chunks, pool.imap(evaluateImgChunk, chunks)):
+            partialMatrix, instContributions, partialPerImageStats, partialNbPixels = result
+            confMatrix += partialMatrix
+            addInstanceContributions(instStats, instContributions)
+            perImageStats.update(partialPerImageStats)
+            nbPixels += partialNbPixels
+            nbImages += len(chunk)
+
+            if not args.quiet:
+                print("\rImages Processed: {}".format(nbImages), end=' ')
+                sys.stdout.flush()
+    except RuntimeError as e:
+        pool.terminate()
+        printError(e)
+    pool.close()
+    pool.join()
+
+    return nbPixels
+
+# Add the instance contributions of evaluated images to the instance statistics.
+# Each contribution corresponds to one ground truth instance.
+def addInstanceContributions(instanceStats, instContributions):
+    for labelName, tp, fn, tpWeighted, fnWeighted, category, catTp, catFn, catTpWeighted, catFnWeighted in instContributions:
+        instanceStats["classes"][labelName]["tp"]         += tp
+        instanceStats["classes"][labelName]["fn"]         += fn
+        instanceStats["classes"][labelName]["tpWeighted"] += tpWeighted
+        instanceStats["classes"][labelName]["fnWeighted"] += fnWeighted
+
+        if category is not None:
+            instanceStats["categories"][category]["tp"]         += catTp
+            instanceStats["categories"][category]["fn"]         += catFn
+            instanceStats["categories"][category]["tpWeighted"] += catTpWeighted
+            instanceStats["categories"][category]["fnWeighted"] += catFnWeighted
+
+# Add the pixels of an image pair to the confusion matrix using numpy.
+# This is used as replacement for the cython implementation. All pairs of
+# ground truth and predicted label are encoded as gt * K + pred, where K is
+# the size of the confusion matrix, and counted in one fixed-size bincount.
+def addToConfusionMatrixNumpy(predictionNp, groundTruthNp, confMatrix, args):
+    confMatDim = confMatrix.shape[0]
+
+    # encoded pairs outside of the confusion matrix cannot be counted
+    gtMax = groundTruthNp.max()
+    if gtMax >= confMatDim:
+        printError("Unknown label with id {:}".format(gtMax))
+    predMax = predictionNp.max()
+    if predMax >= confMatDim:
+        printError("Unknown predicted label with id {:}".format(predMax))
+
+    # a single buffer holds the encoded pairs, which is then updated in-place
+    encoded = groundTruthNp.astype(np.intp)
+    encoded *= confMatDim
+    encoded += predictionNp
+    counts = np.bincount(encoded.ravel(), minlength=confMatDim*confMatDim).reshape(confMatDim, confMatDim)
+
+    # all ground truth labels need to be known
+    gtCounts = counts.sum(axis=1)
+    for gtId in np.flatnonzero(gtCounts):
+        if not gtId in args.evalLabels:
+            printError("Unknown label with id {:}".format(gtId))
+
+    confMatrix += counts.astype(confMatrix.dtype)
+    return confMatrix
+
 # Main evaluation method. Evaluates pairs of prediction and ground truth
 # images which are passed as arguments.
-def evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, instanceStats, perImageStats, args):
+# If a list is given as instContributions, the contributions of all
+# ground truth instances of this image are appended to it as well.
+def evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, instanceStats, perImageStats, args, instContributions=None):
     # Loading all resources for evaluation.
     try:
         predictionImg = Image.open(predictionImgFileName)
@@ -585,61 +691,62 @@ def evaluatePair(predictionImgFileName, groundTruthImgFileName, confMatrix, inst
         # using cython
         confMatrix = addToConfusionMatrix.cEvaluatePair(predictionNp, groundTruthNp, confMatrix, args.evalLabels)
     else:
-        # the slower python way 
-        encoding_value = max(groundTruthNp.max(), predictionNp.max()).astype(np.int32) + 1
-        encoded = (groundTruthNp.astype(np.int32) * encoding_value) + predictionNp
-
-        values, cnt = np.unique(encoded, return_counts=True)
-
-        for value, c in zip(values, cnt):
-            pred_id = value % encoding_value
-            gt_id = int((value - pred_id)/encoding_value)
-            if not gt_id in args.evalLabels:
-                printError("Unknown label with id {:}".format(gt_id))
-            confMatrix[gt_id][pred_id] += c
-        
+        # the slower numpy way
+        confMatrix = addToConfusionMatrixNumpy(predictionNp, groundTruthNp, confMatrix, args)
 
     if args.evalInstLevelScore:
-        # Generate category masks
-        categoryMasks = {}
-        for category in instanceStats["categories"]:
-            categoryMasks[category] = np.in1d( predictionNp , instanceStats["categories"][category]["labelIds"] ).reshape(predictionNp.shape)
-
-        instList = np.unique(instanceNp[instanceNp > 1000])
+        # Lookup table from label ID to the index of its category,
+        # -1 if the category is not evaluated on instance level
+        instCategories = list(instanceStats["categories"])
+        categoryLut = np.full(256, -1, dtype=np.intp)
+        for categoryIdx, category in enumerate(instCategories):
+            categoryLut[instanceStats["categories"][category]["labelIds"]] = categoryIdx
+
+        # Compute the size, the true positives and the category true positives
+        # of all instances at once, using bincounts over the instance IDs
+        instPixels   = instanceNp > 1000
+        instIdPixels = instanceNp[instPixels].astype(np.intp)
+        predPixels   = predictionNp[instPixels]
+        labelPixels  = instIdPixels // 1000
+        instSizes    = np.bincount(instIdPixels)
+        instTps      = np.bincount(instIdPixels[predPixels == labelPixels], minlength=instSizes.size)
+        catPixels    = categoryLut[labelPixels]
+        instCatTps   = np.bincount(instIdPixels[np.logical_and(catPixels >= 0, categoryLut[predPixels] == catPixels)], minlength=instSizes.size)
+
+        contributions = []
+        instList = np.flatnonzero(instSizes)
         for instId in instList:
             labelId = int(instId/1000)
             label = id2label[ labelId ]
             if label.ignoreInEval:
                 continue
 
-            mask = instanceNp==instId
-            instSize = np.count_nonzero( mask )
+            instSize = int(instSizes[instId])
 
-            tp = np.count_nonzero( predictionNp[mask] == labelId )
+            tp = int(instTps[instId])
             fn = instSize - tp
 
             weight = args.avgClassSize[label.name] / float(instSize)
             tpWeighted = float(tp) * weight
             fnWeighted = float(fn) * weight
 
-            instanceStats["classes"][label.name]["tp"]         += tp
-            instanceStats["classes"][label.name]["fn"]         += fn
-            instanceStats["classes"][label.name]["tpWeighted"] += tpWeighted
-            instanceStats["classes"][label.name]["fnWeighted"] += fnWeighted
-
             category = label.category
             if category in instanceStats["categories"]:
-                catTp = 0
-                catTp = np.count_nonzero( np.logical_and( mask , categoryMasks[category] ) )
+                catTp = int(instCatTps[instId])
                 catFn = instSize - catTp
 
                 catTpWeighted = float(catTp) * weight
                 catFnWeighted = float(catFn) * weight
+            else:
+                category = None
+                catTp = catFn = 0
+                catTpWeighted = catFnWeighted = 0.0
+
+            contributions.append( (label.name, tp, fn, tpWeighted, fnWeighted, category, catTp, catFn, catTpWeighted, catFnWeighted) )
 
-                instanceStats["categories"][category]["tp"]         += catTp
-                instanceStats["categories"][category]["fn"]         += catFn
-                instanceStats["categories"][category]["tpWeighted"] += catTpWeighted
-                instanceStats["categories"][category]["fnWeighted"] += catFnWeighted
+        addInstanceContributions(instanceStats, contributions)
+        if instContributions is not None:
+            instContributions.extend(contributions)
 
     if args.evalPixelAccuracy:
         notIgnoredLabels = [l for l in args.evalLabels if not id2label[l].ignoreInEval]
@@ -656,6 +763,17 @@ def main():
     global args
     argv = sys.argv[1:]
 
+    # the number of worker processes can be given as option
+    try:
+        opts, argv = getopt.gnu_getopt(argv, "j:", ["workers="])
+    except getopt.GetoptError as e:
+        printError(e)
+    for opt, val in opts:
+        if opt in ("-j", "--workers"):
+            if not val.isdigit() or int(val) < 1:
+                printError("Invalid number of workers: {}".format(val))
+            args.numWorkers = int(val)
+
     predictionImgList = []
     groundTruthImgList = []
 
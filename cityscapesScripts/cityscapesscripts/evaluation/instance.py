@@ -10,12 +10,14 @@ class Instance(object):
     medDist    = -1
     distConf   = 0.0
 
-    def __init__(self, imgNp, instID):
+    def __init__(self, imgNp, instID, pixelCount=None):
         if (instID == -1):
             return
         self.instID     = int(instID)
         self.labelID    = int(self.getLabelID(instID))
-        self.pixelCount = int(self.getInstancePixels(imgNp, instID))
+        if pixelCount is None:
+            pixelCount = self.getInstancePixels(imgNp, instID)
+        self.pixelCount = int(pixelCount)
 
     def getLabelID(self, instID):
         if (instID < 1000):
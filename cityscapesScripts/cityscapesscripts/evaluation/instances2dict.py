@@ -2,52 +2,140 @@
 #
 # Convert instances from png files to a dictionary
 #
+# The instances can optionally be cached in a compact npz file. The cache
+# is keyed on the absolute path of each image together with its mtime and
+# size. Images that are new or have changed are processed again and added
+# to the cache, all other images are taken from the cache.
+#
 
 from __future__ import print_function, absolute_import, division
 import os, sys
+import time
 
 # Cityscapes imports
 from cityscapesscripts.evaluation.instance import *
 from cityscapesscripts.helpers.csHelpers import *
 
-def instances2dict(imageFileList, verbose=False):
+# Compute the instance ids of an image together with their pixel counts
+def getInstancePixelCounts(imageFileName):
+    # Load image
+    img = Image.open(imageFileName)
+
+    # Image as numpy array
+    imgNp = np.array(img)
+
+    # All instance ids and their sizes in a single pass
+    return np.unique(imgNp, return_counts=True)
+
+# Create the instance dict of an image from its instance ids and pixel counts
+def getImageInstances(instanceIds, pixelCounts):
+    # Initialize label categories
+    instances = {}
+    for label in labels:
+        instances[label.name] = []
+
+    # Loop through all instance ids in instance image
+    for instanceId, pixelCount in zip(instanceIds, pixelCounts):
+        instanceObj = Instance(None, instanceId, pixelCount)
+
+        instances[id2label[instanceObj.labelID].name].append(instanceObj.toDict())
+
+    return instances
+
+# The fingerprint of an image, used to invalidate cache entries
+def getFileFingerprint(imageFileName):
+    stat = os.stat(imageFileName)
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Load the instance cache, a dict from image path to
+# (fingerprint, instance ids, pixel counts)
+def loadInstanceCache(cacheFile):
+    cache = {}
+    if not os.path.isfile(cacheFile):
+        return cache
+
+    with np.load(cacheFile) as data:
+        offsets = data["offsets"]
+        instanceIds = data["instanceIds"]
+        pixelCounts = data["pixelCounts"]
+        for i, imgKey in enumerate(data["paths"]):
+            fingerprint = (int(data["mtimes"][i]), int(data["sizes"][i]))
+            begin, end = offsets[i], offsets[i+1]
+            cache[str(imgKey)] = (fingerprint, instanceIds[begin:end], pixelCounts[begin:end])
+
+    return cache
+
+# Write the instance cache, all images are stored in flat arrays
+def saveInstanceCache(cache, cacheFile):
+    paths = sorted(cache)
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(cache[imgKey][1]) for imgKey in paths])
+
+    def concat(idx):
+        if not paths:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.asarray(cache[imgKey][idx], dtype=np.int64) for imgKey in paths])
+
+    # write to a temporary file first, such that the cache is never left broken
+    tmpFile = cacheFile + ".tmp"
+    with open(tmpFile, "wb") as f:
+        np.savez_compressed(f,
+                            paths=np.array(paths, dtype=np.str_),
+                            mtimes=np.array([cache[imgKey][0][0] for imgKey in paths], dtype=np.int64),
+                            sizes=np.array([cache[imgKey][0][1] for imgKey in paths], dtype=np.int64),
+                            offsets=offsets,
+                            instanceIds=concat(1),
+                            pixelCounts=concat(2))
+    os.replace(tmpFile, cacheFile)
+
+def instances2dict(imageFileList, verbose=False, cacheFile=None):
     imgCount     = 0
+    cachedCount  = 0
     instanceDict = {}
+    startTime    = time.time()
 
     if not isinstance(imageFileList, list):
         imageFileList = [imageFileList]
 
+    cache = {}
+    cacheChanged = False
+    if cacheFile:
+        cache = loadInstanceCache(cacheFile)
+
     if verbose:
         print("Processing {} images...".format(len(imageFileList)))
 
     for imageFileName in imageFileList:
-        # Load image
-        img = Image.open(imageFileName)
-
-        # Image as numpy array
-        imgNp = np.array(img)
-
-        # Initialize label categories
-        instances = {}
-        for label in labels:
-            instances[label.name] = []
-
-        # Loop through all instance ids in instance image
-        for instanceId in np.unique(imgNp):
-            instanceObj = Instance(imgNp, instanceId)
-
-            instances[id2label[instanceObj.labelID].name].append(instanceObj.toDict())
-
         imgKey = os.path.abspath(imageFileName)
-        instanceDict[imgKey] = instances
+
+        if cacheFile:
+            fingerprint = getFileFingerprint(imageFileName)
+            if imgKey in cache and cache[imgKey][0] == fingerprint:
+                instanceIds, pixelCounts = cache[imgKey][1:]
+                cachedCount += 1
+            else:
+                instanceIds, pixelCounts = getInstancePixelCounts(imageFileName)
+                cache[imgKey] = (fingerprint, instanceIds, pixelCounts)
+                cacheChanged = True
+        else:
+            instanceIds, pixelCounts = getInstancePixelCounts(imageFileName)
+
+        instanceDict[imgKey] = getImageInstances(instanceIds, pixelCounts)
         imgCount += 1
 
         if verbose:
             print("\rImages Processed: {}".format(imgCount), end=' ')
             sys.stdout.flush()
 
+    if cacheChanged:
+        saveInstanceCache(cache, cacheFile)
+
     if verbose:
         print("")
+        if cacheFile:
+            print("Took {:.2f}s, {} of {} images from cache {}".format(time.time() - startTime, cachedCount, imgCount, cacheFile))
+        else:
+            print("Took {:.2f}s".format(time.time() - startTime))
 
     return instanceDict
 
@@ -4,9 +4,13 @@
 #
 
 import os
+import hashlib
 import numpy as np
 
-from typing import List
+from typing import List, Tuple
+
+from cityscapesscripts.helpers.annotation import CsBbox3d
+from cityscapesscripts.helpers.box3dImageTransform import Camera
 
 # matching methods
 MATCHING_AMODAL = 0
@@ -167,3 +171,221 @@ def getFiles(
     file_list.sort()
 
     return file_list
+
+
+class Box3dArrays:
+    """Columnar storage of the 3D boxes of an image
+
+    Every attribute holds one row per box, such that the evaluation can
+    select and process the boxes with array operations.
+
+    Attributes:
+        labels: labels with shape N
+        scores: scores with shape N
+        centers: 3D centers with shape Nx3
+        dims: dimensions (length, width, height) with shape Nx3
+        rotations: rotation quaternions with shape Nx4
+        boxes_2d_modal: modal 2D boxes as [xmin, ymin, xmax, ymax] with shape Nx4
+        boxes_2d_amodal: amodal 2D boxes as [xmin, ymin, xmax, ymax] with shape Nx4
+    """
+
+    def __init__(
+        self,
+        labels,             # type: np.ndarray
+        scores,             # type: np.ndarray
+        centers,            # type: np.ndarray
+        dims,               # type: np.ndarray
+        rotations,          # type: np.ndarray
+        boxes_2d_modal,     # type: np.ndarray
+        boxes_2d_amodal     # type: np.ndarray
+    ):
+        # type: (...) -> None
+        self.labels = np.asarray(labels, dtype=np.str_)
+        self.scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        self.dims = np.asarray(dims, dtype=np.float64).reshape(-1, 3)
+        self.rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 4)
+        self.boxes_2d_modal = np.asarray(boxes_2d_modal, dtype=np.float64).reshape(-1, 4)
+        self.boxes_2d_amodal = np.asarray(boxes_2d_amodal, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def fromBoxes(
+        cls,
+        boxes   # type: List[CsBbox3d]
+    ):
+        # type: (...) -> Box3dArrays
+        """Creates the arrays from a list of CsBbox3d objects."""
+        return cls(
+            [box.label for box in boxes],
+            [box.score for box in boxes],
+            [box.center for box in boxes],
+            [box.dims for box in boxes],
+            [box.rotation for box in boxes],
+            [box.bbox_2d.bbox_modal for box in boxes],
+            [box.bbox_2d.bbox_amodal for box in boxes]
+        )
+
+    @classmethod
+    def concatenate(
+        cls,
+        arrays  # type: List[Box3dArrays]
+    ):
+        # type: (...) -> Box3dArrays
+        """Stacks the boxes of several Box3dArrays."""
+        if not arrays:
+            return cls.fromBoxes([])
+        columns = ["labels", "scores", "centers", "dims", "rotations", "boxes_2d_modal", "boxes_2d_amodal"]
+        return cls(*[np.concatenate([getattr(a, c) for a in arrays]) for c in columns])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def select(
+        self,
+        idx     # type: List[int]
+    ):
+        # type: (...) -> Box3dArrays
+        """Returns the boxes with the given indices."""
+        idx = np.asarray(idx, dtype=np.int64)
+        return Box3dArrays(
+            self.labels[idx],
+            self.scores[idx],
+            self.centers[idx],
+            self.dims[idx],
+            self.rotations[idx],
+            self.boxes_2d_modal[idx],
+            self.boxes_2d_amodal[idx]
+        )
+
+    def setAmodalBoxes(
+        self,
+        boxes_2d_amodal     # type: np.ndarray
+    ):
+        # type: (...) -> None
+        """Sets the amodal 2D boxes given as [xmin, ymin, xmax, ymax].
+
+        The boxes are converted like CsBbox2d.setAmodalBox, i.e. via their
+        width and height, such that the results do not depend on the storage.
+        """
+        boxes = np.asarray(boxes_2d_amodal, dtype=np.float64).reshape(-1, 4)
+        self.boxes_2d_amodal = np.concatenate(
+            [boxes[:, :2], boxes[:, :2] + (boxes[:, 2:] - boxes[:, :2])], axis=1)
+
+    @property
+    def depths(self):
+        # type: (...) -> np.ndarray
+        """Returns the BEV depths like CsBbox3d.depth"""
+        return np.sqrt(self.centers[:, 0]**2 + self.centers[:, 1]**2).astype(int)
+
+
+def getGtFingerprint(
+    files,      # type: List[str]
+    labels      # type: List[str]
+):
+    # type: (...) -> str
+    """Returns a fingerprint of the given GT files and evaluated labels.
+
+    The fingerprint changes if a file is added, removed or modified, i.e.
+    if its modification time or size changes.
+
+    Args:
+        files (List[str]): the GT files
+        labels (List[str]): the labels that are evaluated
+
+    Returns:
+        str: hex digest of the fingerprint
+    """
+    fingerprint = hashlib.sha1()
+    fingerprint.update(repr(sorted(labels)).encode())
+    for f in sorted(files):
+        stat = os.stat(f)
+        fingerprint.update("{}:{}:{}\n".format(os.path.abspath(f), stat.st_mtime_ns, stat.st_size).encode())
+    return fingerprint.hexdigest()
+
+
+def saveGtCache(
+    cache_file,     # type: str
+    gts,            # type: dict
+    cameras         # type: dict
+):
+    # type: (...) -> None
+    """Writes GT boxes, ignore regions and cameras of all images to a npz file.
+
+    The boxes and ignore regions of all images are concatenated, the
+    offsets arrays hold the first row of each image.
+
+    Args:
+        cache_file (str): path of the npz file
+        gts (dict): dict with "objects" (Box3dArrays) and "ignores" (Mx4 array) per image
+        cameras (dict): Camera object per image
+    """
+    bases = sorted(gts.keys())
+    objects = [gts[base]["objects"] for base in bases]
+    ignores = [gts[base]["ignores"] for base in bases]
+
+    def concat(arrays, shape, dtype=np.float64):
+        if not arrays:
+            return np.zeros(shape, dtype=dtype)
+        return np.concatenate(arrays)
+
+    def offsets(sizes):
+        result = np.zeros(len(sizes) + 1, dtype=np.int64)
+        result[1:] = np.cumsum(sizes)
+        return result
+
+    # write to a temporary file first, such that the cache is never left broken
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(
+            f,
+            bases=np.array(bases, dtype=np.str_),
+            box_offsets=offsets([len(o) for o in objects]),
+            labels=concat([o.labels for o in objects], (0,), np.str_),
+            scores=concat([o.scores for o in objects], (0,)),
+            centers=concat([o.centers for o in objects], (0, 3)),
+            dims=concat([o.dims for o in objects], (0, 3)),
+            rotations=concat([o.rotations for o in objects], (0, 4)),
+            boxes_2d_modal=concat([o.boxes_2d_modal for o in objects], (0, 4)),
+            boxes_2d_amodal=concat([o.boxes_2d_amodal for o in objects], (0, 4)),
+            ignore_offsets=offsets([len(i) for i in ignores]),
+            ignores=concat(ignores, (0, 4)),
+            camera_intrinsics=np.array(
+                [[cameras[base].fx, cameras[base].fy, cameras[base].u0, cameras[base].v0] for base in bases],
+                dtype=np.float64).reshape(-1, 4),
+            camera_extrinsics=np.array(
+                [cameras[base].sensor_T_ISO_8855 for base in bases], dtype=np.float64).reshape(-1, 3, 4)
+        )
+    os.replace(tmp_file, cache_file)
+
+
+def loadGtCache(
+    cache_file  # type: str
+):
+    # type: (...) -> Tuple[dict, dict]
+    """Reads the GT written by saveGtCache.
+
+    Args:
+        cache_file (str): path of the npz file
+
+    Returns:
+        tuple(dict, dict): GT boxes and ignore regions per image and Camera object per image
+    """
+    gts = {}
+    cameras = {}
+    with np.load(cache_file) as data:
+        data = {key: data[key] for key in data.files}
+
+    box_offsets = data["box_offsets"]
+    ignore_offsets = data["ignore_offsets"]
+    columns = ["labels", "scores", "centers", "dims", "rotations", "boxes_2d_modal", "boxes_2d_amodal"]
+    for i, base in enumerate(data["bases"]):
+        base = str(base)
+        begin, end = box_offsets[i], box_offsets[i + 1]
+        gts[base] = {
+            "objects": Box3dArrays(*[data[c][begin:end] for c in columns]),
+            "ignores": data["ignores"][ignore_offsets[i]:ignore_offsets[i + 1]]
+        }
+        fx, fy, u0, v0 = data["camera_intrinsics"][i].tolist()
+        cameras[base] = Camera(fx, fy, u0, v0, data["camera_extrinsics"][i].tolist())
+
+    return gts, cameras
@@ -16,10 +16,35 @@ import locale
 from abc import ABCMeta, abstractmethod
 from .box3dImageTransform import Camera
 
+# orjson parses annotation files considerably faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # A point in a polygon
 Point = namedtuple('Point', ['x', 'y'])
 
 
+def loadJson(jsonText):
+    """Parse a json string or bytes object, using orjson if it is available"""
+    if orjson is not None:
+        try:
+            return orjson.loads(jsonText)
+        except orjson.JSONDecodeError:
+            # e.g. NaN values, which are only accepted by the json module
+            pass
+    return json.loads(jsonText)
+
+
+def polygonToArray(polygon):
+    """Convert a list of points to an (N,2) array, integer coordinates are stored as int32"""
+    points = np.array(polygon).reshape(-1, 2)
+    if points.dtype.kind in 'iu':
+        points = points.astype(np.int32)
+    return points
+
+
 class CsObjectType():
     """Type of an object"""
     POLY = 1  # polygon
@@ -107,30 +132,20 @@ class CsPoly(CsObject):
         text = "Object: {} - {}".format(self.label, polyText)
         return text
 
+    @property
+    def points(self):
+        """Returns the polygon as (N,2) array"""
+        return polygonToArray(self.polygon)
+
     def fromJsonText(self, jsonText, objId=-1):
         self.id = objId
         self.label = str(jsonText['label'])
         self.polygon = [Point(p[0], p[1]) for p in jsonText['polygon']]
-        if 'deleted' in jsonText.keys():
-            self.deleted = jsonText['deleted']
-        else:
-            self.deleted = 0
-        if 'verified' in jsonText.keys():
-            self.verified = jsonText['verified']
-        else:
-            self.verified = 1
-        if 'user' in jsonText.keys():
-            self.user = jsonText['user']
-        else:
-            self.user = ''
-        if 'date' in jsonText.keys():
-            self.date = jsonText['date']
-        else:
-            self.date = ''
-        if self.deleted == 1:
-            self.draw = False
-        else:
-            self.draw = True
+        self.deleted = jsonText.get('deleted', 0)
+        self.verified = jsonText.get('verified', 1)
+        self.user = jsonText.get('user', '')
+        self.date = jsonText.get('date', '')
+        self.draw = self.deleted != 1
 
     def toJsonText(self):
         objDict = {}
@@ -147,6 +162,84 @@ class CsPoly(CsObject):
         return objDict
 
 
+class CsPolyCompact(object):
+    """Memory efficient variant of CsPoly used by Annotation(compact=True)
+
+    The polygon is stored as (N,2) numpy array in 'points'. The list of
+    'Point' tuples of CsPoly is only created once 'polygon' is accessed. From
+    then on, the list is the polygon, such that in place edits are kept.
+    """
+    __slots__ = ['objectType', 'label', 'deleted', 'verified', 'date', 'user', 'draw', 'id',
+                 '_points', '_polygon']
+
+    # the attributes written by Annotation.toJson, next to the polygon
+    jsonKeys = ['objectType', 'label', 'deleted', 'verified', 'date', 'user', 'draw', 'id']
+
+    # Constructor
+    def __init__(self):
+        self.objectType = CsObjectType.POLY
+        self.label = ""
+        self.deleted = 0
+        self.verified = 0
+        self.date = ""
+        self.user = ""
+        self.draw = True
+        self.id = -1
+        self._points = np.zeros((0, 2), dtype=np.int32)
+        self._polygon = None
+
+    __str__ = CsPoly.__str__
+    updateDate = CsObject.updateDate
+    delete = CsObject.delete
+
+    @property
+    def points(self):
+        """Returns the polygon as (N,2) array"""
+        if self._polygon is not None:
+            return polygonToArray(self._polygon)
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self._points = polygonToArray(points)
+        self._polygon = None
+
+    @property
+    def polygon(self):
+        """Returns the polygon as list of points"""
+        if self._polygon is None:
+            self._polygon = [Point(x, y) for x, y in self._points.tolist()]
+            self._points = None
+        return self._polygon
+
+    @polygon.setter
+    def polygon(self, polygon):
+        self._polygon = polygon
+        self._points = None
+
+    def fromJsonText(self, jsonText, objId=-1):
+        self.id = objId
+        self.label = str(jsonText['label'])
+        self.points = jsonText['polygon']
+        self.deleted = jsonText.get('deleted', 0)
+        self.verified = jsonText.get('verified', 1)
+        self.user = jsonText.get('user', '')
+        self.date = jsonText.get('date', '')
+        self.draw = self.deleted != 1
+
+    def toJsonText(self):
+        objDict = {}
+        objDict['label'] = self.label
+        objDict['id'] = self.id
+        objDict['deleted'] = self.deleted
+        objDict['verified'] = self.verified
+        objDict['user'] = self.user
+        objDict['date'] = self.date
+        objDict['polygon'] = self.points.tolist()
+
+        return objDict
+
+
 class CsBbox2d(CsObject):
     """Class that contains the information of a single annotated object as bounding box"""
 
@@ -352,11 +445,26 @@ class CsIgnore2d(CsObject):
         return self.bbox_xywh
 
 
+def toJsonDict(obj):
+    """Returns the attributes of obj that are written by Annotation.toJson"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, CsPolyCompact):
+        objDict = {key: getattr(obj, key) for key in CsPolyCompact.jsonKeys}
+        objDict['polygon'] = obj.points.tolist()
+        return objDict
+    return {key: value for key, value in obj.__dict__.items() if not key.startswith('_')}
+
+
 class Annotation:
-    """The annotation of a whole image (doesn't support mixed annotations, i.e. combining CsPoly and CsBbox2d)"""
+    """The annotation of a whole image (doesn't support mixed annotations, i.e. combining CsPoly and CsBbox2d)
+
+    With compact=True, polygons are loaded as CsPolyCompact objects that keep
+    their points in numpy arrays. Use this for batch processing of many files.
+    """
 
     # Constructor
-    def __init__(self, objType=CsObjectType.POLY):
+    def __init__(self, objType=CsObjectType.POLY, compact=False):
         # the width of that image and thus of the label image
         self.imgWidth = 0
         # the height of that image and thus of the label image
@@ -367,12 +475,14 @@ class Annotation:
         self.camera = None
         assert objType in CsObjectType.__dict__.values()
         self.objectType = objType
+        # load polygons as CsPolyCompact, not written to JSON
+        self._compact = compact
 
     def toJson(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+        return json.dumps(self, default=toJsonDict, sort_keys=True, indent=4)
 
     def fromJsonText(self, jsonText):
-        jsonDict = json.loads(jsonText)
+        jsonDict = loadJson(jsonText)
         self.imgWidth = int(jsonDict['imgWidth'])
         self.imgHeight = int(jsonDict['imgHeight'])
         self.objects = []
@@ -380,7 +490,7 @@ class Annotation:
         if self.objectType != CsObjectType.IGNORE2D:
             for objId, objIn in enumerate(jsonDict['objects']):
                 if self.objectType == CsObjectType.POLY:
-                    obj = CsPoly()
+                    obj = CsPolyCompact() if self._compact else CsPoly()
                 elif self.objectType == CsObjectType.BBOX2D:
                     obj = CsBbox2d()
                 elif self.objectType == CsObjectType.BBOX3D:
@@ -419,7 +529,7 @@ class Annotation:
         if not os.path.isfile(jsonFile):
             print('Given json file not found: {}'.format(jsonFile))
             return
-        with open(jsonFile, 'r') as f:
+        with open(jsonFile, 'rb') as f:
             jsonText = f.read()
             self.fromJsonText(jsonText)
 
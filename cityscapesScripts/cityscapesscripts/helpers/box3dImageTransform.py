@@ -43,6 +43,26 @@ CRS_V = 0
 CRS_C = 1
 CRS_S = 2
 
+# Signs of the box vertices relative to the center in units of half the size,
+# in the order of Box3dImageTransform.loc
+BOX_VERTEX_SIGNS = np.array([
+    [-1, 1, -1],   # Back Left Bottom
+    [-1, -1, -1],  # Back Right Bottom
+    [1, -1, -1],   # Front Right Bottom
+    [1, 1, -1],    # Front Left Bottom
+    [-1, 1, 1],    # Back Left Top
+    [-1, -1, 1],   # Back Right Top
+    [1, -1, 1],    # Front Right Top
+    [1, 1, 1],     # Front Left Top
+], dtype=np.float64)
+
+# The 12 edges of a box as pairs of vertex indices
+BOX_EDGES = np.array([
+    [0, 1], [1, 2], [2, 3], [3, 0],
+    [4, 5], [5, 6], [6, 7], [7, 4],
+    [0, 4], [1, 5], [2, 6], [3, 7]
+])
+
 
 def get_K_multiplier():
     K_multiplier = np.zeros((3, 3))
@@ -61,6 +81,44 @@ def get_projection_matrix(camera):
     return K_matrix
 
 
+def quaternions_to_rotation_matrices(quaternions):
+    # Rotation matrices with shape (N,3,3) of the quaternions [w, x, y, z]
+    # with shape (N,4). The quaternions are normalized like in pyquaternion.
+    quaternions = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    norms = np.linalg.norm(quaternions, axis=1, keepdims=True)
+    w, x, y, z = (quaternions / np.where(norms > 0, norms, 1.)).T
+
+    rotation_matrices = np.empty((len(quaternions), 3, 3))
+    rotation_matrices[:, 0, 0] = 1. - 2. * (y * y + z * z)
+    rotation_matrices[:, 0, 1] = 2. * (x * y - w * z)
+    rotation_matrices[:, 0, 2] = 2. * (x * z + w * y)
+    rotation_matrices[:, 1, 0] = 2. * (x * y + w * z)
+    rotation_matrices[:, 1, 1] = 1. - 2. * (x * x + z * z)
+    rotation_matrices[:, 1, 2] = 2. * (y * z - w * x)
+    rotation_matrices[:, 2, 0] = 2. * (x * z - w * y)
+    rotation_matrices[:, 2, 1] = 2. * (y * z + w * x)
+    rotation_matrices[:, 2, 2] = 1. - 2. * (x * x + y * y)
+    return rotation_matrices
+
+
+def quaternions_to_yaw_pitch_roll(quaternions):
+    # Euler angles (yaw, pitch, roll) with shape (N,3) of the quaternions
+    # [w, x, y, z] with shape (N,4), computed like Quaternion.yaw_pitch_roll
+    # of pyquaternion. Quaternions are only normalized if they are not unit.
+    quaternions = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    sum_of_squares = np.sum(quaternions * quaternions, axis=1)
+    norms = np.sqrt(sum_of_squares)
+    normalize = (np.abs(1.0 - sum_of_squares) >= 1e-14) & (norms > 0)
+    q = np.where(normalize[:, np.newaxis], quaternions / np.where(norms > 0, norms, 1.)[:, np.newaxis], quaternions)
+
+    yaw = np.arctan2(2 * (q[:, 0] * q[:, 3] - q[:, 1] * q[:, 2]),
+                     1 - 2 * (q[:, 2] ** 2 + q[:, 3] ** 2))
+    pitch = np.arcsin(2 * (q[:, 0] * q[:, 2] + q[:, 3] * q[:, 1]))
+    roll = np.arctan2(2 * (q[:, 0] * q[:, 1] - q[:, 2] * q[:, 3]),
+                      1 - 2 * (q[:, 1] ** 2 + q[:, 2] ** 2))
+    return np.stack([yaw, pitch, roll], axis=1)
+
+
 def apply_transformation_points(points, transformation_matrix):
     points = np.concatenate([points, np.ones((points.shape[0], 1))], axis=1)
     points = np.matmul(transformation_matrix, points.T).T
@@ -275,6 +333,65 @@ class Box3dImageTransform(object):
             min(self._camera.imgHeight - 1, max(0, max(ys)))
         ]
 
+    def project_boxes(self, sizes, quaternions, centers):
+        # Batched version of initialize_box() and get_amodal_box_2d() for N
+        # boxes in the coordinate system V, given as sizes (LxWxH) with shape
+        # (N,3), quaternions with shape (N,4) and centers with shape (N,3).
+        # Returns the amodal 2D boxes [xmin, ymin, xmax, ymax] with shape
+        # (N,4), the vertices in V with shape (N,8,3) and the projected
+        # vertices with shape (N,8,2). The vertices are ordered like self.loc.
+        sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 3)
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        rotation_matrices = quaternions_to_rotation_matrices(quaternions)
+
+        # Vertices in V, see _update_box_points_3d()
+        center_vectors = BOX_VERTEX_SIGNS[np.newaxis] * (sizes[:, np.newaxis, :] / 2)
+        vertices = np.einsum("nij,nkj->nki", rotation_matrices, center_vectors)
+        vertices += centers[:, np.newaxis, :]
+
+        # Vertices in S
+        sensor_T_ISO_8855 = np.array(self._camera.sensor_T_ISO_8855, dtype=np.float64)
+        vertices_cam = np.matmul(vertices, sensor_T_ISO_8855[:, :3].T) + sensor_T_ISO_8855[:, 3]
+        vertices_cam = np.matmul(vertices_cam, get_K_multiplier().T)
+
+        K_matrix = get_projection_matrix(self._camera)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vertices_2d = np.matmul(vertices_cam, K_matrix.T)
+            vertices_2d = vertices_2d[..., :2] / vertices_2d[..., 2:]
+
+        # The cropped side polygons of _crop_side_polygon_and_project() consist
+        # of the vertices in front of the camera plane and of the points where
+        # the edges cross the plane. The crossing point is computed from the
+        # vertex behind the plane, as in the cropping of the side polygons.
+        camera_plane_z = 0.01
+        in_front = vertices_cam[..., 2] > camera_plane_z
+        first, second = BOX_EDGES[:, 0], BOX_EDGES[:, 1]
+        first_behind = ~in_front[:, first]
+        crossing = in_front[:, first] != in_front[:, second]
+        point = np.where(first_behind[..., np.newaxis], vertices_cam[:, first], vertices_cam[:, second])
+        neighbor = np.where(first_behind[..., np.newaxis], vertices_cam[:, second], vertices_cam[:, first])
+        delta = point - neighbor
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k = (camera_plane_z - point[..., 2]) / delta[..., 2]
+            crossing_points = point + k[..., np.newaxis] * delta
+
+            polygon_points = np.concatenate([vertices_cam, crossing_points], axis=1)
+            polygon_points = np.matmul(polygon_points, K_matrix.T)
+            polygon_points = polygon_points[..., :2] / polygon_points[..., 2:]
+        valid = np.concatenate([in_front, crossing], axis=1)[..., np.newaxis]
+
+        # if the whole box is behind the camera, the box is [0., 0., 0., 0.]
+        mins = np.where(valid, polygon_points, np.inf).min(axis=1)
+        maxs = np.where(valid, polygon_points, -np.inf).max(axis=1)
+        limits = np.array([self._camera.imgWidth - 1, self._camera.imgHeight - 1], dtype=np.float64)
+        amodal_boxes_2d = np.concatenate([
+            np.minimum(limits, np.maximum(0, mins)),
+            np.minimum(limits, np.maximum(0, maxs))
+        ], axis=1)
+        amodal_boxes_2d[~valid[..., 0].any(axis=1)] = 0.
+
+        return amodal_boxes_2d, vertices, vertices_2d
+
     def _crop_side_polygon_and_project(self, side_point_indices=[], side_points=[]):
         K_matrix = get_projection_matrix(self._camera)
         camera_plane_z = 0.01
@@ -12,6 +12,8 @@
 # For cityscapes image_id has form <city>_123456_123456 and corresponds to the prefix
 # of cityscapes image files.
 #
+# Use --num-workers to convert the images with several processes.
+#
 
 # python imports
 from __future__ import print_function, absolute_import, division, unicode_literals
@@ -20,6 +22,7 @@ import glob
 import sys
 import argparse
 import json
+import multiprocessing
 import numpy as np
 
 # Image processing
@@ -30,8 +33,87 @@ from cityscapesscripts.helpers.csHelpers import printError
 from cityscapesscripts.helpers.labels import id2label, labels
 
 
+# Convert a single *instanceIds.png file
+# Writes the panoptic PNG to the given folder and returns the image and annotation entries
+def convertSingleImage(f, panopticFolder, useTrainId):
+    originalFormat = np.array(Image.open(f))
+
+    fileName = os.path.basename(f)
+    imageId = fileName.replace("_gtFine_instanceIds.png", "")
+    inputFileName = fileName.replace("_instanceIds.png", "_leftImg8bit.png")
+    outputFileName = fileName.replace("_instanceIds.png", "_panoptic.png")
+    # image entry, id for image is its filename without extension
+    image = {"id": imageId,
+             "width": int(originalFormat.shape[1]),
+             "height": int(originalFormat.shape[0]),
+             "file_name": inputFileName}
+
+    # map every pixel to the index of its segment id
+    segmentIds, segmentIndex = np.unique(originalFormat, return_inverse=True)
+    segmentIndex = segmentIndex.reshape(originalFormat.shape)
+    nbSegments = len(segmentIds)
+
+    # segment area and bbox computation for all segments at once,
+    # based on the number of pixels of each segment per column and per row
+    height, width = originalFormat.shape
+    colCounts = np.bincount((segmentIndex * width + np.arange(width)).ravel(),
+                            minlength=nbSegments * width).reshape(nbSegments, width)
+    rowCounts = np.bincount((segmentIndex * height + np.arange(height)[:, np.newaxis]).ravel(),
+                            minlength=nbSegments * height).reshape(nbSegments, height)
+    areas = colCounts.sum(axis=1)
+    hasCol = colCounts > 0
+    hasRow = rowCounts > 0
+    xMin = np.argmax(hasCol, axis=1)
+    xMax = width - 1 - np.argmax(hasCol[:, ::-1], axis=1)
+    yMin = np.argmax(hasRow, axis=1)
+    yMax = height - 1 - np.argmax(hasRow[:, ::-1], axis=1)
+
+    # the panoptic color of each segment, ignored segments stay black
+    segmentColors = np.zeros((nbSegments, 3), dtype=np.uint8)
+
+    segmInfo = []
+    for index, segmentId in enumerate(segmentIds):
+        if segmentId < 1000:
+            semanticId = segmentId
+            isCrowd = 1
+        else:
+            semanticId = segmentId // 1000
+            isCrowd = 0
+        labelInfo = id2label[semanticId]
+        categoryId = labelInfo.trainId if useTrainId else labelInfo.id
+        if labelInfo.ignoreInEval:
+            continue
+        if not labelInfo.hasInstances:
+            isCrowd = 0
+
+        segmentColors[index] = [segmentId % 256, segmentId // 256, segmentId // 256 // 256]
+
+        bbox = [int(xMin[index]), int(yMin[index]),
+                int(xMax[index] - xMin[index] + 1), int(yMax[index] - yMin[index] + 1)]
+
+        segmInfo.append({"id": int(segmentId),
+                         "category_id": int(categoryId),
+                         "area": int(areas[index]),
+                         "bbox": bbox,
+                         "iscrowd": isCrowd})
+
+    annotation = {'image_id': imageId,
+                  'file_name': outputFileName,
+                  "segments_info": segmInfo}
+
+    pan_format = segmentColors[segmentIndex]
+    Image.fromarray(pan_format).save(os.path.join(panopticFolder, outputFileName))
+
+    return image, annotation
+
+
+# Pool worker wrapper around 'convertSingleImage'
+def convertSingleImageWorker(task):
+    return convertSingleImage(*task)
+
+
 # The main method
-def convert2panoptic(cityscapesPath=None, outputFolder=None, useTrainId=False, setNames=["val", "train", "test"]):
+def convert2panoptic(cityscapesPath=None, outputFolder=None, useTrainId=False, setNames=["val", "train", "test"], numWorkers=1):
     # Where to look for Cityscapes
     if cityscapesPath is None:
         if 'CITYSCAPES_DATASET' in os.environ:
@@ -43,6 +125,9 @@ def convert2panoptic(cityscapesPath=None, outputFolder=None, useTrainId=False, s
     if outputFolder is None:
         outputFolder = cityscapesPath
 
+    if not numWorkers:
+        numWorkers = multiprocessing.cpu_count()
+
     categories = []
     for label in labels:
         if label.ignoreInEval:
@@ -79,73 +164,30 @@ def convert2panoptic(cityscapesPath=None, outputFolder=None, useTrainId=False, s
             os.mkdir(panopticFolder)
         print("Corresponding segmentations in .png format will be saved in {}".format(panopticFolder))
 
+        tasks = [(f, panopticFolder, useTrainId) for f in files]
+        workers = min(numWorkers, len(files))
+        pool = None
+        if workers > 1:
+            # the entries are streamed back in file order, only the small
+            # json entries are kept in memory
+            pool = multiprocessing.Pool(processes=workers)
+            results = pool.imap(convertSingleImageWorker, tasks, chunksize=4)
+        else:
+            results = map(convertSingleImageWorker, tasks)
+
         images = []
         annotations = []
-        for progress, f in enumerate(files):
-
-            originalFormat = np.array(Image.open(f))
-
-            fileName = os.path.basename(f)
-            imageId = fileName.replace("_gtFine_instanceIds.png", "")
-            inputFileName = fileName.replace("_instanceIds.png", "_leftImg8bit.png")
-            outputFileName = fileName.replace("_instanceIds.png", "_panoptic.png")
-            # image entry, id for image is its filename without extension
-            images.append({"id": imageId,
-                           "width": int(originalFormat.shape[1]),
-                           "height": int(originalFormat.shape[0]),
-                           "file_name": inputFileName})
-
-            pan_format = np.zeros(
-                (originalFormat.shape[0], originalFormat.shape[1], 3), dtype=np.uint8
-            )
-
-            segmentIds = np.unique(originalFormat)
-            segmInfo = []
-            for segmentId in segmentIds:
-                if segmentId < 1000:
-                    semanticId = segmentId
-                    isCrowd = 1
-                else:
-                    semanticId = segmentId // 1000
-                    isCrowd = 0
-                labelInfo = id2label[semanticId]
-                categoryId = labelInfo.trainId if useTrainId else labelInfo.id
-                if labelInfo.ignoreInEval:
-                    continue
-                if not labelInfo.hasInstances:
-                    isCrowd = 0
-
-                mask = originalFormat == segmentId
-                color = [segmentId % 256, segmentId // 256, segmentId // 256 // 256]
-                pan_format[mask] = color
-
-                area = np.sum(mask) # segment area computation
-
-                # bbox computation for a segment
-                hor = np.sum(mask, axis=0)
-                hor_idx = np.nonzero(hor)[0]
-                x = hor_idx[0]
-                width = hor_idx[-1] - x + 1
-                vert = np.sum(mask, axis=1)
-                vert_idx = np.nonzero(vert)[0]
-                y = vert_idx[0]
-                height = vert_idx[-1] - y + 1
-                bbox = [int(x), int(y), int(width), int(height)]
-
-                segmInfo.append({"id": int(segmentId),
-                                 "category_id": int(categoryId),
-                                 "area": int(area),
-                                 "bbox": bbox,
-                                 "iscrowd": isCrowd})
-
-            annotations.append({'image_id': imageId,
-                                'file_name': outputFileName,
-                                "segments_info": segmInfo})
-
-            Image.fromarray(pan_format).save(os.path.join(panopticFolder, outputFileName))
-
-            print("\rProgress: {:>3.2f} %".format((progress + 1) * 100 / len(files)), end=' ')
-            sys.stdout.flush()
+        try:
+            for progress, (image, annotation) in enumerate(results):
+                images.append(image)
+                annotations.append(annotation)
+
+                print("\rProgress: {:>3.2f} %".format((progress + 1) * 100 / len(files)), end=' ')
+                sys.stdout.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         print("\nSaving the json file {}".format(outFile))
         d = {'images': images,
@@ -174,9 +216,14 @@ def main():
                         nargs='+',
                         default=["val", "train", "test"],
                         type=str)
+    parser.add_argument("--num-workers",
+                        dest="numWorkers",
+                        help="number of worker processes, 0 to use all CPUs",
+                        default=1,
+                        type=int)
     args = parser.parse_args()
 
-    convert2panoptic(args.cityscapesPath, args.outputFolder, args.useTrainId, args.setNames)
+    convert2panoptic(args.cityscapesPath, args.outputFolder, args.useTrainId, args.setNames, args.numWorkers)
 
 
 # call the main
@@ -15,6 +15,10 @@
 # Note however, that once you submit or evaluate results, the regular
 # IDs are needed.
 #
+# Use '--workers N' to convert the files with N processes. Files whose output
+# image is newer than the annotation are skipped, unless '--force' is given.
+# Files that fail to convert are reported at the end.
+#
 # Uses the converter tool in 'json2labelImg.py'
 # Uses the mapping defined in 'labels.py'
 #
@@ -22,13 +26,46 @@
 # python imports
 from __future__ import print_function, absolute_import, division
 import os, glob, sys
+import argparse
+import multiprocessing
+import traceback
 
 # cityscapes imports
 from cityscapesscripts.helpers.csHelpers import printError
 from cityscapesscripts.preparation.json2labelImg import json2labelImg
 
+# The output filename for the given annotation file
+def getOutputFile(f):
+    return f.replace( "_polygons.json" , "_labelTrainIds.png" )
+
+# Check if the output of the given annotation file is newer than the annotation itself
+def isUpToDate(f):
+    dst = getOutputFile(f)
+    return os.path.isfile(dst) and os.path.getmtime(dst) >= os.path.getmtime(f)
+
+# Convert a single annotation file
+# Returns the filename and None on success or an error message on failure,
+# such that a single broken file does not abort the whole batch
+def convertFile(f):
+    try:
+        json2labelImg( f , getOutputFile(f) , "trainIds" )
+    except (Exception, SystemExit):
+        return f, traceback.format_exc()
+    return f, None
+
 # The main method
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--workers",
+                        dest="workers",
+                        type=int,
+                        default=1,
+                        help="Number of worker processes used for the conversion. Defaults to 1, use 0 for all CPUs.")
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Convert all files, even if the output image is newer than the annotation file.")
+    args = parser.parse_args()
+
     # Where to look for Cityscapes
     if 'CITYSCAPES_DATASET' in os.environ:
         cityscapesPath = os.environ['CITYSCAPES_DATASET']
@@ -52,27 +89,54 @@ def main():
     if not files:
         printError( "Did not find any files. Please consult the README." )
 
+    # skip the files that are already converted
+    if not args.force:
+        nbFiles = len(files)
+        files = [ f for f in files if not isUpToDate(f) ]
+        if len(files) < nbFiles:
+            print("Skipping {} up-to-date files".format(nbFiles - len(files)))
+        if not files:
+            print("Nothing to do")
+            return
+
     # a bit verbose
     print("Processing {} annotation files".format(len(files)))
 
+    workers = args.workers if args.workers > 0 else multiprocessing.cpu_count()
+    workers = min(workers, len(files))
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        results = pool.imap_unordered(convertFile, files, chunksize=4)
+    else:
+        results = map(convertFile, files)
+
     # iterate through files
     progress = 0
+    failures = []
     print("Progress: {:>3} %".format( progress * 100 / len(files) ), end=' ')
-    for f in files:
-        # create the output filename
-        dst = f.replace( "_polygons.json" , "_labelTrainIds.png" )
-
-        # do the conversion
-        try:
-            json2labelImg( f , dst , "trainIds" )
-        except:
-            print("Failed to convert: {}".format(f))
-            raise
+    try:
+        for f, error in results:
+            if error is not None:
+                failures.append((f, error))
 
-        # status
-        progress += 1
-        print("\rProgress: {:>3} %".format( progress * 100 / len(files) ), end=' ')
-        sys.stdout.flush()
+            # status
+            progress += 1
+            print("\rProgress: {:>3} %".format( progress * 100 / len(files) ), end=' ')
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print("")
+
+    # report all failures at the end
+    if failures:
+        failures.sort()
+        for f, error in failures:
+            print("Failed to convert: {}".format(f))
+            print(error)
+        printError( "Failed to convert {} of {} files.".format(len(failures), len(files)) )
 
 
 # call the main
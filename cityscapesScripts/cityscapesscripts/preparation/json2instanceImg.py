@@ -110,7 +110,8 @@ def createInstanceImage(annotation, encoding):
     # loop over all objects
     for obj in annotation.objects:
         label   = obj.label
-        polygon = obj.polygon
+        # flat list of coordinates, avoids creating a point tuple per vertex
+        polygon = obj.points.ravel().tolist()
 
         # If the object is deleted, skip it
         if obj.deleted:
@@ -161,7 +162,7 @@ def createInstanceImage(annotation, encoding):
 #     - "ids"      : classes are encoded using the regular label IDs
 #     - "trainIds" : classes are encoded using the training IDs
 def json2instanceImg(inJson,outImg,encoding="ids"):
-    annotation = Annotation()
+    annotation = Annotation(compact=True)
     annotation.fromJsonFile(inJson)
     instanceImg = createInstanceImage( annotation , encoding )
     instanceImg.save( outImg )
@@ -8,7 +8,9 @@
 #   -h   print a little help text
 #   -t   use train IDs
 #
-# Can also be used by including as a module.
+# Can also be used by including as a module. Use 'json2labelImgs' to create
+# several encodings (e.g. ids, trainIds, color and instanceIds) of the same
+# annotation while parsing and rasterizing its polygons only once.
 #
 # Uses the mapping defined in 'labels.py'.
 #
@@ -18,8 +20,14 @@
 # python imports
 from __future__ import print_function, absolute_import, division
 import os, sys, getopt
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # Image processing
+import numpy as np
 from PIL import Image
 from PIL import ImageDraw
 
@@ -27,6 +35,9 @@ from PIL import ImageDraw
 from cityscapesscripts.helpers.annotation import Annotation
 from cityscapesscripts.helpers.labels     import name2label
 
+# The encodings that can be created by 'createLabelImages'
+labelImgEncodings = [ "ids" , "trainIds" , "color" , "instanceIds" , "instanceTrainIds" ]
+
 # Print the information
 def printHelp():
     print('{} [OPTIONS] inputJson outputImg'.format(os.path.basename(sys.argv[0])))
@@ -74,7 +85,8 @@ def createLabelImage(annotation, encoding, outline=None):
     # loop over all objects
     for obj in annotation.objects:
         label   = obj.label
-        polygon = obj.polygon
+        # flat list of coordinates, avoids creating a point tuple per vertex
+        polygon = obj.points.ravel().tolist()
 
         # If the object is deleted, skip it
         if obj.deleted:
@@ -118,11 +130,162 @@ def createLabelImage(annotation, encoding, outline=None):
 #     - "trainIds" : classes are encoded using the training IDs
 #     - "color"    : classes are encoded using the corresponding colors
 def json2labelImg(inJson,outImg,encoding="ids"):
-    annotation = Annotation()
+    annotation = Annotation(compact=True)
     annotation.fromJsonFile(inJson)
     labelImg   = createLabelImage( annotation , encoding )
     labelImg.save( outImg )
 
+# Rasterize all polygons of the given annotation into a single index image
+# Each pixel holds 1 + the index of the last polygon in drawing order that
+# covers it, or 0 for the background. Returns the index image as a numpy
+# array and the list of label tuples and group flags of the drawn polygons.
+def createIndexImage(annotation):
+    # the size of the image
+    size = ( annotation.imgWidth , annotation.imgHeight )
+
+    # this is the image that we want to create
+    indexImg = Image.new("I", size, 0)
+
+    # a drawer to draw into the image
+    drawer = ImageDraw.Draw( indexImg )
+
+    drawnLabels = []
+    # loop over all objects
+    for obj in annotation.objects:
+        label   = obj.label
+        # flat list of coordinates, avoids creating a point tuple per vertex
+        polygon = obj.points.ravel().tolist()
+
+        # If the object is deleted, skip it
+        if obj.deleted:
+            continue
+
+        # If the label is not known, but ends with a 'group' (e.g. cargroup)
+        # try to remove the s and see if that works
+        isGroup = False
+        if ( not label in name2label ) and label.endswith('group'):
+            label = label[:-len('group')]
+            isGroup = True
+
+        if not label in name2label:
+            printError( "Label '{}' not known.".format(label) )
+
+        # If the ID is negative that polygon should not be drawn
+        if name2label[label].id < 0:
+            continue
+
+        try:
+            drawer.polygon( polygon, fill=len(drawnLabels) + 1 )
+        except:
+            print("Failed to draw polygon with label {}".format(label))
+            raise
+        drawnLabels.append( ( name2label[label] , isGroup ) )
+
+    return np.asarray( indexImg ), drawnLabels
+
+# Create the lookup table that maps polygon indices to the values of the given encoding
+# The values match the ones of 'createLabelImage' and of 'createInstanceImage'
+# in 'json2instanceImg.py'
+def createEncodingLut(drawnLabels, encoding):
+    unlabeled = name2label['unlabeled']
+    if encoding in ( "ids" , "trainIds" ):
+        key = "id" if encoding == "ids" else "trainId"
+        values = [ getattr(unlabeled, key) ] + [ getattr(labelTuple, key) for labelTuple, _ in drawnLabels ]
+        return np.array( values , dtype=np.uint8 )
+    if encoding == "color":
+        values = [ unlabeled.color ] + [ labelTuple.color for labelTuple, _ in drawnLabels ]
+        lut = np.full( ( len(values) , 4 ) , 255 , dtype=np.uint8 )
+        lut[:, :3] = values
+        return lut
+    if encoding in ( "instanceIds" , "instanceTrainIds" ):
+        key = "id" if encoding == "instanceIds" else "trainId"
+        values = [ getattr(unlabeled, key) ]
+        # the number of instances that we already saw of each class
+        nbInstances = {}
+        for labelTuple, isGroup in drawnLabels:
+            id = getattr(labelTuple, key)
+            # if this label distinguishs between individual instances,
+            # make the id a instance ID
+            if labelTuple.hasInstances and not isGroup and id != 255:
+                instance = nbInstances.get(labelTuple.name, 0)
+                nbInstances[labelTuple.name] = instance + 1
+                id = id * 1000 + instance
+            values.append(id)
+        return np.array( values , dtype=np.int32 )
+    printError( "Unknown encoding '{}'".format(encoding) )
+
+# Convert the given annotation to label images of several encodings at once
+# The polygons are rasterized only once, the encodings are derived with lookup tables.
+# Returns a dictionary that maps each of the given encodings to its image.
+# Valid encodings are listed in 'labelImgEncodings'.
+def createLabelImages(annotation, encodings):
+    indexImg, drawnLabels = createIndexImage( annotation )
+
+    labelImgs = {}
+    for encoding in encodings:
+        encodedImg = createEncodingLut( drawnLabels , encoding )[indexImg]
+        if encoding == "color":
+            labelImgs[encoding] = Image.fromarray( encodedImg , "RGBA" )
+        elif encoding in ( "ids" , "trainIds" ):
+            labelImgs[encoding] = Image.fromarray( encodedImg , "L" )
+        else:
+            labelImgs[encoding] = Image.fromarray( encodedImg , "I" )
+    return labelImgs
+
+# Writes images in a background thread, such that the PNG encoding of one
+# frame overlaps with the rasterization of the next one.
+# At most 'maxPending' images are queued. Errors are raised in 'close'.
+class LabelImgWriter(object):
+    def __init__(self, maxPending=16):
+        self.queue  = queue.Queue( maxsize=maxPending )
+        self.errors = []
+        self.thread = threading.Thread( target=self.run )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            img, outImg = item
+            try:
+                img.save( outImg )
+            except Exception as e:
+                self.errors.append( ( outImg , e ) )
+
+    def save(self, img, outImg):
+        self.queue.put( ( img , outImg ) )
+
+    # Wait for all pending images to be written
+    def close(self):
+        self.queue.put( None )
+        self.thread.join()
+        if self.errors:
+            outImg, e = self.errors[0]
+            raise IOError( "Failed to write {} images, first {}: {}".format(len(self.errors), outImg, e) )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Create several label images from a single json file
+# inJson is the filename of the json file
+# outImgs is a dictionary that maps each encoding to the filename of the image
+# that is generated, see 'labelImgEncodings' for the valid encodings
+# writer is an optional 'LabelImgWriter' that saves the images in the background
+def json2labelImgs(inJson,outImgs,writer=None):
+    annotation = Annotation(compact=True)
+    annotation.fromJsonFile(inJson)
+    labelImgs  = createLabelImages( annotation , outImgs.keys() )
+    for encoding, outImg in outImgs.items():
+        if writer is not None:
+            writer.save( labelImgs[encoding] , outImg )
+        else:
+            labelImgs[encoding].save( outImg )
+
 # The main method, if you execute this script directly
 # Reads the command line arguments and calls the method 'json2labelImg'
 def main(argv):
@@ -15,6 +15,8 @@ import glob
 import os
 # copy things
 import copy
+# background loading of the neighbouring frames
+import threading
 # numpy
 import numpy as np
 # matplotlib for colormaps
@@ -38,7 +40,7 @@ from cityscapesscripts.helpers.labels_cityPersons import name2labelCp
 from cityscapesscripts.helpers.box3dImageTransform import Box3dImageTransform
 
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 LabelType = namedtuple('LabelType', 'description gtDir objectType')
 
 
@@ -57,6 +59,142 @@ class CsLabelType():
 
     DISPARITY = 7
 
+#################
+# Frame cache
+#################
+
+
+# Load an image, returns None if it cannot be read
+# QImage (unlike QPixmap) may be created outside of the GUI thread
+def loadImageFile(filename):
+    image = QtGui.QImage(filename)
+    if image.isNull():
+        return None
+    return image
+
+
+# Load the annotation of the given object type from a json file
+def loadAnnotationFile(filename, objectType):
+    annotation = Annotation(objectType, compact=True)
+    annotation.fromJsonFile(filename)
+    return annotation
+
+
+# Load a disparity map and convert it to a colored overlay
+def loadDisparityOverlay(filename, colortable):
+    dispNp = np.array(Image.open(filename))
+    dispNp = dispNp / 128.
+    dispNp = np.array(dispNp, dtype=np.uint8)
+
+    dispQt = QtGui.QImage(
+        dispNp.data, dispNp.shape[1], dispNp.shape[0], dispNp.strides[0], QtGui.QImage.Format_Indexed8)
+    dispQt.setColorTable(colortable)
+    # the conversion copies the data, the overlay does not reference dispNp afterwards
+    return dispQt.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+
+
+class FrameCache(object):
+    """LRU cache of decoded images, annotations and disparity overlays.
+
+    Entries are identified by a key, e.g. the kind of data and its filename,
+    and created by a loader function without arguments. A background thread
+    works off the loaders that were requested via prefetch, such that the
+    neighbouring frames are usually decoded before the user switches to them.
+    """
+
+    def __init__(self, maxSize):
+        # The maximal number of entries
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        # Requests (key, loader) of the background thread, the most urgent first
+        self.pending = []
+        # The key that the background thread is currently loading
+        self.loadingKey = None
+        self.hits = 0
+        self.misses = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.entries)
+
+    # The fraction of requests that were served from the cache
+    def hitRate(self):
+        with self.condition:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    def insert(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    # Return the entry of key, load it in this thread if it was not prefetched
+    # Exceptions of the loader are passed on to the caller
+    def get(self, key, loader):
+        with self.condition:
+            # wait for the background thread if it is busy with this entry
+            while self.loadingKey == key:
+                self.condition.wait()
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            self.pending = [r for r in self.pending if r[0] != key]
+
+        value = loader()
+        if value is not None:
+            with self.condition:
+                self.insert(key, value)
+        return value
+
+    # Replace the pending background requests by the given list of (key, loader)
+    def prefetch(self, requests):
+        with self.condition:
+            self.pending = [r for r in requests if r[0] not in self.entries]
+            # the prefetched entries must not evict each other
+            self.pending = self.pending[:max(self.maxSize - 1, 0)]
+            # keep the requested entries that are already cached from being evicted
+            for key, _ in requests:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.pending = []
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                key, loader = self.pending.pop(0)
+                self.loadingKey = key
+
+            try:
+                value = loader()
+            except Exception:
+                # errors are reported once the frame is actually shown
+                value = None
+
+            with self.condition:
+                if value is not None:
+                    self.insert(key, value)
+                self.loadingKey = None
+                self.condition.notify_all()
+
+
 #################
 # Main GUI class
 #################
@@ -152,9 +290,7 @@ class CityscapesViewer(QtWidgets.QMainWindow):
         self.enableDisparity = True
         # The filename of the disparity map we currently working on
         self.currentDispFile = ""
-        # The disparity image
-        self.dispImg = None
-        # As overlay
+        # The disparity map as colored overlay
         self.dispOverlay = None
         # The disparity search path
         self.dispPath = None
@@ -176,9 +312,22 @@ class CityscapesViewer(QtWidgets.QMainWindow):
             norm = matplotlib.colors.Normalize(vmin=3, vmax=100)
             cmap = matplotlib.cm.plasma
             self.colormap = matplotlib.cm.ScalarMappable(norm=norm, cmap=cmap)
+            self.dispColortable = []
+            for i in range(256):
+                color = self.colormap.to_rgba(i)
+                colorRgb = (int(color[0]*255),
+                            int(color[1]*255), int(color[2]*255))
+                self.dispColortable.append(QtGui.qRgb(*colorRgb))
         except Exception:
             self.enableDisparity = False
 
+        # The number of frames before and after the current one that are loaded in the background
+        self.prefetchFrames = 4
+        # The direction of the last image change, the frames in this direction are loaded first
+        self.prefetchDirection = 1
+        # Decoded images, annotations and disparities of the current and neighbouring frames
+        self.frameCache = FrameCache(3 * (2 * self.prefetchFrames + 1))
+
         # Default label
         self.defaultLabel = 'static'
         if self.defaultLabel not in name2label:
@@ -317,6 +466,9 @@ class CityscapesViewer(QtWidgets.QMainWindow):
         self.defaultStatusbar = 'Ready'
         # Create a statusbar. Init with default
         self.statusBar().showMessage(self.defaultStatusbar)
+        # The fill level and hit rate of the frame cache
+        self.cacheStatus = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.cacheStatus)
 
         # Enable mouse move events
         self.setMouseTracking(True)
@@ -345,6 +497,7 @@ class CityscapesViewer(QtWidgets.QMainWindow):
             return
         if self.idx > 0:
             self.idx -= 1
+            self.prefetchDirection = -1
             self.imageChanged()
         else:
             message = "Already at the first image"
@@ -361,6 +514,7 @@ class CityscapesViewer(QtWidgets.QMainWindow):
             return
         if self.idx < len(self.images)-1:
             self.idx += 1
+            self.prefetchDirection = 1
             self.imageChanged()
         elif self.playState:
             self.playState = False
@@ -457,6 +611,7 @@ class CityscapesViewer(QtWidgets.QMainWindow):
 
     # Close the application
     def closeEvent(self, event):
+        self.frameCache.stop()
         event.accept()
 
     #############################
@@ -470,6 +625,8 @@ class CityscapesViewer(QtWidgets.QMainWindow):
         self.loadLabels()
         # Load disparities if available
         self.loadDisparities()
+        # Decode the neighbouring frames in the background
+        self.prefetchNeighbours()
         # Update the object the mouse points to
         self.updateMouseObject()
         # Update the GUI
@@ -506,7 +663,8 @@ class CityscapesViewer(QtWidgets.QMainWindow):
             if not self.image.isNull() and filename == self.currentFile:
                 success = True
             else:
-                self.image = QtGui.QImage(filename)
+                image = self.frameCache.get(("image", filename), lambda: loadImageFile(filename))
+                self.image = image if image is not None else QtGui.QImage()
                 if self.image.isNull():
                     message = "Failed to read image: {0}".format(filename)
                 else:
@@ -540,10 +698,12 @@ class CityscapesViewer(QtWidgets.QMainWindow):
         # Clear the current labels first
         self.clearAnnotation()
 
+        objectType = self.labelTypes[self.gtType].objectType
         try:
-            self.annotation = Annotation(self.labelTypes[self.gtType].objectType)
-            self.annotation.fromJsonFile(filename)
+            self.annotation = self.frameCache.get(("labels", filename, objectType),
+                                                  lambda: loadAnnotationFile(filename, objectType))
         except IOError as e:
+            self.annotation = Annotation(objectType, compact=True)
             # This is the error if the file does not exist
             message = "Error parsing labels in {0}. Message: {1}".format(
                 filename, e.strerror)
@@ -568,45 +728,25 @@ class CityscapesViewer(QtWidgets.QMainWindow):
 
         filename = self.getDisparityFilename()
         if not filename:
-            self.dispImg = None
+            self.dispOverlay = None
             return
 
         # If we have everything and the filename did not change, then we are good
-        if self.dispImg and filename == self.currentDispFile:
+        if self.dispOverlay is not None and filename == self.currentDispFile:
             return
 
-        # Clear the current labels first
-        self.dispImg = None
+        # Clear the current disparities first
+        self.dispOverlay = None
 
         try:
-            self.dispImg = Image.open(filename)
+            self.dispOverlay = self.frameCache.get(("disparity", filename),
+                                                   lambda: loadDisparityOverlay(filename, self.dispColortable))
         except IOError as e:
             # This is the error if the file does not exist
             message = "Error parsing disparities in {0}. Message: {1}".format(
                 filename, e.strerror)
             self.statusBar().showMessage(message)
-            self.dispImg = None
-
-        if self.dispImg:
-            dispNp = np.array(self.dispImg)
-            dispNp = dispNp / 128.
-            dispNp.round()
-            dispNp = np.array(dispNp, dtype=np.uint8)
-
-            dispQt = QtGui.QImage(
-                dispNp.data, dispNp.shape[1], dispNp.shape[0], QtGui.QImage.Format_Indexed8)
-
-            colortable = []
-            for i in range(256):
-                color = self.colormap.to_rgba(i)
-                colorRgb = (int(color[0]*255),
-                            int(color[1]*255), int(color[2]*255))
-                colortable.append(QtGui.qRgb(*colorRgb))
-
-            dispQt.setColorTable(colortable)
-            dispQt = dispQt.convertToFormat(
-                QtGui.QImage.Format_ARGB32_Premultiplied)
-            self.dispOverlay = dispQt
+            self.dispOverlay = None
 
         # Remember the filename loaded
         self.currentDispFile = filename
@@ -617,6 +757,35 @@ class CityscapesViewer(QtWidgets.QMainWindow):
         # Restore the message
         self.statusBar().showMessage(restoreMessage)
 
+    # Request the images, labels and disparities of the neighbouring frames
+    # from the background loader, starting with the frames in the direction of
+    # the last image change
+    def prefetchNeighbours(self):
+        requests = []
+        if self.images:
+            offsets = [self.prefetchDirection * i for i in range(1, self.prefetchFrames + 1)]
+            offsets += [-o for o in offsets]
+            objectType = self.labelTypes[self.gtType].objectType if self.gtType in self.labelTypes else None
+            for offset in offsets:
+                idx = self.idx + offset
+                if idx < 0 or idx >= len(self.images):
+                    continue
+                imageFile = os.path.normpath(self.images[idx])
+                requests.append((("image", imageFile), lambda f=imageFile: loadImageFile(f)))
+                labelFile = self.getLabelFilename(imageFile)
+                if labelFile and objectType is not None:
+                    requests.append((("labels", labelFile, objectType),
+                                     lambda f=labelFile: loadAnnotationFile(f, objectType)))
+                if self.enableDisparity and self.gtType == CsLabelType.DISPARITY:
+                    dispFile = self.getDisparityFilename(imageFile)
+                    if dispFile:
+                        requests.append((("disparity", dispFile),
+                                         lambda f=dispFile: loadDisparityOverlay(f, self.dispColortable)))
+        self.frameCache.prefetch(requests)
+
+        self.cacheStatus.setText("Cache: {0}/{1} | hit rate {2:.0%}".format(
+            len(self.frameCache), self.frameCache.maxSize, self.frameCache.hitRate()))
+
     #############################
     # Drawing
     #############################
@@ -716,8 +885,8 @@ class CityscapesViewer(QtWidgets.QMainWindow):
 
     def getPolygon(self, obj):
         poly = QtGui.QPolygonF()
-        for pt in obj.polygon:
-            point = QtCore.QPointF(pt.x, pt.y)
+        for x, y in obj.points.tolist():
+            point = QtCore.QPointF(x, y)
             poly.append(point)
         return poly
 
@@ -1418,21 +1587,24 @@ class CityscapesViewer(QtWidgets.QMainWindow):
     def isLabelPathValid(self, labelPath):
         return os.path.isdir(labelPath)
 
-    # Get the filename where to load labels
+    # Get the filename where to load labels of the given image,
+    # defaults to the current image
     # Returns empty string if not possible
-    def getLabelFilename(self):
+    def getLabelFilename(self, imageFile=None):
+        if imageFile is None:
+            imageFile = self.currentFile
         # And we need to have a directory where labels should be searched
         if not self.labelPath:
             return ""
         # Without the name of the current images, there is also nothing we can do
-        if not self.currentFile:
+        if not imageFile:
             return ""
         # Check if the label directory is valid.
         if not self.isLabelPathValid(self.labelPath):
             return ""
 
         # Generate the filename of the label file
-        filename = os.path.basename(self.currentFile)
+        filename = os.path.basename(imageFile)
         filename = filename.replace(self.imageExt, self.gtExt)
         filename = os.path.join(self.labelPath, filename)
         search = glob.glob(filename)
@@ -1441,21 +1613,24 @@ class CityscapesViewer(QtWidgets.QMainWindow):
         filename = os.path.normpath(search[0])
         return filename
 
-    # Get the filename where to load disparities
+    # Get the filename where to load disparities of the given image,
+    # defaults to the current image
     # Returns empty string if not possible
-    def getDisparityFilename(self):
+    def getDisparityFilename(self, imageFile=None):
+        if imageFile is None:
+            imageFile = self.currentFile
         # And we need to have a directory where disparities should be searched
         if not self.dispPath:
             return ""
         # Without the name of the current images, there is also nothing we can do
-        if not self.currentFile:
+        if not imageFile:
             return ""
         # Check if the label directory is valid.
         if not os.path.isdir(self.dispPath):
             return ""
 
         # Generate the filename of the label file
-        filename = os.path.basename(self.currentFile)
+        filename = os.path.basename(imageFile)
         filename = filename.replace(self.imageExt, self.dispExt)
         filename = os.path.join(self.dispPath, filename)
         filename = os.path.normpath(filename)
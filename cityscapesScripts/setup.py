@@ -60,7 +60,8 @@ config = {
     'install_requires': ['numpy', 'matplotlib', 'pillow', 'appdirs', 'pyquaternion', 'coloredlogs', 'tqdm', 'typing'],
     'setup_requires': ['setuptools>=18.0'],
     'extras_require': {
-        'gui': ['PyQt5']
+        'gui': ['PyQt5'],
+        'fast': ['orjson']
     },
     'packages': find_packages(),
     'scripts': [],
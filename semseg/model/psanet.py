@@ -59,7 +59,9 @@ class PSA(nn.Module):
                 h = (h - 1) // self.shrink_factor + 1
                 w = (w - 1) // self.shrink_factor + 1
                 x = F.interpolate(x, size=(h, w), mode='bilinear', align_corners=True)
-            y = self.attention(x)
+            # the psa mask and the views below expect contiguous tensors, e.g. in channels last inference
+            x = x.contiguous()
+            y = self.attention(x).contiguous()
             if self.compact:
                 if self.psa_type == 1:
                     y = y.view(n, h * w, h * w).transpose(1, 2).view(n, h * w, h, w)
@@ -77,8 +79,11 @@ class PSA(nn.Module):
                 w = (w - 1) // self.shrink_factor + 1
                 x_col = F.interpolate(x_col, size=(h, w), mode='bilinear', align_corners=True)
                 x_dis = F.interpolate(x_dis, size=(h, w), mode='bilinear', align_corners=True)
-            y_col = self.attention(x_col)
-            y_dis = self.attention_p(x_dis)
+            # the psa mask and the views below expect contiguous tensors, e.g. in channels last inference
+            x_col = x_col.contiguous()
+            x_dis = x_dis.contiguous()
+            y_col = self.attention(x_col).contiguous()
+            y_dis = self.attention_p(x_dis).contiguous()
             if self.compact:
                 y_dis = y_dis.view(n, h * w, h * w).transpose(1, 2).view(n, h * w, h, w)
             else:
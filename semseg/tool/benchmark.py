@@ -0,0 +1,95 @@
+# Throughput of the sliding window inference of test.py/demo.py in images/sec,
+# for PSPNet and PSANet with ResNet50/101 on random weights and random images.
+# Usage: PYTHONPATH=./ python tool/benchmark.py --device cpu --threads 16 [--channels_last]
+
+import time
+import logging
+import argparse
+
+import numpy as np
+import torch
+
+from util.inference import SlidingWindowInference, model_to_device
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='PyTorch Semantic Segmentation Inference Benchmark')
+    parser.add_argument('--device', type=str, default='cpu', help='device to run the models on, e.g. cpu or cuda')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads of the cpu backend, 0 keeps the default')
+    parser.add_argument('--channels_last', action='store_true', help='run the models in channels last memory format')
+    parser.add_argument('--archs', type=str, nargs='+', default=['psp', 'psa'], help='architectures to benchmark')
+    parser.add_argument('--layers', type=int, nargs='+', default=[50, 101], help='backbone depths to benchmark')
+    parser.add_argument('--classes', type=int, default=19, help='number of classes')
+    parser.add_argument('--image_h', type=int, default=512, help='height of the test images')
+    parser.add_argument('--image_w', type=int, default=1024, help='width of the test images')
+    parser.add_argument('--base_size', type=int, default=1024, help='based size for scaling')
+    parser.add_argument('--crop', type=int, default=473, help='size of the sliding window crops')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0], help='evaluation scales')
+    parser.add_argument('--batch_size', type=int, default=4, help='crops per forward pass')
+    parser.add_argument('--images', type=int, default=5, help='number of timed images per model')
+    return parser.parse_args()
+
+
+def get_logger():
+    logger_name = "main-logger"
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler()
+    fmt = "[%(asctime)s %(levelname)s %(filename)s line %(lineno)d %(process)d] %(message)s"
+    handler.setFormatter(logging.Formatter(fmt))
+    logger.addHandler(handler)
+    return logger
+
+
+def build_model(arch, layers, classes, crop):
+    if arch == 'psp':
+        from model.pspnet import PSPNet
+        return PSPNet(layers=layers, classes=classes, zoom_factor=8, pretrained=False)
+    elif arch == 'psa':
+        from model.psanet import PSANet
+        # default psa settings of the configs, the mask size follows check() in test.py
+        shrink_factor = 2
+        mask_size = 2 * ((crop - 1) // (8 * shrink_factor) + 1) - 1
+        return PSANet(layers=layers, classes=classes, zoom_factor=8, compact=False, shrink_factor=shrink_factor,
+                      mask_h=mask_size, mask_w=mask_size, normalization_factor=1.0, psa_softmax=True, pretrained=False)
+    raise Exception('architecture {} not supported yet'.format(arch))
+
+
+def main():
+    args = get_parser()
+    logger = get_logger()
+    assert (args.crop - 1) % 8 == 0
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    logger.info(args)
+    logger.info("intra-op threads: {}".format(torch.get_num_threads()))
+
+    value_scale = 255
+    mean = [item * value_scale for item in [0.485, 0.456, 0.406]]
+    std = [item * value_scale for item in [0.229, 0.224, 0.225]]
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 256, (args.image_h, args.image_w, 3)).astype(np.float32) for _ in range(args.images)]
+
+    for arch in args.archs:
+        for layers in args.layers:
+            model = model_to_device(build_model(arch, layers, args.classes, args.crop), device, args.channels_last).eval()
+            inference = SlidingWindowInference(model, args.classes, args.crop, args.crop, mean, std, args.base_size,
+                                               args.scales, args.batch_size, channels_last=args.channels_last)
+            # warm up, e.g. for cudnn.benchmark and the allocator
+            inference(images[0])
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.time()
+            for image in images:
+                inference(image)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            duration = time.time() - start
+            logger.info('{}{}: {:.3f} images/sec ({:.2f} sec/image).'.format(
+                arch, layers, len(images) / duration, duration / len(images)))
+            del inference, model
+
+
+if __name__ == '__main__':
+    main()
@@ -5,13 +5,12 @@ import argparse
 import cv2
 import numpy as np
 import torch
-import torch.backends.cudnn as cudnn
-import torch.nn.functional as F
 import torch.nn.parallel
 import torch.utils.data
 
 from util import config
 from util.util import colorize
+from util.inference import SlidingWindowInference, model_to_device, load_model_state
 
 cv2.ocl.setUseOpenCL(False)
 
@@ -20,10 +19,16 @@ def get_parser():
     parser = argparse.ArgumentParser(description='PyTorch Semantic Segmentation')
     parser.add_argument('--config', type=str, default='config/ade20k/ade20k_pspnet50.yaml', help='config file')
     parser.add_argument('--image', type=str, default='figure/demo/ADE_val_00001515.jpg', help='input image')
+    parser.add_argument('--device', type=str, default='cuda', help='device to run the model on, e.g. cuda or cpu')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads of the cpu backend, 0 keeps the default')
+    parser.add_argument('--channels_last', action='store_true', help='run the model in channels last memory format')
     parser.add_argument('opts', help='see config/ade20k/ade20k_pspnet50.yaml for all options', default=None, nargs=argparse.REMAINDER)
     args = parser.parse_args()
     assert args.config is not None
     cfg = config.load_cfg_from_cfg_file(args.config)
+    cfg.device = args.device
+    cfg.threads = args.threads
+    cfg.channels_last = args.channels_last
     cfg.image = args.image
     if args.opts is not None:
         cfg = config.merge_cfg_from_list(cfg, args.opts)
@@ -70,7 +75,11 @@ def main():
     args = get_parser()
     check(args)
     logger = get_logger()
-    os.environ["CUDA_VISIBLE_DEVICES"] = ','.join(str(x) for x in args.test_gpu)
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        os.environ["CUDA_VISIBLE_DEVICES"] = ','.join(str(x) for x in args.test_gpu)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
     logger.info(args)
     logger.info("=> creating model ...")
     logger.info("Classes: {}".format(args.classes))
@@ -91,95 +100,22 @@ def main():
                        shrink_factor=args.shrink_factor, mask_h=args.mask_h, mask_w=args.mask_w,
                        normalization_factor=args.normalization_factor, psa_softmax=args.psa_softmax, pretrained=False)
     logger.info(model)
-    model = torch.nn.DataParallel(model).cuda()
-    cudnn.benchmark = True
+    model = model_to_device(model, device, args.channels_last)
     if os.path.isfile(args.model_path):
         logger.info("=> loading checkpoint '{}'".format(args.model_path))
-        checkpoint = torch.load(args.model_path)
-        model.load_state_dict(checkpoint['state_dict'], strict=False)
+        load_model_state(model, args.model_path, device)
         logger.info("=> loaded checkpoint '{}'".format(args.model_path))
     else:
         raise RuntimeError("=> no checkpoint found at '{}'".format(args.model_path))
-    test(model.eval(), args.image, args.classes, mean, std, args.base_size, args.test_h, args.test_w, args.scales, colors)
+    test(model.eval(), args.image, args.classes, mean, std, args.base_size, args.test_h, args.test_w, args.scales, args.batch_size_test, colors, args.channels_last)
 
 
-def net_process(model, image, mean, std=None, flip=True):
-    input = torch.from_numpy(image.transpose((2, 0, 1))).float()
-    if std is None:
-        for t, m in zip(input, mean):
-            t.sub_(m)
-    else:
-        for t, m, s in zip(input, mean, std):
-            t.sub_(m).div_(s)
-    input = input.unsqueeze(0).cuda()
-    if flip:
-        input = torch.cat([input, input.flip(3)], 0)
-    with torch.no_grad():
-        output = model(input)
-    _, _, h_i, w_i = input.shape
-    _, _, h_o, w_o = output.shape
-    if (h_o != h_i) or (w_o != w_i):
-        output = F.interpolate(output, (h_i, w_i), mode='bilinear', align_corners=True)
-    output = F.softmax(output, dim=1)
-    if flip:
-        output = (output[0] + output[1].flip(2)) / 2
-    else:
-        output = output[0]
-    output = output.data.cpu().numpy()
-    output = output.transpose(1, 2, 0)
-    return output
-
-
-def scale_process(model, image, classes, crop_h, crop_w, h, w, mean, std=None, stride_rate=2/3):
-    ori_h, ori_w, _ = image.shape
-    pad_h = max(crop_h - ori_h, 0)
-    pad_w = max(crop_w - ori_w, 0)
-    pad_h_half = int(pad_h / 2)
-    pad_w_half = int(pad_w / 2)
-    if pad_h > 0 or pad_w > 0:
-        image = cv2.copyMakeBorder(image, pad_h_half, pad_h - pad_h_half, pad_w_half, pad_w - pad_w_half, cv2.BORDER_CONSTANT, value=mean)
-    new_h, new_w, _ = image.shape
-    stride_h = int(np.ceil(crop_h*stride_rate))
-    stride_w = int(np.ceil(crop_w*stride_rate))
-    grid_h = int(np.ceil(float(new_h-crop_h)/stride_h) + 1)
-    grid_w = int(np.ceil(float(new_w-crop_w)/stride_w) + 1)
-    prediction_crop = np.zeros((new_h, new_w, classes), dtype=float)
-    count_crop = np.zeros((new_h, new_w), dtype=float)
-    for index_h in range(0, grid_h):
-        for index_w in range(0, grid_w):
-            s_h = index_h * stride_h
-            e_h = min(s_h + crop_h, new_h)
-            s_h = e_h - crop_h
-            s_w = index_w * stride_w
-            e_w = min(s_w + crop_w, new_w)
-            s_w = e_w - crop_w
-            image_crop = image[s_h:e_h, s_w:e_w].copy()
-            count_crop[s_h:e_h, s_w:e_w] += 1
-            prediction_crop[s_h:e_h, s_w:e_w, :] += net_process(model, image_crop, mean, std)
-    prediction_crop /= np.expand_dims(count_crop, 2)
-    prediction_crop = prediction_crop[pad_h_half:pad_h_half+ori_h, pad_w_half:pad_w_half+ori_w]
-    prediction = cv2.resize(prediction_crop, (w, h), interpolation=cv2.INTER_LINEAR)
-    return prediction
-
-
-def test(model, image_path, classes, mean, std, base_size, crop_h, crop_w, scales, colors):
+def test(model, image_path, classes, mean, std, base_size, crop_h, crop_w, scales, batch_size, colors, channels_last=False):
     image = cv2.imread(image_path, cv2.IMREAD_COLOR)  # BGR 3 channel ndarray wiht shape H * W * 3
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # convert cv2 read image from BGR order to RGB order
-    h, w, _ = image.shape
-    prediction = np.zeros((h, w, classes), dtype=float)
-    for scale in scales:
-        long_size = round(scale * base_size)
-        new_h = long_size
-        new_w = long_size
-        if h > w:
-            new_w = round(long_size/float(h)*w)
-        else:
-            new_h = round(long_size/float(w)*h)
-        image_scale = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-        prediction += scale_process(model, image_scale, classes, crop_h, crop_w, h, w, mean, std)
-    prediction = scale_process(model, image_scale, classes, crop_h, crop_w, h, w, mean, std)
-    prediction = np.argmax(prediction, axis=2)
-    gray = np.uint8(prediction)
+    inference = SlidingWindowInference(model, classes, crop_h, crop_w, mean, std, base_size, scales, batch_size,
+                                       channels_last=channels_last)
+    gray = inference(image)
     color = colorize(gray, colors)
     image_name = image_path.split('/')[-1].split('.')[0]
     gray_path = os.path.join('./figure/demo/', image_name + '_gray.png')
@@ -2,17 +2,18 @@ import os
 import time
 import logging
 import argparse
+import multiprocessing
+from functools import partial
 
 import cv2
 import numpy as np
 import torch
-import torch.backends.cudnn as cudnn
-import torch.nn.functional as F
 import torch.nn.parallel
 import torch.utils.data
 
 from util import dataset, transform, config
-from util.util import AverageMeter, intersectionAndUnion, check_makedirs, colorize
+from util.util import AverageMeter, PredictionWriter, confusionMatrix, intersectionAndUnionFromConfusion
+from util.inference import SlidingWindowInference, model_to_device, load_model_state
 
 cv2.ocl.setUseOpenCL(False)
 
@@ -20,10 +21,16 @@ cv2.ocl.setUseOpenCL(False)
 def get_parser():
     parser = argparse.ArgumentParser(description='PyTorch Semantic Segmentation')
     parser.add_argument('--config', type=str, default='config/ade20k/ade20k_pspnet50.yaml', help='config file')
+    parser.add_argument('--device', type=str, default='cuda', help='device to run the model on, e.g. cuda or cpu')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads of the cpu backend, 0 keeps the default')
+    parser.add_argument('--channels_last', action='store_true', help='run the model in channels last memory format')
     parser.add_argument('opts', help='see config/ade20k/ade20k_pspnet50.yaml for all options', default=None, nargs=argparse.REMAINDER)
     args = parser.parse_args()
     assert args.config is not None
     cfg = config.load_cfg_from_cfg_file(args.config)
+    cfg.device = args.device
+    cfg.threads = args.threads
+    cfg.channels_last = args.channels_last
     if args.opts is not None:
         cfg = config.merge_cfg_from_list(cfg, args.opts)
     return cfg
@@ -69,7 +76,11 @@ def main():
     args = get_parser()
     check(args)
     logger = get_logger()
-    os.environ["CUDA_VISIBLE_DEVICES"] = ','.join(str(x) for x in args.test_gpu)
+    device = torch.device(args.device)
+    if device.type == 'cuda':
+        os.environ["CUDA_VISIBLE_DEVICES"] = ','.join(str(x) for x in args.test_gpu)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
     logger.info(args)
     logger.info("=> creating model ...")
     logger.info("Classes: {}".format(args.classes))
@@ -91,10 +102,11 @@ def main():
     else:
         index_end = min(index_start + args.index_step, len(test_data.data_list))
     test_data.data_list = test_data.data_list[index_start:index_end]
-    test_loader = torch.utils.data.DataLoader(test_data, batch_size=1, shuffle=False, num_workers=args.workers, pin_memory=True)
+    test_loader = torch.utils.data.DataLoader(test_data, batch_size=1, shuffle=False, num_workers=args.workers, pin_memory=device.type == 'cuda')
     colors = np.loadtxt(args.colors_path).astype('uint8')
     names = [line.rstrip('\n') for line in open(args.names_path)]
 
+    confusion = None
     if not args.has_prediction:
         if args.arch == 'psp':
             from model.pspnet import PSPNet
@@ -105,145 +117,98 @@ def main():
                            shrink_factor=args.shrink_factor, mask_h=args.mask_h, mask_w=args.mask_w,
                            normalization_factor=args.normalization_factor, psa_softmax=args.psa_softmax, pretrained=False)
         logger.info(model)
-        model = torch.nn.DataParallel(model).cuda()
-        cudnn.benchmark = True
+        model = model_to_device(model, device, args.channels_last)
         if os.path.isfile(args.model_path):
             logger.info("=> loading checkpoint '{}'".format(args.model_path))
-            checkpoint = torch.load(args.model_path)
-            model.load_state_dict(checkpoint['state_dict'], strict=False)
+            load_model_state(model, args.model_path, device)
             logger.info("=> loaded checkpoint '{}'".format(args.model_path))
         else:
             raise RuntimeError("=> no checkpoint found at '{}'".format(args.model_path))
-        test(test_loader, test_data.data_list, model, args.classes, mean, std, args.base_size, args.test_h, args.test_w, args.scales, gray_folder, color_folder, colors)
+        confusion = test(test_loader, test_data.data_list, model, args.classes, mean, std, args.base_size, args.test_h, args.test_w, args.scales, args.batch_size_test, gray_folder, color_folder, colors, args.channels_last, args.split != 'test')
     if args.split != 'test':
-        cal_acc(test_data.data_list, gray_folder, args.classes, names)
+        if confusion is None:
+            confusion = cal_acc(test_data.data_list, gray_folder, args.classes, args.workers)
+        eval_result(confusion, args.classes, names)
 
 
-def net_process(model, image, mean, std=None, flip=True):
-    input = torch.from_numpy(image.transpose((2, 0, 1))).float()
-    if std is None:
-        for t, m in zip(input, mean):
-            t.sub_(m)
-    else:
-        for t, m, s in zip(input, mean, std):
-            t.sub_(m).div_(s)
-    input = input.unsqueeze(0).cuda()
-    if flip:
-        input = torch.cat([input, input.flip(3)], 0)
-    with torch.no_grad():
-        output = model(input)
-    _, _, h_i, w_i = input.shape
-    _, _, h_o, w_o = output.shape
-    if (h_o != h_i) or (w_o != w_i):
-        output = F.interpolate(output, (h_i, w_i), mode='bilinear', align_corners=True)
-    output = F.softmax(output, dim=1)
-    if flip:
-        output = (output[0] + output[1].flip(2)) / 2
-    else:
-        output = output[0]
-    output = output.data.cpu().numpy()
-    output = output.transpose(1, 2, 0)
-    return output
-
-
-def scale_process(model, image, classes, crop_h, crop_w, h, w, mean, std=None, stride_rate=2/3):
-    ori_h, ori_w, _ = image.shape
-    pad_h = max(crop_h - ori_h, 0)
-    pad_w = max(crop_w - ori_w, 0)
-    pad_h_half = int(pad_h / 2)
-    pad_w_half = int(pad_w / 2)
-    if pad_h > 0 or pad_w > 0:
-        image = cv2.copyMakeBorder(image, pad_h_half, pad_h - pad_h_half, pad_w_half, pad_w - pad_w_half, cv2.BORDER_CONSTANT, value=mean)
-    new_h, new_w, _ = image.shape
-    stride_h = int(np.ceil(crop_h*stride_rate))
-    stride_w = int(np.ceil(crop_w*stride_rate))
-    grid_h = int(np.ceil(float(new_h-crop_h)/stride_h) + 1)
-    grid_w = int(np.ceil(float(new_w-crop_w)/stride_w) + 1)
-    prediction_crop = np.zeros((new_h, new_w, classes), dtype=float)
-    count_crop = np.zeros((new_h, new_w), dtype=float)
-    for index_h in range(0, grid_h):
-        for index_w in range(0, grid_w):
-            s_h = index_h * stride_h
-            e_h = min(s_h + crop_h, new_h)
-            s_h = e_h - crop_h
-            s_w = index_w * stride_w
-            e_w = min(s_w + crop_w, new_w)
-            s_w = e_w - crop_w
-            image_crop = image[s_h:e_h, s_w:e_w].copy()
-            count_crop[s_h:e_h, s_w:e_w] += 1
-            prediction_crop[s_h:e_h, s_w:e_w, :] += net_process(model, image_crop, mean, std)
-    prediction_crop /= np.expand_dims(count_crop, 2)
-    prediction_crop = prediction_crop[pad_h_half:pad_h_half+ori_h, pad_w_half:pad_w_half+ori_w]
-    prediction = cv2.resize(prediction_crop, (w, h), interpolation=cv2.INTER_LINEAR)
-    return prediction
-
-
-def test(test_loader, data_list, model, classes, mean, std, base_size, crop_h, crop_w, scales, gray_folder, color_folder, colors):
+def test(test_loader, data_list, model, classes, mean, std, base_size, crop_h, crop_w, scales, batch_size, gray_folder, color_folder, colors, channels_last=False, evaluate=False):
     logger.info('>>>>>>>>>>>>>>>> Start Evaluation >>>>>>>>>>>>>>>>')
     data_time = AverageMeter()
-    batch_time = AverageMeter()
+    compute_time = AverageMeter()
+    wait_time = AverageMeter()
     model.eval()
+    inference = SlidingWindowInference(model, classes, crop_h, crop_w, mean, std, base_size, scales, batch_size,
+                                       channels_last=channels_last)
+    # png encoding runs in the background, only a full queue stalls the loop
+    writer = PredictionWriter(gray_folder, color_folder, colors)
+    # the predictions are evaluated as they are produced, instead of reading them back afterwards
+    confusion = np.zeros((classes, classes), dtype=np.int64)
+    start = time.time()
     end = time.time()
-    for i, (input, _) in enumerate(test_loader):
+    for i, (input, target) in enumerate(test_loader):
         data_time.update(time.time() - end)
+        end = time.time()
         input = np.squeeze(input.numpy(), axis=0)
         image = np.transpose(input, (1, 2, 0))
-        h, w, _ = image.shape
-        prediction = np.zeros((h, w, classes), dtype=float)
-        for scale in scales:
-            long_size = round(scale * base_size)
-            new_h = long_size
-            new_w = long_size
-            if h > w:
-                new_w = round(long_size/float(h)*w)
-            else:
-                new_h = round(long_size/float(w)*h)
-            image_scale = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-            prediction += scale_process(model, image_scale, classes, crop_h, crop_w, h, w, mean, std)
-        prediction /= len(scales)
-        prediction = np.argmax(prediction, axis=2)
-        batch_time.update(time.time() - end)
+        prediction = inference(image)
+        if evaluate:
+            confusion += confusionMatrix(prediction, np.squeeze(target.numpy(), axis=0), classes)
+        compute_time.update(time.time() - end)
         end = time.time()
+        image_path, _ = data_list[i]
+        image_name = image_path.split('/')[-1].split('.')[0]
+        writer.put(image_name, prediction)
+        wait_time.update(time.time() - end)
         if ((i + 1) % 10 == 0) or (i + 1 == len(test_loader)):
             logger.info('Test: [{}/{}] '
                         'Data {data_time.val:.3f} ({data_time.avg:.3f}) '
-                        'Batch {batch_time.val:.3f} ({batch_time.avg:.3f}).'.format(i + 1, len(test_loader),
-                                                                                    data_time=data_time,
-                                                                                    batch_time=batch_time))
-        check_makedirs(gray_folder)
-        check_makedirs(color_folder)
-        gray = np.uint8(prediction)
-        color = colorize(gray, colors)
-        image_path, _ = data_list[i]
-        image_name = image_path.split('/')[-1].split('.')[0]
-        gray_path = os.path.join(gray_folder, image_name + '.png')
-        color_path = os.path.join(color_folder, image_name + '.png')
-        cv2.imwrite(gray_path, gray)
-        color.save(color_path)
+                        'Compute {compute_time.val:.3f} ({compute_time.avg:.3f}) '
+                        'Write {write_time.avg:.3f} (wait {wait_time.avg:.3f}).'.format(i + 1, len(test_loader),
+                                                                                      data_time=data_time,
+                                                                                      compute_time=compute_time,
+                                                                                      write_time=writer.write_time,
+                                                                                      wait_time=wait_time))
+        end = time.time()
+    writer.close()
+    logger.info('Data {:.1f}s, compute {:.1f}s, write {:.1f}s in background ({:.1f}s waited), total {:.1f}s.'.format(
+        data_time.sum, compute_time.sum, writer.write_time.sum, wait_time.sum, time.time() - start))
     logger.info('<<<<<<<<<<<<<<<<< End Evaluation <<<<<<<<<<<<<<<<<')
-
-
-def cal_acc(data_list, pred_folder, classes, names):
-    intersection_meter = AverageMeter()
-    union_meter = AverageMeter()
-    target_meter = AverageMeter()
-
-    for i, (image_path, target_path) in enumerate(data_list):
-        image_name = image_path.split('/')[-1].split('.')[0]
-        pred = cv2.imread(os.path.join(pred_folder, image_name+'.png'), cv2.IMREAD_GRAYSCALE)
-        target = cv2.imread(target_path, cv2.IMREAD_GRAYSCALE)
-        intersection, union, target = intersectionAndUnion(pred, target, classes)
-        intersection_meter.update(intersection)
-        union_meter.update(union)
-        target_meter.update(target)
-        accuracy = sum(intersection_meter.val) / (sum(target_meter.val) + 1e-10)
-        logger.info('Evaluating {0}/{1} on image {2}, accuracy {3:.4f}.'.format(i + 1, len(data_list), image_name+'.png', accuracy))
-
-    iou_class = intersection_meter.sum / (union_meter.sum + 1e-10)
-    accuracy_class = intersection_meter.sum / (target_meter.sum + 1e-10)
+    return confusion if evaluate else None
+
+
+def image_confusion(paths, pred_folder, classes):
+    image_path, target_path = paths
+    image_name = image_path.split('/')[-1].split('.')[0]
+    pred = cv2.imread(os.path.join(pred_folder, image_name+'.png'), cv2.IMREAD_GRAYSCALE)
+    target = cv2.imread(target_path, cv2.IMREAD_GRAYSCALE)
+    return confusionMatrix(pred, target, classes)
+
+
+def cal_acc(data_list, pred_folder, classes, workers=1):
+    # evaluates an existing prediction folder, the images are split across processes
+    logger.info('Evaluating {} predictions in {}.'.format(len(data_list), pred_folder))
+    confusion = np.zeros((classes, classes), dtype=np.int64)
+    process = partial(image_confusion, pred_folder=pred_folder, classes=classes)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    results = pool.imap(process, data_list, chunksize=8) if pool is not None else map(process, data_list)
+    for i, image_confusion_matrix in enumerate(results):
+        confusion += image_confusion_matrix
+        if ((i + 1) % 100 == 0) or (i + 1 == len(data_list)):
+            accuracy = np.trace(confusion) / (confusion.sum() + 1e-10)
+            logger.info('Evaluating {0}/{1}, accuracy {2:.4f}.'.format(i + 1, len(data_list), accuracy))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return confusion
+
+
+def eval_result(confusion, classes, names):
+    intersection, union, target = intersectionAndUnionFromConfusion(confusion)
+    iou_class = intersection / (union + 1e-10)
+    accuracy_class = intersection / (target + 1e-10)
     mIoU = np.mean(iou_class)
     mAcc = np.mean(accuracy_class)
-    allAcc = sum(intersection_meter.sum) / (sum(target_meter.sum) + 1e-10)
+    allAcc = sum(intersection) / (sum(target) + 1e-10)
 
     logger.info('Eval result: mIoU/mAcc/allAcc {:.4f}/{:.4f}/{:.4f}.'.format(mIoU, mAcc, allAcc))
     for i in range(classes):
@@ -1,5 +1,8 @@
 import os
 import os.path
+import fcntl
+import hashlib
+import contextlib
 import cv2
 import numpy as np
 
@@ -49,23 +52,126 @@ def make_dataset(split='train', data_root=None, data_list=None):
     return image_label_list
 
 
+class DecodedCache(object):
+    """LRU cache of decoded image & label pairs, shared by all processes that use the same cache_dir.
+
+    Every sample is stored as H * W * 4 uint8 .npy file (RGB and label) and read back memory-mapped,
+    on a tmpfs like /dev/shm the samples stay in shared memory across epochs and DataLoader workers.
+    The total size is kept below size_mb by removing the least recently used samples.
+    """
+    def __init__(self, cache_dir, size_mb):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(size_mb * 1024 * 1024)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.lock_path = os.path.join(cache_dir, 'lock')
+        self.size_path = os.path.join(cache_dir, 'size')
+
+    def cache_path(self, image_path, label_path):
+        # the key changes with the source files, stale samples are evicted over time
+        key = [image_path, label_path]
+        for path in (image_path, label_path):
+            stat = os.stat(path)
+            key += [str(stat.st_mtime_ns), str(stat.st_size)]
+        return os.path.join(self.cache_dir, hashlib.sha1('|'.join(key).encode()).hexdigest() + '.npy')
+
+    def get(self, path):
+        try:
+            sample = np.load(path, mmap_mode='r')
+            # the modification time is the recency of the LRU eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            # not cached or removed by another process
+            return None
+        return np.array(sample[:, :, :3]), np.array(sample[:, :, 3])
+
+    def put(self, path, image, label):
+        sample = np.concatenate([image, label[:, :, np.newaxis]], axis=2)
+        if sample.nbytes >= self.max_bytes:
+            return
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, sample)
+        size = os.path.getsize(tmp_path)
+        with self.locked():
+            if os.path.isfile(path):
+                os.remove(tmp_path)
+                return
+            total = self.read_size() + size
+            if total > self.max_bytes:
+                total = self.shrink(self.max_bytes - size) + size
+            os.replace(tmp_path, path)
+            self.write_size(total)
+
+    @contextlib.contextmanager
+    def locked(self):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read_size(self):
+        try:
+            with open(self.size_path, 'r') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return self.shrink(self.max_bytes)
+
+    def write_size(self, total):
+        with open(self.size_path, 'w') as f:
+            f.write(str(total))
+
+    def shrink(self, max_bytes):
+        # removes the least recently used samples until at most max_bytes remain, returns the remaining size
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+        return total
+
+
 class SemData(Dataset):
-    def __init__(self, split='train', data_root=None, data_list=None, transform=None):
+    def __init__(self, split='train', data_root=None, data_list=None, transform=None, cache_dir=None, cache_size=0):
         self.split = split
         self.data_list = make_dataset(split, data_root, data_list)
         self.transform = transform
+        # optional cache of the decoded samples, cache_size in MB
+        self.cache = DecodedCache(cache_dir, cache_size) if cache_dir and cache_size > 0 else None
 
     def __len__(self):
         return len(self.data_list)
 
-    def __getitem__(self, index):
-        image_path, label_path = self.data_list[index]
+    def load(self, image_path, label_path):
         image = cv2.imread(image_path, cv2.IMREAD_COLOR)  # BGR 3 channel ndarray wiht shape H * W * 3
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # convert cv2 read image from BGR order to RGB order
-        image = np.float32(image)
         label = cv2.imread(label_path, cv2.IMREAD_GRAYSCALE)  # GRAY 1 channel ndarray with shape H * W
         if image.shape[0] != label.shape[0] or image.shape[1] != label.shape[1]:
             raise (RuntimeError("Image & label shape mismatch: " + image_path + " " + label_path + "\n"))
+        return image, label
+
+    def __getitem__(self, index):
+        image_path, label_path = self.data_list[index]
+        sample = None
+        if self.cache is not None:
+            cache_path = self.cache.cache_path(image_path, label_path)
+            sample = self.cache.get(cache_path)
+        if sample is not None:
+            image, label = sample
+        else:
+            image, label = self.load(image_path, label_path)
+            if self.cache is not None:
+                self.cache.put(cache_path, image, label)
+        # the image stays uint8 during the augmentation, ToTensor converts it to float
         if self.transform is not None:
             image, label = self.transform(image, label)
         return image, label
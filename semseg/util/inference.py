@@ -0,0 +1,162 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import torch
+import torch.backends.cudnn as cudnn
+import torch.nn.functional as F
+
+# torch.inference_mode is available from pytorch 1.9 on
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+def model_to_device(model, device, channels_last=False):
+    # DataParallel on gpus, the bare model on other devices
+    device = torch.device(device)
+    if device.type == 'cuda':
+        model = torch.nn.DataParallel(model).cuda()
+        cudnn.benchmark = True
+    else:
+        model = model.to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def load_model_state(model, model_path, device):
+    checkpoint = torch.load(model_path, map_location=torch.device(device))
+    state_dict = checkpoint['state_dict']
+    if not isinstance(model, torch.nn.DataParallel):
+        # checkpoints are saved from DataParallel models
+        state_dict = OrderedDict((k[len('module.'):] if k.startswith('module.') else k, v) for k, v in state_dict.items())
+    model.load_state_dict(state_dict, strict=False)
+
+
+def crop_grid(new_h, new_w, crop_h, crop_w, stride_rate=2/3):
+    # top left corners of the sliding window crops, the last crop of a row/column ends at the border
+    stride_h = int(np.ceil(crop_h*stride_rate))
+    stride_w = int(np.ceil(crop_w*stride_rate))
+    grid_h = int(np.ceil(float(new_h-crop_h)/stride_h) + 1)
+    grid_w = int(np.ceil(float(new_w-crop_w)/stride_w) + 1)
+    grid = []
+    for index_h in range(0, grid_h):
+        for index_w in range(0, grid_w):
+            s_h = min(index_h * stride_h + crop_h, new_h) - crop_h
+            s_w = min(index_w * stride_w + crop_w, new_w) - crop_w
+            grid.append((s_h, s_w))
+    return grid
+
+
+class SlidingWindowInference(object):
+    """Multi-scale sliding window inference of a segmentation model.
+
+    The crops of all scales are run through the model in batches of batch_size crops
+    (twice as many images with flipping). Class probabilities are accumulated on the
+    device of the model, only the final label map is transferred back.
+    """
+    def __init__(self, model, classes, crop_h, crop_w, mean, std=None, base_size=512, scales=(1.0,), batch_size=1,
+                 stride_rate=2/3, flip=True, device=None, channels_last=False):
+        self.model = model
+        self.classes = classes
+        self.crop_h = crop_h
+        self.crop_w = crop_w
+        self.mean = mean
+        self.base_size = base_size
+        self.scales = scales
+        self.batch_size = batch_size
+        self.stride_rate = stride_rate
+        self.flip = flip
+        self.channels_last = channels_last
+        if device is None:
+            device = next(model.parameters()).device
+        self.device = torch.device(device)
+        self.mean_tensor = torch.tensor(mean, dtype=torch.float32, device=self.device).view(-1, 1, 1)
+        self.std_tensor = None if std is None else torch.tensor(std, dtype=torch.float32, device=self.device).view(-1, 1, 1)
+
+    def scale_size(self, h, w, scale):
+        long_size = round(scale * self.base_size)
+        new_h = long_size
+        new_w = long_size
+        if h > w:
+            new_w = round(long_size/float(h)*w)
+        else:
+            new_h = round(long_size/float(w)*h)
+        return new_h, new_w
+
+    def prepare_scale(self, image, new_h, new_w):
+        # resized, padded to at least the crop size and normalized image on the device
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        pad_h = max(self.crop_h - new_h, 0)
+        pad_w = max(self.crop_w - new_w, 0)
+        pad_h_half = int(pad_h / 2)
+        pad_w_half = int(pad_w / 2)
+        if pad_h > 0 or pad_w > 0:
+            image = cv2.copyMakeBorder(image, pad_h_half, pad_h - pad_h_half, pad_w_half, pad_w - pad_w_half,
+                                       cv2.BORDER_CONSTANT, value=self.mean)
+        input = torch.from_numpy(image.transpose((2, 0, 1))).to(self.device).float()
+        input -= self.mean_tensor
+        if self.std_tensor is not None:
+            input /= self.std_tensor
+        return input, pad_h_half, pad_w_half
+
+    def forward(self, input):
+        n = input.shape[0]
+        if self.flip:
+            input = torch.cat([input, input.flip(3)], 0)
+        output = self.model(input)
+        _, _, h_i, w_i = input.shape
+        _, _, h_o, w_o = output.shape
+        if (h_o != h_i) or (w_o != w_i):
+            output = F.interpolate(output, (h_i, w_i), mode='bilinear', align_corners=True)
+        output = F.softmax(output, dim=1)
+        if self.flip:
+            output = (output[:n] + output[n:].flip(3)) / 2
+        return output
+
+    def __call__(self, image):
+        # image: H * W * 3 RGB ndarray, returns the H * W uint8 label map
+        with inference_mode():
+            return self.predict(image)
+
+    def predict(self, image):
+        h, w, _ = image.shape
+        states = []
+        jobs = []
+        for k, scale in enumerate(self.scales):
+            new_h, new_w = self.scale_size(h, w, scale)
+            grid = crop_grid(max(new_h, self.crop_h), max(new_w, self.crop_w), self.crop_h, self.crop_w, self.stride_rate)
+            states.append(dict(size=(new_h, new_w), remaining=len(grid), input=None))
+            jobs += [(k, s_h, s_w) for s_h, s_w in grid]
+
+        prediction = torch.zeros((self.classes, h, w), dtype=torch.float32, device=self.device)
+        for start in range(0, len(jobs), self.batch_size):
+            batch = jobs[start:start + self.batch_size]
+            crops = []
+            for k, s_h, s_w in batch:
+                state = states[k]
+                # the scaled images are created when needed and released once all their crops are done
+                if state['input'] is None:
+                    state['input'], state['pad_h'], state['pad_w'] = self.prepare_scale(image, *state['size'])
+                    _, pad_h, pad_w = state['input'].shape
+                    state['prediction'] = torch.zeros((self.classes, pad_h, pad_w), dtype=torch.float32, device=self.device)
+                    state['count'] = torch.zeros((1, pad_h, pad_w), dtype=torch.float32, device=self.device)
+                crops.append(state['input'][:, s_h:s_h + self.crop_h, s_w:s_w + self.crop_w])
+            input = torch.stack(crops, 0)
+            if self.channels_last:
+                input = input.contiguous(memory_format=torch.channels_last)
+            output = self.forward(input)
+            for (k, s_h, s_w), output_crop in zip(batch, output):
+                state = states[k]
+                state['prediction'][:, s_h:s_h + self.crop_h, s_w:s_w + self.crop_w] += output_crop
+                state['count'][:, s_h:s_h + self.crop_h, s_w:s_w + self.crop_w] += 1
+                state['remaining'] -= 1
+                if state['remaining'] == 0:
+                    prediction += self.finish_scale(state, h, w)
+                    states[k] = None
+        return prediction.argmax(0).to(torch.uint8).cpu().numpy()
+
+    def finish_scale(self, state, h, w):
+        new_h, new_w = state['size']
+        prediction = state['prediction'] / state['count']
+        prediction = prediction[:, state['pad_h']:state['pad_h'] + new_h, state['pad_w']:state['pad_w'] + new_w]
+        return F.interpolate(prediction.unsqueeze(0), (h, w), mode='bilinear', align_corners=False)[0]
@@ -20,7 +20,7 @@ class Compose(object):
 
 
 class ToTensor(object):
-    # Converts numpy.ndarray (H x W x C) to a torch.FloatTensor of shape (C x H x W).
+    # Converts numpy.ndarray (H x W x C), e.g. uint8, to a torch.FloatTensor of shape (C x H x W).
     def __call__(self, image, label):
         if not isinstance(image, np.ndarray) or not isinstance(label, np.ndarray):
             raise (RuntimeError("segtransform.ToTensor() only handle np.ndarray"
@@ -1,4 +1,8 @@
 import os
+import time
+import queue
+import threading
+import cv2
 import numpy as np
 from PIL import Image
 
@@ -52,6 +56,24 @@ def intersectionAndUnion(output, target, K, ignore_index=255):
     return area_intersection, area_union, area_target
 
 
+def confusionMatrix(output, target, K, ignore_index=255):
+    # 'K' classes, output and target of the same shape, each value in range 0 to K - 1.
+    # Returns the K * K pixel counts of target (rows) and output (columns) in a single bincount.
+    assert output.shape == target.shape
+    output = output.reshape(output.size)
+    target = target.reshape(target.size)
+    valid = (target != ignore_index) & (target < K)
+    return np.bincount(target[valid].astype(np.int64) * K + output[valid], minlength=K * K).reshape(K, K)
+
+
+def intersectionAndUnionFromConfusion(confusion):
+    # area_intersection, area_union, area_target as in intersectionAndUnion, summed over the images of confusion
+    area_intersection = np.diag(confusion)
+    area_target = confusion.sum(axis=1)
+    area_union = confusion.sum(axis=0) + area_target - area_intersection
+    return area_intersection, area_union, area_target
+
+
 def intersectionAndUnionGPU(output, target, K, ignore_index=255):
     # 'K' classes, output and target sizes are N or N * L or N * H * W, each value in range 0 to K - 1.
     assert (output.dim() in [1, 2, 3])
@@ -158,6 +180,60 @@ def colorize(gray, palette):
     return color
 
 
+class PredictionWriter(object):
+    """Writes gray and colorized predictions as png in background threads
+
+    put() blocks while max_pending predictions wait to be written, close() waits for
+    all of them. The palette is converted once and attached to the gray image as is,
+    so colorization does not touch the pixels.
+    """
+    def __init__(self, gray_folder, color_folder, palette, workers=2, max_pending=8):
+        check_makedirs(gray_folder)
+        check_makedirs(color_folder)
+        self.gray_folder = gray_folder
+        self.color_folder = color_folder
+        self.palette = np.asarray(palette, dtype=np.uint8).tobytes()
+        self.write_time = AverageMeter()
+        self.error = None
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, name, gray):
+        if self.error is not None:
+            raise self.error
+        self.jobs.put((name, gray))
+
+    def write(self, name, gray):
+        cv2.imwrite(os.path.join(self.gray_folder, name + '.png'), gray)
+        color = Image.fromarray(gray)
+        color.putpalette(self.palette)
+        color.save(os.path.join(self.color_folder, name + '.png'))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            start = time.time()
+            try:
+                self.write(*job)
+            except Exception as e:
+                self.error = e
+            with self.lock:
+                self.write_time.update(time.time() - start)
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+
 def find_free_port():
     import socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)